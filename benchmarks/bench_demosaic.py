@@ -0,0 +1,89 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Benchmark the DNG demosaic-and-bin kernel against the previous implementation.
+
+Usage:
+    python -m benchmarks.bench_demosaic
+"""
+
+import time
+
+import numpy as np
+
+from snowimagerpro.core.methods import helper
+from snowimagerpro.core.methods.image_loading import demosaic_and_bin
+
+SHAPE = (3040, 4056)  # 12 MP, Raspberry Pi HQ camera
+WHITE_LEVEL = 4095
+REPEAT = 5
+
+
+def previous_load_dng(raw_image, shrink, white_level):
+    """Array part of `load_dng` before the fused kernel."""
+
+    raw_image = raw_image.copy()
+
+    image = np.zeros(
+        (raw_image.shape[0] // 2, raw_image.shape[1] // 2) + (3,), dtype=np.uint16
+    )
+
+    image[:, :, 0] = raw_image[1::2, 0::2]  # red channel
+    image[:, :, 1] = (
+        raw_image[0::2, 0::2] // 2 + raw_image[1::2, 1::2] // 2
+    )  # green channel
+    image[:, :, 2] = raw_image[0::2, 1::2]  # blue channel
+
+    image = helper.bin_ndarray(
+        image, (image.shape[0] // shrink, image.shape[1] // shrink, 3), operation="mean"
+    )
+
+    return image / white_level
+
+
+def timeit(func, *args):
+    best = np.inf
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        out = func(*args)
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+def main():
+    rng = np.random.default_rng(0)
+    raw_image = rng.integers(0, WHITE_LEVEL + 1, SHAPE, dtype=np.uint16)
+
+    print(f"synthetic mosaic {SHAPE[1]} x {SHAPE[0]} px, best of {REPEAT}")
+    print(f"{'shrink':>6} {'previous':>10} {'fused':>10} {'speed-up':>9} {'max diff':>10}")
+
+    for shrink in [1, 2, 4]:
+        t_prev, prev = timeit(previous_load_dng, raw_image, shrink, WHITE_LEVEL)
+        t_new, new = timeit(demosaic_and_bin, raw_image, shrink, WHITE_LEVEL)
+
+        # previous version rounds each green site down before averaging
+        diff = np.abs(prev - new).max()
+
+        print(
+            f"{shrink:>6} {t_prev * 1e3:>8.1f}ms {t_new * 1e3:>8.1f}ms "
+            f"{t_prev / t_new:>8.1f}x {diff:>10.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
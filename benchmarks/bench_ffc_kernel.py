@@ -0,0 +1,146 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Throughput of the flat-field correction and reflectance calibration.
+
+Corrects a stack of float32 frames sharing dark and reference with
+`Image.do_ffc` + `Image.do_refl_cal` (one frame at a time, as `ImageSet.ffc`
+and `ImageSet.refl_cal`) and with the fused in-place kernel, and compares
+the throughput with a plain copy of the stack, the limit set by the memory
+bandwidth. Checks that both give the same result.
+
+Usage:
+    python -m benchmarks.bench_ffc_kernel [n_frames] [height] [width]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from snowimagerpro.core.metadata import DEFAULT_ROI
+from snowimagerpro.core.methods.correction import (
+    GRAY,
+    WHITE,
+    correction_frame,
+    ffc_refl_cal,
+)
+from snowimagerpro.core.methods.processing import rel2pix
+from snowimagerpro.core.processing import Image
+
+
+class _Meta:
+    ID = 0
+    wavelength = 940.0
+    ROI = DEFAULT_ROI
+
+
+def scene(shape):
+    """Snow with the gray and white targets in the default ROIs."""
+
+    reflectance = np.full(shape, 0.7, dtype=np.float32)
+    for rois, value in zip(DEFAULT_ROI, [GRAY, WHITE]):
+        for roi in rois:
+            (x0, y0), (x1, y1) = rel2pix(roi, [shape[1], shape[0]])
+            reflectance[y0:y1, x0:x1] = value
+    return reflectance
+
+
+def frames(n, shape):
+    rng = np.random.default_rng(0)
+    dark = rng.normal(0.06, 0.002, shape).astype(np.float32)
+    ref = (dark + 0.7 + rng.normal(0, 0.002, shape)).astype(np.float32)
+    reflectance = scene(shape)
+
+    stack = np.empty((n,) + shape, dtype=np.float32)
+    for i in range(n):
+        exposure = rng.uniform(0.6, 1.2)
+        stack[i] = dark + exposure * reflectance * (ref - dark)
+        stack[i] += rng.normal(0, 0.002, shape).astype(np.float32)
+
+    return stack, dark, ref
+
+
+def best_of(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 960
+    width = int(sys.argv[3]) if len(sys.argv) > 3 else 1280
+
+    stack, dark, ref = frames(n, (height, width, 3))
+    ref_dark = dark
+    gb = stack.nbytes / 1e9
+
+    # reference: one Image at a time, as ImageSet.ffc and ImageSet.refl_cal
+    def _images():
+        corr = correction_frame(ref, ref_dark)
+
+        out = []
+        for frame in stack:
+            img = Image()
+            img._meta = _Meta()
+            img._data = frame
+            img.do_ffc(dark, corr)
+            img.do_refl_cal()
+            out.append(img._data)
+        return out
+
+    expected = np.stack(_images())
+    t_images = best_of(_images)
+
+    work = np.empty_like(stack)
+    t_copy = best_of(lambda: np.copyto(work, stack))
+
+    rois = [DEFAULT_ROI] * n
+    results = {}
+    for workers in [1, 4]:
+
+        def _fused():
+            np.copyto(work, stack)
+            corr = correction_frame(ref, ref_dark)
+            ffc_refl_cal(work, dark, corr, rois, workers=workers)
+
+        # the copy restoring the input is timed separately and subtracted
+        results[workers] = best_of(_fused) - t_copy
+
+    diff = np.abs(work - expected).max()
+
+    print(f"{n} frames of {height}x{width}x3 float32, {gb:.2f} GB")
+    print(f"  copy (read + write):   {t_copy:.3f} s, {2 * gb / t_copy:5.1f} GB/s")
+    print(f"  do_ffc + do_refl_cal:  {t_images:.3f} s, {2 * gb / t_images:5.1f} GB/s")
+    for workers, t in results.items():
+        print(
+            f"  fused, {workers} worker(s):    {t:.3f} s, {2 * gb / t:5.1f} GB/s, "
+            f"{t_images / t:.1f}x faster"
+        )
+    print(f"  max difference: {diff:.2e}")
+
+    assert diff < 1e-4
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
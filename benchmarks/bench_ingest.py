@@ -0,0 +1,133 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Adding a field day of raw frames to an image database.
+
+Writes a folder tree of .bay frames (sparse files of the size of sensor mode
+4, with distinct content) with their sidecars, half of which is already in
+the database, plus copies of some frames. Times scanning and ingesting the
+tree with a new and with a filled metadata index, and checks that the
+metadata is taken from the sidecars and the duplicates are skipped.
+
+Usage:
+    python -m benchmarks.bench_ingest [n_images]
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from snowimagerpro.core.metadata import ImageMetadata
+from snowimagerpro.core.methods.image_loading import BAYER_MODES
+from snowimagerpro.core.methods.ingest import ingest, scan
+from snowimagerpro.core.methods.metadata_index import MetadataIndex
+
+MODE = 4
+FRAMES_PER_SERIES = 10
+
+
+def write_field_day(folder, n):
+    (rows, stride), _, _ = BAYER_MODES[MODE]
+    rng = np.random.default_rng(0)
+
+    files = []
+    for i in range(n):
+        series = i // FRAMES_PER_SERIES
+        directory = Path(folder) / f"pit_{series % 4}"
+        directory.mkdir(exist_ok=True)
+
+        fp = directory / f"s{series:03d}-{i:05d}.bay"
+        with open(fp, "wb") as f:
+            f.write(rng.integers(0, 256, 4096, dtype=np.uint8).tobytes())
+            f.truncate(rows * stride)
+        files.append(fp)
+
+        if i % FRAMES_PER_SERIES == 0:
+            sidecar = {
+                "metadata": {
+                    "device": "snowimager-01",
+                    "timestamp": "2025-02-14T10:00:00",
+                    "timezone": "UTC",
+                    "software_version": "1.0",
+                    "wavelength": 940 if series % 2 else 1300,
+                    "location": f"pit_{series % 4}",
+                    "img_type": "ref" if series % 5 == 0 else "ngr",
+                }
+            }
+            with open(directory / f"s{series:03d}_metadata.yaml", "w") as f:
+                yaml.safe_dump(sidecar, f)
+
+    # frames copied to a second folder
+    copies = Path(folder) / "copies"
+    copies.mkdir()
+    for fp in files[:: max(n // 20, 1)]:
+        shutil.copy(fp, copies / fp.name)
+        shutil.copy(
+            fp.parent / (fp.name.split("-")[0] + "_metadata.yaml"),
+            copies / (fp.name.split("-")[0] + "_metadata.yaml"),
+        )
+
+    image_db = {
+        i + 1: ImageMetadata(ID=i + 1, filepath=fp) for i, fp in enumerate(files[::2])
+    }
+
+    return files, image_db
+
+
+def main():
+    n_images = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files, image_db = write_field_day(tmp, n_images)
+        index = MetadataIndex(Path(tmp) / "db.csv.meta.sqlite")
+
+        for run in ["new index", "filled index"]:
+            t = time.perf_counter()
+            found = scan(tmp)
+            t_scan = time.perf_counter() - t
+
+            t = time.perf_counter()
+            result = ingest(found, image_db=image_db, index=index)
+            t_ingest = time.perf_counter() - t
+
+            print(
+                f"{run:>13}: {len(found)} files, scan {t_scan:.2f} s, "
+                f"ingest {t_ingest:.2f} s, {len(result['entries'])} new, "
+                f"{len(result['duplicates'])} duplicates"
+            )
+
+        entries = result["entries"]
+        assert len(entries) == n_images - len(image_db)
+        assert not result["invalid"]
+        assert {meta.date for meta in entries} == {"2025-02-14"}
+        assert {meta.location for meta in entries} <= {f"pit_{i}" for i in range(4)}
+        assert {meta.wavelength for meta in entries} == {940.0, 1300.0}
+        assert "ref" in {meta.img_type for meta in entries}
+
+        index.close()
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
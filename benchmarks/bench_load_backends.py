@@ -0,0 +1,104 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Speed-up of the "thread" and "process" loading backends of `ImageSet`.
+
+Writes synthetic packed Bayer (.bay) frames to a temporary folder and loads
+them with both backends and 1 to N workers. The worker processes are started
+before timing, as the application keeps them alive between loads.
+
+Usage:
+    python -m benchmarks.bench_load_backends [n_images] [max_workers]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from snowimagerpro.core.metadata import ImageMetadata
+from snowimagerpro.core.methods.image_loading import BAYER_MODES
+from snowimagerpro.core.processing import ImageSet
+
+MODE = 6  # 2592 x 4608, camera v3
+
+
+def write_frames(folder, n):
+    (rows, stride), _, _ = BAYER_MODES[MODE]
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, rows * stride, dtype=np.uint8)
+
+    image_db = {}
+    for i in range(n):
+        fp = Path(folder) / f"top-{i:04d}.bay"
+        np.roll(frame, i).tofile(fp)
+        image_db[i + 1] = ImageMetadata(ID=i + 1, filepath=fp.name, wavelength=940.0)
+
+    return image_db
+
+
+def time_load(image_set, ids, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        t = time.perf_counter()
+        image_set.load_images(ids)
+        best = min(best, time.perf_counter() - t)
+
+    return best
+
+
+def main():
+    n_images = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_db = write_frames(tmp, n_images)
+        ids = list(image_db)
+
+        print(f"{n_images} .bay frames (mode {MODE}), {os.cpu_count()} cores")
+        print(f"{'workers':>8} {'thread [s]':>11} {'process [s]':>12} "
+              f"{'thread x':>9} {'process x':>10}")
+
+        baseline = None
+        for workers in range(1, max_workers + 1):
+            times = {}
+            for backend in ["thread", "process"]:
+                image_set = ImageSet(load_backend=backend, load_workers=workers)
+                image_set._image_db = image_db
+                image_set._data_dir = tmp
+
+                image_set.load_images(ids[:workers])  # start the workers
+                times[backend] = time_load(image_set, ids)
+
+                image_set._selected_images = {}
+                image_set._shared_frames.release()
+                image_set.shutdown_workers()
+
+            if baseline is None:
+                baseline = times["thread"]
+
+            print(f"{workers:>8} {times['thread']:>11.2f} {times['process']:>12.2f} "
+                  f"{baseline / times['thread']:>9.2f} "
+                  f"{baseline / times['process']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Memory of the processing stages of an image set.
+
+Runs ffc, reflectance calibration and undistortion on a synthetic set of
+measurement frames (plus dark and reference) with each stage policy, and
+prints the peak resident bytes reported per stage and the peak of all
+allocations (tracemalloc).
+
+Usage (from the repository root, the calibration files are looked up there):
+    python -m benchmarks.bench_stage_memory [n_frames]
+"""
+
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+from snowimagerpro.core.metadata import DEFAULT_ROI, ImageMetadata
+from snowimagerpro.core.processing import Image, ImageSet
+
+SHAPE = (480, 720, 3)
+
+
+def synthetic_set(n_frames, policy):
+    rng = np.random.default_rng(0)
+    dark = rng.normal(0.06, 0.002, SHAPE)
+    ref = dark + 0.7
+
+    refl = np.full(SHAPE[:2], 0.4)
+    for target, level in zip(DEFAULT_ROI, [0.498, 0.94]):
+        for (x0, y0), (x1, y1) in target:
+            refl[
+                int(y0 * SHAPE[0]) : int(y1 * SHAPE[0]),
+                int(x0 * SHAPE[1]) : int(x1 * SHAPE[1]),
+            ] = level
+    measurement = dark + refl[:, :, None] * (ref - dark)
+
+    entries = [("ref", 940.0, ref), ("ngr", 0.0, dark)]
+    entries += [("ngr", 940.0, measurement)] * n_frames
+
+    image_set = ImageSet(dtype=np.float32)
+    image_set.stages.policy = policy
+    image_set._image_db = {}
+    image_set._selected_images = {}
+
+    for i, (img_type, wavelength, data) in enumerate(entries):
+        meta = ImageMetadata(
+            ID=i + 1,
+            filepath=Path(f"top-{i:04d}.dng"),
+            img_type=img_type,
+            wavelength=wavelength,
+        )
+        image_set._image_db[meta.ID] = meta
+
+        img = Image(dtype=np.float32)
+        img._meta = meta
+        img._data = data.astype(np.float32)  # every frame its own array
+        img._exif = {"Image BodySerialNumber": "snowimager-06", "metadata": {}}
+        image_set._selected_images[meta.ID] = img
+
+    image_set.generate_link_table()
+
+    return image_set
+
+
+def main():
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+
+    for policy in ["keep", "release", "spill"]:
+        image_set = synthetic_set(n_frames, policy)
+
+        tracemalloc.start()
+        t = time.perf_counter()
+        image_set.ffc()
+        image_set.refl_cal()
+        image_set.undistort(None)
+        dt = time.perf_counter() - t
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stages = ", ".join(
+            f"{name} {nbytes / 2**20:.0f}"
+            for name, nbytes in image_set.report_stages().items()
+        )
+        print(
+            f"{policy:>7}: {dt:.2f} s, peak allocated {peak / 2**20:.0f} MB, "
+            f"resident by stage (MB): {stages}"
+        )
+
+        image_set.close()
+
+
+if __name__ == "__main__":
+    main()
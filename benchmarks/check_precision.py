@@ -0,0 +1,149 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Compare the stitched h5 output of the float32 and float64 processing.
+
+Runs ffc, reflectance calibration, undistortion and stitching on a synthetic
+image set with both precisions and checks that the saved images (uint16,
+1023 = 100% reflectance) differ by at most `MAX_DIFF` counts.
+
+Usage (from the repository root, the calibration files are looked up there):
+    python -m benchmarks.check_precision
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from snowimagerpro.core.metadata import DEFAULT_ROI, ImageMetadata
+from snowimagerpro.core.processing import Image, ImageSet
+
+SHAPE = (720, 1080, 3)
+MAX_DIFF = 1  # counts of the 10-bit output
+
+
+def synthetic_set(dtype, seed=0):
+    """Dark, reference and two overlapping measurement images.
+
+    The measurement images show a textured scene with gray (49.8%) and
+    white (94%) targets inside the default ROIs, as used by the reflectance
+    calibration.
+    """
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0 : SHAPE[0], 0 : SHAPE[1]] / SHAPE[1]
+    vignetting = (1 - 0.3 * ((x - 0.7) ** 2 + (y - 0.35) ** 2))[:, :, None]
+
+    dark = rng.normal(0.06, 0.002, SHAPE)
+    ref = dark + 0.7 * vignetting + rng.normal(0, 0.002, SHAPE)
+
+    def measurement(shift):
+        refl = 0.4 + 0.1 * np.sin(40 * (x + shift)) * np.cos(30 * y)
+        for target, level in zip(DEFAULT_ROI, [0.498, 0.94]):
+            for (x0, y0), (x1, y1) in target:
+                refl[
+                    int(y0 * SHAPE[0]) : int(y1 * SHAPE[0]),
+                    int(x0 * SHAPE[1]) : int(x1 * SHAPE[1]),
+                ] = level
+        # arbitrary exposure, recovered by the reflectance calibration
+        signal = 1.3 * refl[:, :, None] * (ref - dark)
+        return dark + signal + rng.normal(0, 0.002, SHAPE)
+
+    entries = [
+        ("ref", 940.0, [0.0, 0.0], ref),
+        ("ngr", 0.0, [0.0, 0.0], dark),
+        ("ngr", 940.0, [0.0, 0.0], measurement(0.0)),
+        ("ngr", 940.0, [0.0, 60.0], measurement(0.05)),
+    ]
+
+    image_set = ImageSet(dtype=dtype)
+    image_set._image_db = {}
+    image_set._selected_images = {}
+
+    for i, (img_type, wavelength, coords_mm, data) in enumerate(entries):
+        meta = ImageMetadata(
+            ID=i + 1,
+            filepath=Path(f"top-{i:04d}.dng"),
+            img_type=img_type,
+            wavelength=wavelength,
+            coords_mm=coords_mm,
+            px_2_mm=0.1,
+        )
+        image_set._image_db[meta.ID] = meta
+
+        img = Image(dtype=dtype)
+        img._meta = meta
+        img._data = data.astype(dtype)
+        img._exif = {"Image BodySerialNumber": "snowimager-06", "metadata": {}}
+        image_set._selected_images[meta.ID] = img
+
+    image_set.generate_link_table()
+
+    return image_set
+
+
+def run(dtype, folder):
+    image_set = synthetic_set(dtype)
+
+    t = time.perf_counter()
+    image_set.ffc()
+    image_set.refl_cal()
+    image_set.undistort(None)
+    image_set.stitching()
+    dt = time.perf_counter() - t
+
+    fn = image_set.save_as_h5(folder=folder)
+
+    with h5py.File(fn, "r") as f:
+        image = f["SnowImage(s)"]["ngr"]["image"][()]
+
+    stages = ["imgs_post_ffc", "imgs_post_refl_cal", "imgs_post_undistort"]
+    dtypes = {
+        stage: {img._data.dtype.name for img in getattr(image_set, stage).values()}
+        for stage in stages
+    }
+
+    return image.astype(np.int32), dt, dtypes
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        out_64, t_64, _ = run(np.float64, Path(tmp) / "float64")
+        out_32, t_32, dtypes = run(np.float32, Path(tmp) / "float32")
+
+    diff = np.abs(out_64 - out_32)
+
+    print(f"stage dtypes (float32 policy): {dtypes}")
+    print(f"processing time: float64 {t_64:.2f}s, float32 {t_32:.2f}s")
+    print(f"stitched image {out_32.shape}, max diff {diff.max()} counts, "
+          f"{np.count_nonzero(diff)} pixels differ")
+
+    if diff.max() > MAX_DIFF:
+        print(f"FAILED: difference exceeds {MAX_DIFF} counts")
+        return 1
+
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
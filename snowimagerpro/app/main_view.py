@@ -84,6 +84,11 @@ class MainView(QMainWindow):
                 logging.getLogger(logger).info(f"Closing views in {name}:")
                 logic.close_views()
 
+        # Write the journaled db edits into the db, stop loader processes
+        public_data.img_set.close()
+        if public_data.catalog is not None:
+            public_data.catalog.close()
+
         # Save user config
         user_config.set("initial_tab", self.ui.toolBox.currentIndex())
         user_config.save()
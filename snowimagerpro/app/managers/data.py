@@ -18,12 +18,19 @@
 
 import os
 import logging
+from functools import partial
 from send2trash import send2trash
 from typing import Any, Union, overload
 
 from snowimagerpro.app._core import Image, ImageSet, ImageForAnalysis
 from snowimagerpro.core.methods import helper
+from snowimagerpro.core.methods.catalog import Catalog
+from snowimagerpro.core.methods.correction_cache import CorrectionCache
+from snowimagerpro.core.methods.preview_cache import PreviewCache
+from .jobs import threadpool
+from .paths import data_dir
 from .settings import user_config
+from snowimagerpro.app.workers.run_func import ImageProcessor
 
 from snowimagerpro.app.popups import show_warning
 
@@ -58,6 +65,12 @@ class PublicDataModel:
         self.sortby = "date"
         self.uuids_selected: list[str] = []
 
+        ## Downsampled previews of raw images, shared by db explorer and inspector
+        self.preview_cache: PreviewCache | None = None
+
+        ## Index of the entries of all raw image databases
+        self.catalog: Catalog | None = None
+
         ## Processed reflectance image for post-processing (SSA and density calculation)
         self.processed_image_dbs = processed_image_dbs
         self.processed_images_db: dict[str, str] = {} ## NO NEED FOR PUBLIC ACCESS
@@ -79,9 +92,37 @@ class PublicDataModel:
             self.widget_models[name] = Model(self)
 
     def initialize(self) -> None:
+        ## preview cache (created here as the user config is loaded by now)
+        self.preview_cache = PreviewCache(
+            os.path.join(data_dir, "previews"),
+            budget=int(user_config.get("explorer.preview_cache_mb")) * 2**20,
+        )
+
+        ## decoding of the selected images ("thread" or "process", 0 workers = all cores)
+        self.img_set.load_backend = user_config.get("processor.load_backend")
+        self.img_set.load_workers = int(user_config.get("processor.load_workers")) or None
+
+        ## superseded processing stages: "keep" (to show them), "release" or "spill"
+        self.img_set.stages.policy = user_config.get("processor.stage_policy")
+
+        ## correction frames of the ffc, reused across runs; average all darks of a group
+        self.img_set.correction_cache = CorrectionCache(
+            os.path.join(data_dir, "corrections"),
+            budget=int(user_config.get("processor.correction_cache_mb")) * 2**20,
+        )
+        self.img_set.master_dark = bool(user_config.get("processor.master_dark"))
+
         ## raw_image database
         self.raw_image_dbs.initialize(user_config.get("raw_image_dbs"))
 
+        ## catalog of the raw image databases (indexed on the first query)
+        self.catalog = Catalog(os.path.join(data_dir, "catalog.sqlite"))
+        self.catalog.register(
+            [item.info["path"] for item in self.raw_image_dbs.items.items()]
+        )
+        self.raw_image_dbs.catalog = self.catalog
+        self.img_set.catalog = self.catalog
+
         if self.raw_image_dbs:
             uuid = self.raw_image_dbs.current
             self.raw_image_dbs.current = uuid  # TODO: Why double?
@@ -135,14 +176,45 @@ class PublicDataModel:
             self.widget_models["db_combo"].change_selected_db(idx)
             self.raw_image_dbs.current = uuid
             self.img_set.load_db(db_path=db_path, data_dir=data_dir)
+
+            bad_rows = getattr(self.img_set._image_db, "bad_rows", [])
+            if bad_rows:
+                lines = ", ".join(str(line) for line, _ in bad_rows[:20])
+                show_warning(
+                    None,
+                    "Warning",
+                    f"{len(bad_rows)} rows of {db_path} could not be read and "
+                    f"were skipped (lines {lines}), see the log for details.",
+                )
+
             self.widget_models["image_list"].refresh()
             self.widget_models["image_tree"].refresh()
 
+            self._warm_dbs(idx)
+
             user_config.set("raw_image_dbs_last", idx)
             self.raw_image_dbs._update.emit()
 
         return True
 
+
+    def _warm_dbs(self, idx):
+        """Load the databases next to the selected one through the catalog in
+        the background, so selecting one of them (`ImageSet.load_db`) takes it
+        from the catalog instead of reading the file."""
+
+        dbs = self.raw_image_dbs
+        paths = [
+            dbs.items[dbs.idx_2_uuid(n)].info["path"]
+            for n in (idx + 1, idx - 1)
+            if 0 <= n < len(dbs)
+        ]
+        paths = [path for path in paths if os.path.exists(path)]
+
+        if paths:
+            worker = ImageProcessor([partial(self.catalog.load, p) for p in paths])
+            threadpool.start(worker)
+
     def sort_by_changed(self, index):
         self.sortby = self.widget_models["sortby_list"].sort_keys[index]
         self.widget_models["image_tree"].refresh()
@@ -187,7 +259,10 @@ class PublicDataModel:
             return uuids
 
         self.uuids_selected = []
-        selected_uuids = get_uuids_from_subtree(index)
+        if hasattr(index.model(), "uuids"):  # also in groups not expanded yet
+            selected_uuids = index.model().uuids(index)
+        else:
+            selected_uuids = get_uuids_from_subtree(index)
         self.uuids_selected.extend(selected_uuids)
 
     def change_databases(self):
@@ -218,6 +293,7 @@ class Databases:
         self.items = BetterDict(attrs=["uuid", "info"])
         self.current: str | None = None  ## TODO: Turn into namedtuple
         self.current_idx: int | None = 0  ##
+        self.catalog: Catalog | None = None
 
     def __len__(self) -> int:
         return len(self.items)
@@ -241,6 +317,8 @@ class Databases:
                 print(f"Adding database {fp} with uuid {uuid}")
 
                 self.items[str(uuid)] = {"path": fp, "data_dir": data_dir}
+                if self.catalog is not None:
+                    self.catalog.register([fp])
                 self.current = str(uuid)
                 self.current_idx = self.uuid_2_idx(uuid)
 
@@ -255,6 +333,9 @@ class Databases:
         print(f"Removing database with UUID: {uuid}")
         print(f"from shared data: {self.items.keys()}")
 
+        if self.catalog is not None and uuid in self.items:
+            self.catalog.unregister([self.items[uuid].info["path"]])
+
         if delete_from_disk:
             fp = self.items[uuid].info["path"]
             if os.path.exists(fp):
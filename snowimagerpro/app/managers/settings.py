@@ -47,8 +47,17 @@ class UserConfig(ConfigManager):
         "inspector.defaultDirs": [os.path.expanduser("~")],
         "explorer.db_path": os.path.expanduser("~"),
         "explorer.autosave": False,
+        "explorer.preview_cache_mb": 1024,
+        "explorer.image_cache_mb": 1024,
+        "explorer.prefetch_neighbours": 2,
         "processor.overlap_x": 100,
         "processor.overlap_y": 100,
+        "processor.load_backend": "thread",
+        "processor.load_workers": 0,
+        "processor.stage_policy": "keep",
+        "processor.master_dark": False,
+        "processor.stream_in_flight": 8,
+        "processor.correction_cache_mb": 512,
         "processor.h5_path": os.path.expanduser("~"),
         "analyzer.db_path": os.path.expanduser("~"),
         "analyzer.data_dir": os.path.expanduser("~"),
@@ -16,6 +16,7 @@
 # this program. If not, see <https://www.gnu.org/licenses/>.
 #
 
+import inspect
 import shutil
 from pathlib import Path
 
@@ -23,11 +24,11 @@ from snowimagerpro.app.managers import user_config
 from snowimagerpro.app.managers.data import raw_image_dbs
 from snowimagerpro.app.managers.jobs import threadpool
 from snowimagerpro.app.workers.run_func import ImageProcessor
-from snowimagerpro.core.metadata import ImageMetadata
-from snowimagerpro.core.methods import helper
+from snowimagerpro.core.methods import processing as pro
 
 from ..base import LogicBase, public_data
 from .model import model
+from .prefetch import Prefetcher
 from .viewr import getSaveFileName, show_warning
 
 
@@ -40,11 +41,18 @@ def focus_list(func):
 
 
 def update_raw_image_dbs(func):
+    signature = inspect.signature(func)
+
     def wrapper(self, *args, **kwargs):
-        func(self, *args, **kwargs)
+        # one step for all selected entries: relinked, refreshed, autosaved
+        # and undone once (see ImageSet.batch)
+        uuids = signature.bind(self, *args, **kwargs).arguments.get("uuids")
+        with model.public.img_set.batch(func.__name__.replace("_", " ")) as batch:
+            if uuids is not None:
+                batch.record(uuids)
+            func(self, *args, **kwargs)
+
         model.public.raw_image_dbs._update.emit()
-        model.public.img_set.regenerate_link_table()
-        model.public.img_set.autosave_db()
 
     return wrapper
 
@@ -54,52 +62,75 @@ class Logic(LogicBase):
         super().__init__()
         self.model = model
 
+        self._prefetcher = None
+        self._backed_up = set()  # databases backed up in this session
+
         model.signals.refresh_db.emit()
 
     def post_init(self):
         public_data.raw_image_dbs._update.connect(self.do_new_update)
+        public_data.img_set.edit_listeners.append(self.on_entries_edited)
+
+    def on_entries_edited(self, keys):
+        model.public.widget_models["image_list"].refresh()
+        model.public.widget_models["image_tree"].refresh(keys)
+
+    def undo(self):
+        batch = model.public.img_set.undo()
+        if batch is not None:
+            print(f"Undone: {batch.label} ({len(batch)} images)")
+            model.public.raw_image_dbs._update.emit()
 
     def do_new_update(self):
         print("RUNNING: do_new_update in db_explorer (logic)")
 
     def add_images_to_db(self, folder):
-        files = []
-        exts = [".BAY", ".dng"]
-        for ext in exts:
-            for path in Path(folder).rglob(f"*{ext}", case_sensitive=False):
-                files.append(str(path))
-
-            print("Found", len(files), "images with extension", ext)
+        img_set = model.public.img_set
+
+        files = pro.scan(folder)
+        print("Found", len(files), "images in", folder)
+
+        # headers, sidecars and content digests only: skips broken files and
+        # files already in the db, and pre-fills the metadata
+        result = pro.ingest(
+            files,
+            image_db=img_set._image_db,
+            data_dir=img_set._data_dir,
+            index=img_set.metadata_index,
+        )
+        entries, invalid = result["entries"], result["invalid"]
 
-        files = sorted(files)
+        for info in invalid:
+            print("Skipping", info["path"], info["error"])
+        for fp, known in result["duplicates"]:
+            print("Skipping", fp, "same content as", known)
 
-        print("Adding images to db", files)
+        print("Adding", len(entries), "images to db")
 
-        for filepath in files:
-            uuid = helper.create_uuid()
-            meta = ImageMetadata()
+        # relinked and shown at once, and undone as one step
+        img_set.add_entries(entries)
 
-            meta.ID = uuid
-            meta.filepath = filepath
+        if invalid:
+            show_warning(
+                None,
+                "Warning",
+                f"{len(invalid)} files could not be read and were not added:\n"
+                + "\n".join(f"{info['path']}: {info['error']}" for info in invalid[:20]),
+            )
 
-            model.public.img_set._image_db[uuid] = meta
+        print(len(img_set._image_db), "images in current image db")
 
-        print(len(model.public.img_set._image_db), "images in current image db")
+        if not entries:
+            return
 
-        # model.signals.refresh_db.emit()
-        model.public.widget_models["image_list"].refresh()
-        model.public.widget_models["image_tree"].refresh()
+        self.fill_preview_cache([str(meta.filepath) for meta in entries])
 
+        # the whole batch in one write
         self.write_to_db()
 
     def remove_images_from_db(self, uuids):
         print("Removing images with uuids", uuids)
-        print(model.public.img_set._image_db.keys())
-        for uuid in uuids:
-            model.public.img_set._image_db.pop(int(uuid))
-
-        model.public.widget_models["image_list"].refresh()
-        model.public.widget_models["image_tree"].refresh()
+        model.public.img_set.remove_entries(uuids)
 
     def backup_db(self, fp):
         # TODO: handle multiple backups
@@ -109,18 +140,22 @@ class Logic(LogicBase):
         shutil.copy(fp, fp_bak)
 
     def write_to_db(self, fp=None):
-        model.public.img_set.save_db(fp)
-
-        if not fp:  # if no file path is given, write to current db after backing up
-            fp = model.public.img_set.current_db_path
-            self.backup_db(fp)
+        if not fp:  # writing to the current db, back it up before the first write
+            current = model.public.img_set.current_db_path
+            if current not in self._backed_up:
+                self.backup_db(current)
+                self._backed_up.add(current)
 
-        # TODO: Check if database has actually changed (see settings.manager)
+        # SQLite databases only get the changed entries
+        model.public.img_set.save_db(fp)
 
     def write_to_new_db(self, fp):
         db = model.public.img_set
         fp = getSaveFileName(
-            None, "Save database as", str(db.current_db_path), "Database (*.csv)"
+            None,
+            "Save database as",
+            str(db.current_db_path),
+            "Database (*.csv *.sqlite)",
         )
         self.write_to_db(fp)
 
@@ -137,16 +172,7 @@ class Logic(LogicBase):
 
     @update_raw_image_dbs
     def paste_metadata(self, uuids):
-        for uuid in uuids:
-            self.paste_metadata_single(uuid)
-
-    def paste_metadata_single(self, uuid):
-        _meta = model.public.img_set._image_db[int(uuid)]
-
-        for key in self.clipboard:
-            print("Pasting metadata for key", key)
-            print(self.clipboard[key])
-            _meta[key] = self.clipboard[key]
+        model.public.img_set.update_entries(uuids, **self.clipboard)
 
     def add_db(self, fp):
         flag = raw_image_dbs.add_new_db(fp)
@@ -187,7 +213,50 @@ class Logic(LogicBase):
             print("No data dir changed")
         model.public.img_set._data_dir = new_data_dir
 
-    def load_single_image(self, uuid):
+    def fill_preview_cache(self, files):
+        """Decode new images in the background to cache their previews."""
+
+        cache = public_data.preview_cache
+        if cache is None:
+            return
+
+        def func():
+            cache.fill(
+                [Path(fp) for fp in files], lambda fp: pro.load_image(fp)[0]
+            )
+
+        threadpool.start(ImageProcessor([func]))
+
+    @property
+    def prefetcher(self):
+        # created on first use, the user config is not loaded at import
+        if self._prefetcher is None:
+            self._prefetcher = Prefetcher(
+                int(user_config.get("explorer.image_cache_mb")) * 2**20
+            )
+        return self._prefetcher
+
+    def prefetch_neighbours(self, uuids):
+        """Decode the images with `uuids` (nearest first) in the background."""
+
+        img_set = public_data.img_set
+        data_dir = img_set._data_dir
+
+        entries = []
+        for uuid in uuids:
+            meta = img_set._image_db.get(int(uuid))
+            if meta is not None:
+                entries.append((Path(data_dir) / Path(meta.filepath), meta))
+
+        self.prefetcher.prefetch(entries, data_dir, index=img_set.metadata_index)
+
+    def load_single_image(self, uuid, full=False):
+        """Show the image with `uuid`.
+
+        Prefetched images are shown at full resolution, otherwise the cached
+        preview is shown unless `full`.
+        """
+
         print("db explorer load image with uuid", uuid)
         model.private["current_img_uuid"] = uuid
         model.private["current_db_entry"] = public_data.img_set._image_db[int(uuid)]
@@ -201,12 +270,60 @@ class Logic(LogicBase):
         print(fp)
 
         if fp.exists():
+            cache = public_data.preview_cache
+            img = model.private["current_img"]
+            prefetcher = self.prefetcher
+
+            meta = model.private["current_db_entry"]
+
+            def show(loaded):
+                img._meta = meta
+                img._data = loaded._data
+                img._exif = loaded._exif
+
+            prefetched = prefetcher.cache.get(fp)
+            if prefetched is not None:
+                show(prefetched)
+                self.do_update()
+                return
+
+            preview = None
+            if cache is not None and not full:
+                preview = cache.get(fp)
+
+            if preview is not None:
+                img._meta = model.private["current_db_entry"]
+                img._data = preview
+                img._exif = None
+                self.do_update()
+                return
 
             def func():
-                model.private["current_img"].load_from(
-                    model.private["current_db_entry"],
-                    _dir=model.private["current_data_dir"],
+                if not full:
+                    # strided decode, the full decode fills the preview cache
+                    preview, _ = pro.load_preview(fp)
+                    if preview is not None:
+                        if model.private["current_img_uuid"] == uuid:
+                            img._meta = meta
+                            img._data = preview
+                            img._exif = None
+                        self.fill_preview_cache([fp])
+                        return
+
+                loaded = prefetcher.get_or_load(
+                    fp,
+                    meta,
+                    model.private["current_data_dir"],
+                    index=public_data.img_set.metadata_index,
                 )
+                if loaded is None:
+                    raise OSError(f"Failed to load {fp}")
+
+                if cache is not None and not cache.has(fp):
+                    cache.put(fp, loaded._data)
+
+                if model.private["current_img_uuid"] == uuid:
+                    show(loaded)  # unless another image was selected meanwhile
 
             worker = ImageProcessor([func])
 
@@ -225,44 +342,37 @@ class Logic(LogicBase):
     @focus_list
     @update_raw_image_dbs
     def update_img_type(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].img_type = str(val)
+        model.public.img_set.update_entries(uuids, img_type=str(val))
 
     @focus_list
     @update_raw_image_dbs
     def update_current_drk_group(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].drk_group = int(val)
+        model.public.img_set.update_entries(uuids, drk_group=int(val))
 
     @focus_list
     @update_raw_image_dbs
     def update_current_ref_group(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].ref_group = int(val)
+        model.public.img_set.update_entries(uuids, ref_group=int(val))
 
     @focus_list
     @update_raw_image_dbs
     def update_current_meas_group(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].meas_group = str(val)
+        model.public.img_set.update_entries(uuids, meas_group=str(val))
 
     @focus_list
     @update_raw_image_dbs
     def update_coords_mm(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].coords_mm = str(val)
+        model.public.img_set.update_entries(uuids, coords_mm=str(val))
 
     @focus_list
     @update_raw_image_dbs
     def update_px2mm(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].px_2_mm = float(val)
+        model.public.img_set.update_entries(uuids, px_2_mm=float(val))
 
     @focus_list
     @update_raw_image_dbs
     def update_wavelength(self, val, uuids):
-        for uuid in uuids:
-            model.public.img_set._image_db[int(uuid)].wavelength = float(val)
+        model.public.img_set.update_entries(uuids, wavelength=float(val))
 
     # @update_raw_image_dbs
     def update_ROI(self, idx, _roi):
@@ -0,0 +1,131 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+import logging
+import threading
+from functools import partial
+
+from PySide6.QtCore import QThreadPool
+
+from snowimagerpro.app.workers.run_func import ImageProcessor
+from snowimagerpro.core import Image
+from snowimagerpro.core.methods.image_cache import ImageLRU
+
+logger = "app.db_explorer.prefetch"
+
+
+class Prefetcher:
+    """Decodes the neighbours of the selected image in the background.
+
+    Decoded images are kept in a memory bounded LRU. Every call of `prefetch`
+    starts a new generation: queued decodes of older generations are
+    cancelled, decodes that already run are finished and cached.
+    """
+
+    def __init__(self, budget, workers=2):
+        self.cache = ImageLRU(budget)
+
+        # own pool, prefetching never delays on-demand loads
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(workers)
+
+        self._generation = 0
+        self._queued = {}  # id -> started worker that did not finish yet
+        self._loading = set()  # file paths being decoded
+        self._cond = threading.Condition()
+
+    def prefetch(self, entries, data_dir, index=None):
+        """Decode the images of `entries` (nearest first) that are not cached.
+
+        Args:
+            entries (list): Pairs of (file path, ImageMetadata).
+            data_dir (str | Path): Data directory of the database.
+            index (MetadataIndex, optional): Cache of the parsed EXIF metadata.
+        """
+
+        self._generation += 1
+
+        # cancel stale prefetches that did not start yet
+        with self._cond:
+            queued = list(self._queued.items())
+        for key, worker in queued:
+            if self._pool.tryTake(worker):
+                with self._cond:
+                    self._queued.pop(key, None)
+
+        for fp, meta in entries:
+            if fp in self.cache:
+                continue
+
+            worker = ImageProcessor(
+                [partial(self._prefetch, self._generation, fp, meta, data_dir, index)]
+            )
+            # the workers stay alive until they finished or were taken back,
+            # tryTake on a deleted worker raises
+            worker.setAutoDelete(False)
+            worker.signals.finished.connect(partial(self._finished, id(worker)))
+
+            with self._cond:
+                self._queued[id(worker)] = worker
+            self._pool.start(worker)
+
+    def _finished(self, key):
+        with self._cond:
+            self._queued.pop(key, None)
+
+    def _prefetch(self, generation, fp, meta, data_dir, index):
+        if generation != self._generation:
+            return  # the selection moved on
+
+        with self._cond:
+            if fp in self._loading or fp in self.cache:
+                return
+            self._loading.add(fp)
+
+        self._decode(fp, meta, data_dir, index)
+
+    def get_or_load(self, fp, meta, data_dir, index=None):
+        """Return the decoded image of `fp`, waiting for a running prefetch."""
+
+        with self._cond:
+            while fp in self._loading:
+                self._cond.wait()
+
+            img = self.cache.get(fp)
+            if img is not None:
+                return img
+
+            self._loading.add(fp)
+
+        return self._decode(fp, meta, data_dir, index)
+
+    def _decode(self, fp, meta, data_dir, index):
+        img = None
+        try:
+            img = Image()
+            img.load_from(meta, _dir=data_dir, index=index)
+            self.cache.put(fp, img)
+        except Exception as e:
+            logging.getLogger(logger).warning(f"Failed to load {fp}: {e}")
+            img = None
+        finally:
+            with self._cond:
+                self._loading.discard(fp)
+                self._cond.notify_all()
+
+        return img
@@ -20,6 +20,7 @@ from pathlib import Path
 
 import pyqtgraph as pg
 from PySide6.QtCore import Qt
+from PySide6.QtGui import QKeySequence, QShortcut
 from PySide6.QtWidgets import (
     QCheckBox,
     QDialog,
@@ -82,9 +83,9 @@ def paste_metadata():
 
 def add_db():
     db_path = user_config.get("explorer.db_path")
-    fp = getFileName(None, "Open File", db_path, "CSV (*.csv)")
+    fp = getFileName(None, "Open File", db_path, "Database (*.csv *.sqlite)")
     if not Path(fp).exists():
-        if Path(fp).suffix in [".csv", ""]:
+        if Path(fp).suffix in [".csv", ".sqlite", ""]:
             if Path(fp).suffix == "":
                 fp = fp + ".csv"
             create_db(fp)
@@ -97,9 +98,8 @@ def add_db():
 
 
 def create_db(fp):
-    assert fp.endswith(".csv") or fp.endswith("")
-    with open(fp, "w") as f:
-        f.write(",".join(ImageMetadata.to_key_list()) + "\n")
+    assert fp.endswith(".csv") or fp.endswith(".sqlite") or fp.endswith("")
+    pro.save_db({}, fp)  # header only (CSV) or empty table (SQLite)
 
 
 def remove_db():
@@ -135,6 +135,18 @@ def change_data_dir(curr_data_dir):
     return new_data_dir
 
 
+def neighbour_uuids(index, k):
+    """uuids of the next and previous `k` rows (same parent), nearest first."""
+    uuids = []
+    for d in range(1, k + 1):
+        for row in [index.row() + d, index.row() - d]:
+            neighbour = index.siblingAtRow(row)
+            if neighbour.isValid() and neighbour.data(role=0x0100):
+                uuids.append(neighbour.data(role=0x0100))
+
+    return uuids
+
+
 class View(ViewBase):
     def __init__(self):
         super(View, self).__init__()
@@ -162,6 +174,7 @@ class View(ViewBase):
         model.public.sync_widget_to_model(
             self.explr._ui.listView, "image_list", "db_explorer"
         )
+        self.explr._ui.listView.doubleClicked.connect(self.on_listView_double_clicked)
 
         model.signals.change_img.connect(self.change_img)
 
@@ -222,6 +235,8 @@ class View(ViewBase):
         uuid = index.data(role=0x0100)
         if uuid:
             logic.load_single_image(uuid)
+            k = int(user_config.get("explorer.prefetch_neighbours"))
+            logic.prefetch_neighbours(neighbour_uuids(index, k))
 
             ### next highlight the selected item in the list
             ### prolly move to custom_widgets
@@ -237,6 +252,13 @@ class View(ViewBase):
                             break
 
 
+    def on_listView_double_clicked(self, index):
+        """Replace the cached preview by the full resolution image."""
+        uuid = index.data(role=0x0100)
+        if uuid:
+            logic.load_single_image(uuid, full=True)
+
+
 class Ctrls(QWidget):
     def __init__(self):
         super().__init__()
@@ -295,6 +317,10 @@ class Explr(QWidget):
         self._ui.le_coords_mm.editingFinished.connect(self.do_update_coords_mm)
         self._ui.dsb_px2mm.editingFinished.connect(self.do_update_px2mm)
 
+        # undoes the last metadata edit of the selected images
+        self.undo_shortcut = QShortcut(QKeySequence.StandardKey.Undo, self)
+        self.undo_shortcut.activated.connect(logic.undo)
+
         self._ui.cb_update_ROIs.stateChanged.connect(self.on_roi_cb_state_changed)
         self._ui.cb_update_coords_pix.stateChanged.connect(
             self.on_coords_pix_cb_state_changed
@@ -16,13 +16,15 @@
 # this program. If not, see <https://www.gnu.org/licenses/>.
 #
 
+from functools import partial
 from pathlib import Path
 
 from snowimagerpro.app.managers.jobs import threadpool
 from snowimagerpro.app.managers.settings import user_config
 from snowimagerpro.app.workers.run_func import ImageProcessor
+from snowimagerpro.core.methods import processing as pro
 
-from ..base import LogicBase
+from ..base import LogicBase, public_data
 from .model import model
 from .viewr import Viewr
 
@@ -71,12 +73,39 @@ class Logic(LogicBase):
             model.private["defaultDirs"].remove(current_text)
             model.private["currentDir"] = model.private["defaultDirs"][idx - 1]
 
-    def load(self, fp):
+    def load(self, fp, full=False):
+        """Show the image(s) at `fp`, a single image from the preview cache unless `full`."""
+
+        cache = public_data.preview_cache
+
         if not isinstance(fp, list):
             fp = Path(fp)
 
+            preview = None
+            if cache is not None and not full:
+                preview = cache.get(fp)
+
+            if preview is not None:
+                model.private["image"]._data = preview
+                self.show_raw_image()
+                return
+
             def func():
+                if not full:
+                    # strided decode, the full decode fills the preview cache
+                    preview, _ = pro.load_preview(fp)
+                    if preview is not None:
+                        model.private["image"]._data = preview
+                        if cache is not None:
+                            threadpool.start(ImageProcessor([partial(fill, fp)]))
+                        return
+
                 model.private["image"].load_from(fp)
+                if cache is not None:
+                    cache.put(fp, model.private["image"]._data)
+
+            def fill(fp):
+                cache.fill([fp], lambda _fp: pro.load_image(_fp)[0])
 
             funcs = [func]
         else:
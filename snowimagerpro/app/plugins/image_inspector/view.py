@@ -38,7 +38,7 @@ class View(ViewBase):
 
         self._icon = paths.resource("icons/inspecting.svg")
 
-        self.ctrls._ui.btn_load.clicked.connect(logic.load)
+        self.ctrls._ui.btn_load.clicked.connect(self.do_load_full)
         self.ctrls._ui.btn_close_views.clicked.connect(logic.close_views)
 
         self.ctrls._ui.btn_add_def_dir.clicked.connect(self.do_add_default_dir)
@@ -53,6 +53,12 @@ class View(ViewBase):
         fp = self.explr.fs_model.filePath(self.explr._ui.treeView.selectedIndexes()[0])
         logic.load(fp)
 
+    def do_load_full(self):
+        """Load the selected file at full resolution, bypassing the preview cache."""
+        indices = self.explr._ui.treeView.selectedIndexes()
+        if indices:
+            logic.load(self.explr.fs_model.filePath(indices[0]), full=True)
+
     def do_update_model(self, idx):
         current_text = self.explr._ui.comboBox.currentText()
         logic.update_model(idx, current_text)
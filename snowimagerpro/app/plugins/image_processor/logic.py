@@ -44,6 +44,27 @@ class Logic(LogicBase):
         worker.signals.result.connect(self.update_view)
         threadpool.start(worker)
 
+    def process_streaming(self, keep=False):
+        """Load, correct, calibrate, undistort and stitch the selected images
+        image by image (see `ImageSet.process_streaming`), keeping the
+        processed images in memory only with `keep`."""
+
+        logging.getLogger(logger).info(
+            f"Processing uuid(s) image by image: {public_data.uuids_selected}"
+        )
+
+        uuids = [int(uuid) for uuid in public_data.uuids_selected]
+        max_in_flight = int(user_config.get("processor.stream_in_flight"))
+
+        def func():
+            public_data.img_set.process_streaming(
+                uuids, keep=keep, max_in_flight=max_in_flight
+            )
+
+        worker = ImageProcessor([func])
+        worker.signals.result.connect(self.update_view)
+        threadpool.start(worker)
+
     def ffc(self):
         def func():
             public_data.img_set.ffc()
@@ -61,7 +82,23 @@ class Logic(LogicBase):
         else:
             print("No FFC images to remove.")
 
+    def ffc_refl_cal(self):
+        """Flat-field correction and reflectance calibration in one pass,
+        without keeping the flat-field corrected images."""
+
+        def func():
+            return public_data.img_set.ffc_refl_cal()
+
+        worker = ImageProcessor([func])
+        worker.signals.result.connect(self.result_ffc)
+        threadpool.start(worker)
+
     def refl_cal(self):
+        if not hasattr(public_data.img_set, "imgs_post_ffc"):
+            # the flat-field correction was not shown, run both in one pass
+            self.ffc_refl_cal()
+            return
+
         def func():
             public_data.img_set.refl_cal()
 
@@ -81,6 +81,8 @@ class Ctrls(QWidget):
         self._ui.setupUi(self)
 
         self._ui.btn_load.clicked.connect(logic.load)
+        self._ui.btn_load.setContextMenuPolicy(Qt.CustomContextMenu)
+        self._ui.btn_load.customContextMenuRequested.connect(self.load_context_menu)
 
         self._ui.btn_preview.clicked.connect(self.on_btn_preview_clicked)
 
@@ -114,12 +116,22 @@ class Ctrls(QWidget):
 
         self._ui.btn_close_views.clicked.connect(logic.close_views)
 
+    def load_context_menu(self, pos):
+        menu = QMenu()
+        action = menu.addAction("Load and process image by image")
+        action.triggered.connect(lambda: logic.process_streaming())
+        action = menu.addAction("Load and process image by image, keep the images")
+        action.triggered.connect(lambda: logic.process_streaming(keep=True))
+        menu.exec_(self._ui.btn_load.mapToGlobal(pos))
+
     def ffc_context_menu(self, pos):
+        menu = QMenu()
+        action = menu.addAction("Flat-field correct and calibrate in one pass")
+        action.triggered.connect(logic.ffc_refl_cal)
         if hasattr(model.public.img_set, "imgs_post_ffc"):
-            menu = QMenu()
             action = menu.addAction("Remove flat-field correction")
             action.triggered.connect(logic.remove_ffc)
-            menu.exec_(self._ui.btn_ffc.mapToGlobal(pos))
+        menu.exec_(self._ui.btn_ffc.mapToGlobal(pos))
 
     def refl_context_menu(self, pos):
         if hasattr(model.public.img_set, "imgs_post_refl_cal"):
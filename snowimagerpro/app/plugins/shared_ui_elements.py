@@ -16,12 +16,11 @@
 # this program. If not, see <https://www.gnu.org/licenses/>.
 #
 
-from itertools import groupby
+from bisect import bisect_left
+from pathlib import Path
 
 from PySide6 import QtCore
 
-from snowimagerpro.core.metadata import ImageMetadata
-
 
 class DatabasesListModel(QtCore.QStringListModel):
     """DB list model for combobox and editable combobox"""
@@ -147,12 +146,19 @@ class ImageDBListModel(QtCore.QStringListModel):
 
 
 class TreeItem(object):
-    def __init__(self, _name, _parent=None, _uuid=None):
+    def __init__(self, _name, _parent=None, _uuid=None, _key=None, _node=None):
         self._name = _name
         self._uuid = _uuid
         self._children = []
         self._parent = _parent
 
+        # sort key among the siblings, and the subtree in ImageDBTreeModel._data
+        # the children are created from when the item is expanded (fetchMore)
+        self._key = _name if _key is None else _key
+        self._keys = []
+        self._node = _node
+        self._fetched = _node is None
+
     def name(self):
         return self._name
 
@@ -183,12 +189,14 @@ class TreeItem(object):
 
     def add_child(self, child):
         self._children.append(child)
+        self._keys.append(child._key)
 
     def insert_child(self, position, child):
         if position < 0 or position > len(self._children):
             return False
 
         self._children.insert(position, child)
+        self._keys.insert(position, child._key)
         child._parent = self
         return True
 
@@ -197,10 +205,21 @@ class TreeItem(object):
             return False
 
         child = self._children.pop(position)
+        self._keys.pop(position)
         child._parent = None
 
         return True
 
+    def find_child(self, key):
+        """Row of the child with sort key `key`, or where it would be inserted.
+
+        Returns:
+            tuple: (row, True if the child exists)
+        """
+
+        row = bisect_left(self._keys, key)
+        return row, row < len(self._keys) and self._keys[row] == key
+
     def log(self, tab_level=-1):
         output = ""
         tab_level += 1
@@ -222,82 +241,257 @@ class TreeItem(object):
         return self.log()
 
 
+def tree_path(image_db, key, sortby="date") -> tuple:
+    """Position of entry `key` in the image tree.
+
+    Returns:
+        tuple: (date or location, location or date, meas_group, img_type,
+            (file name, ID))
+    """
+
+    if hasattr(image_db, "field"):  # ImageDB, without building the entry
+
+        def get(name):
+            return image_db.field(key, name)
+
+    else:
+        entry = image_db[key]
+
+        def get(name):
+            return getattr(entry, name)
+
+    if sortby == "date":
+        first, second = str(get("date")), str(get("location"))
+    elif sortby == "location":
+        first, second = str(get("location")), str(get("date"))
+    else:
+        raise ValueError("Invalid sortby. Must be 'date' or 'location'")
+
+    return (
+        first,
+        second,
+        str(get("meas_group")),
+        str(get("img_type")),
+        (Path(get("filepath")).stem, str(get("ID"))),
+    )
+
+
 class ImageDBTreeModel(QtCore.QAbstractItemModel):
+    """Tree of the current image db, grouped by date (or location), location
+    (or date), meas_group and img_type.
+
+    The grouping is kept in nested dicts (`_data`), the tree items of a group
+    are only created when the group is expanded (`canFetchMore` and
+    `fetchMore`). `refresh` compares the db with the tree and inserts, removes
+    or moves only the entries that changed.
+    """
+
+    EXPAND_DEPTH = 2
+
     def __init__(self, model, _parent=None):
         super(ImageDBTreeModel, self).__init__(_parent)
 
         self.model = model
         self.instances = []
 
-        self.root_item = TreeItem("ROOT")
-
+        self._db = None
+        self._sortby = None
+        self._paths = {}  # key -> tree_path
         self._data = {}
 
+        self.root_item = TreeItem("ROOT", _node=self._data)
+
     def db_to_tree(self, db, sortby="date"):
         """
         Convert the database to a tree structure
         """
 
-        if sortby == "date":
-            by_first = ImageMetadata.by_date
-            by_second = ImageMetadata.by_location
-        elif sortby == "location":
-            by_first = ImageMetadata.by_location
-            by_second = ImageMetadata.by_date
-        else:
-            raise ValueError("Invalid sortby. Must be 'date' or 'location'")
+        self._paths = {key: tree_path(db, key, sortby) for key in db.keys()}
 
         _data = {}
-        for first, after_first in groupby(db, by_first):
-            _data[first] = {}
-            for second, after_second in groupby(after_first, by_second):
-                _data[first][second] = {}
-
-                for meas_group, after_meas_group in groupby(
-                    sorted(after_second, key=ImageMetadata.by_meas_group),
-                    ImageMetadata.by_meas_group,
-                ):
-                    _data[first][second][meas_group] = {}
-
-                    after_meas_group = sorted(
-                        after_meas_group, key=ImageMetadata.by_img_type
-                    )
-
-                    for img_type, after_img_type in groupby(
-                        after_meas_group, ImageMetadata.by_img_type
-                    ):
-                        _data[first][second][meas_group][img_type] = {}
-                        for image in after_img_type:
-                            _data[first][second][meas_group][img_type][
-                                image.filepath.stem
-                            ] = str(image.ID)
+        for path in self._paths.values():
+            node = _data
+            for name in path[:-1]:
+                node = node.setdefault(name, {})
+            node[path[-1]] = path[-1][1]
 
         return _data
 
-    def refresh(self):
-        image_db = self.model.img_set._image_db.values()
+    def refresh(self, keys=None):
+        """Update the tree to the current image db.
+
+        Args:
+            keys (list, optional): The entries that changed, if known. By
+                default all entries are compared with the tree.
+        """
+
+        image_db = self.model.img_set._image_db
+        sortby = self.model.sortby
+
+        if image_db is not self._db or sortby != self._sortby:
+            return self.reset(image_db, sortby)
+
+        if keys is None:
+            keys = list(image_db.keys()) + [
+                key for key in self._paths if key not in image_db
+            ]
+
+        moved = []
+        for key in keys:
+            path = tree_path(image_db, key, sortby) if key in image_db else None
+            if path != self._paths.get(key):
+                moved.append((key, path))
+
+        for key, path in moved:
+            if key in self._paths:
+                self._remove_path(self._paths.pop(key))
+            if path is not None:
+                self._paths[key] = path
+                self._insert_path(path)
+
+    def reset(self, image_db, sortby):
+        self.beginResetModel()
+
+        self._db = image_db
+        self._sortby = sortby
+        self._data = self.db_to_tree(image_db, sortby=sortby)
+        self.root_item = TreeItem("ROOT", _node=self._data)
+
+        self.endResetModel()
+
+        for i in self.instances:
+            i[0].expandToDepth(self.EXPAND_DEPTH)
+
+    def _item_index(self, item):
+        if item is self.root_item:
+            return QtCore.QModelIndex()
+        return self.createIndex(item.row(), 0, item)
+
+    def _new_item(self, key, value, parent):
+        if isinstance(value, dict):
+            return TreeItem(key, parent, _key=key, _node=value)
+        return TreeItem(key[0], parent, _uuid=value, _key=key)
+
+    def _insert_path(self, path):
+        node, item = self._data, self.root_item
+
+        for depth, name in enumerate(path):
+            if name in node and depth < len(path) - 1:
+                # existing group
+                node = node[name]
+                if item is not None and item._fetched:
+                    row, exists = item.find_child(name)
+                    item = item.child(row) if exists else None
+                else:
+                    item = None
+                continue
+
+            # the new group, with the rest of the path, or the entry
+            value = path[-1][1]
+            for _name in reversed(path[depth + 1 :]):
+                value = {_name: value}
+
+            if item is None or not item._fetched or name in node:
+                node[name] = value  # created when the parent is expanded
+                return
+
+            # a new group only holds this entry, its items are created at once
+            child = branch = self._new_item(name, value, item)
+            while branch._node is not None:
+                ((key, _value),) = branch._node.items()
+                branch._fetched = True
+                branch.add_child(self._new_item(key, _value, branch))
+                branch = branch.child(0)
+
+            # the views see the new row and the new group together
+            row, _ = item.find_child(name)
+            self.beginInsertRows(self._item_index(item), row, row)
+            node[name] = value
+            item.insert_child(row, child)
+            self.endInsertRows()
+
+            if depth <= self.EXPAND_DEPTH:
+                self._expand(item.child(row), depth)
+            return
+
+    def _remove_path(self, path):
+        nodes, items = [self._data], [self.root_item]
+        for name in path[:-1]:
+            nodes.append(nodes[-1][name])
 
-        self._data = self.db_to_tree(image_db, sortby=self.model.sortby)
+            item = items[-1]
+            if item is not None and item._fetched:
+                row, exists = item.find_child(name)
+                items.append(item.child(row) if exists else None)
+            else:
+                items.append(None)
 
-        self.root_item = TreeItem("ROOT")
-        self.setup_model_data(self._data)
+        # the entry and the groups it leaves empty are removed as one row
+        depth = len(path) - 1
+        while depth > 0 and len(nodes[depth]) == 1:
+            depth -= 1
 
-        self.layoutChanged.emit()
+        item = items[depth]
+        row, exists = (0, False)
+        if item is not None and item._fetched:
+            row, exists = item.find_child(path[depth])
+
+        if not exists:
+            del nodes[depth][path[depth]]
+            return
+
+        self.beginRemoveRows(self._item_index(item), row, row)
+        del nodes[depth][path[depth]]
+        item.remove_child(row)
+        self.endRemoveRows()
+
+    def _expand(self, item, depth):
         for i in self.instances:
-            i[0].expandToDepth(2)
+            i[0].expand(self._item_index(item))
+
+        if depth < self.EXPAND_DEPTH:
+            for row in range(item.child_count()):
+                self._expand(item.child(row), depth + 1)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        item = self.get_item(parent)
+        if item._node is None:
+            return False
+        return bool(item._node)
+
+    def canFetchMore(self, parent):
+        item = self.get_item(parent)
+        return not item._fetched and bool(item._node)
+
+    def fetchMore(self, parent):
+        item = self.get_item(parent)
+        if item._fetched:
+            return
+
+        children = sorted(item._node.items())
+        item._fetched = True
+        if not children:
+            return
+
+        self.beginInsertRows(parent, 0, len(children) - 1)
+        for key, value in children:
+            item.add_child(self._new_item(key, value, item))
+        self.endInsertRows()
 
-    def setup_model_data(self, _data, _parent=None):
-        if _parent is None:
-            _parent = self.root_item
+    def uuids(self, index):
+        """IDs of all images below `index`, also in groups not expanded."""
 
-        for key, value in sorted(_data.items()):
-            if isinstance(value, dict):
-                _item = TreeItem(key, _parent)
-                _parent.add_child(_item)
-                self.setup_model_data(value, _item)
-            if isinstance(value, str):
-                _item = TreeItem(key, _parent, _uuid=value)
-                _parent.add_child(_item)
+        if index.isValid() and index.internalPointer()._node is None:
+            return [index.internalPointer().uuid()]
+
+        def _collect(node):
+            for value in node.values():
+                if isinstance(value, dict):
+                    yield from _collect(value)
+                else:
+                    yield value
+
+        return list(_collect(self.get_item(index)._node))
 
     def rowCount(self, parent):
         if not parent.isValid():
@@ -371,6 +565,9 @@ class ImageDBTreeModel(QtCore.QAbstractItemModel):
     def index(self, row, column, parent):
         parent_item = self.get_item(parent)
 
+        if row < 0 or row >= parent_item.child_count():
+            return QtCore.QModelIndex()
+
         child_item = parent_item.child(row)
 
         if child_item:
@@ -386,34 +583,6 @@ class ImageDBTreeModel(QtCore.QAbstractItemModel):
 
         return self.root_item
 
-    def insertRows(self, position, rows, parent=QtCore.QModelIndex()):
-        parent_item = self.get_item(parent)
-        success = False
-
-        self.beginInsertRows(parent, position, position + rows - 1)
-
-        for row in range(rows):
-            child_count = parent_item.child_count()
-            child_item = TreeItem("untitled" + str(child_count))
-            success = parent_item.insert_child(position, child_item)
-
-        self.endInsertRows()
-
-        return success
-
-    def removeRows(self, position, rows, parent=QtCore.QModelIndex()):
-        parent_item = self.get_item(parent)
-        success = False
-
-        self.beginRemoveRows(parent, position, position + rows - 1)
-
-        for row in range(rows):
-            success = parent_item.remove_child(position)
-
-        self.endRemoveRows()
-
-        return success
-
 
 class SortbyListModel(QtCore.QStringListModel):
     def __init__(self, model, parent=None):
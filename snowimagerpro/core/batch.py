@@ -0,0 +1,329 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Headless processing of all measurement sets of an image database.
+
+A set is made of the entries with the same date, location and measurement
+group (with their dark and reference images), if it has measurement images.
+Every set is processed in a worker process by `ImageSet` as in the image
+processor: `load_images`, `ffc_refl_cal` (`ffc` and `refl_cal` in one pass),
+`undistort`, `stitching` and `save_as_h5`, into its own folder of the output
+directory.
+
+After every set the run summary (JSON) is written to the output directory.
+It records the inputs of every set (metadata of its entries and size and
+modification time of their files), so a later run skips the sets that were
+processed from the same inputs and whose outputs exist, and processes the
+others (new, changed or failed sets) again.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+from snowimagerpro import __VERSION__
+from snowimagerpro.core.methods.metadata_index import file_stamp
+from snowimagerpro.core.methods.query import column
+from snowimagerpro.core.processing import ImageSet
+
+logger = "core.batch"
+
+SUMMARY_NAME = "summary.json"
+
+# the fields of a set
+SET_FIELDS = ("date", "location", "meas_group")
+
+
+def set_name(key) -> str:
+    """Folder name of the set `key` ((date, location, meas_group))."""
+    return "_".join(str(value) for value in key)
+
+
+def enumerate_sets(image_db) -> list:
+    """The (date, location, meas_group) sets of an (expanded) image database
+    with measurement images, sorted.
+
+    Groups of only dark and reference images are not sets, their images are
+    processed with the sets linked to them.
+    """
+
+    columns = [column(image_db, name).tolist() for name in SET_FIELDS]
+
+    # measurement images, as corrected by `ImageSet.ffc`
+    measurement = (column(image_db, "img_type") != "ref") & (
+        column(image_db, "wavelength").astype(float) != 0
+    )
+
+    return sorted(
+        {
+            tuple(str(v) for v in values)
+            for values, is_measurement in zip(zip(*columns), measurement)
+            if is_measurement
+        }
+    )
+
+
+def set_ids(image_set, key) -> list:
+    """IDs of the entries of set `key` and of the dark and reference images
+    they are linked to (which may belong to another set)."""
+
+    ids = [int(ID) for ID in image_set.query(**dict(zip(SET_FIELDS, key)))]
+
+    linked = []
+    for ID in ids:
+        link = image_set._link_table.get(ID, {})
+        deps = [link.get("dark_id"), link.get("ref_id")]
+        if link.get("ref_id") in image_set._link_table:
+            deps.append(image_set._link_table[link["ref_id"]].get("dark_id"))
+        linked += [_id for _id in deps if _id is not None]
+
+    return ids + [_id for _id in dict.fromkeys(linked) if _id not in ids]
+
+
+def set_inputs(image_set, key, options) -> str:
+    """Digest of the inputs of set `key`: the metadata of its entries (but
+    their IDs, new for expanded entries on every load), the size and
+    modification time of their files and the processing options."""
+
+    digest = hashlib.blake2b(
+        json.dumps([__VERSION__, options], sort_keys=True).encode(), digest_size=16
+    )
+
+    for ID in set_ids(image_set, key):
+        entry = image_set._image_db[ID].to_dict()
+        entry.pop("ID", None)
+
+        fp = Path(image_set._data_dir) / str(entry["filepath"])
+        record = [entry, file_stamp(fp)]
+        digest.update(json.dumps(record, sort_keys=True, default=str).encode())
+
+    return digest.hexdigest()
+
+
+def process_set(db_path, data_dir, key, folder, undistort=True, streaming=False):
+    """Process the set `key` of a database and save the stitched images.
+
+    Runs in a worker process.
+
+    Returns:
+        dict: "outputs" (list of .h5 files) and "images" (number of entries).
+    """
+
+    image_set = ImageSet()
+    image_set.stages.policy = "release"  # only the result of each stage is needed
+
+    try:
+        image_set.load_db(db_path, data_dir=data_dir)
+
+        ids = set_ids(image_set, key)
+        if not ids:
+            raise ValueError(f"No entries in set {set_name(key)}")
+
+        if streaming:
+            image_set.process_streaming(ids, undistort=undistort)
+        else:
+            image_set.load_images(ids)
+            if image_set.ffc_refl_cal() is ReferenceError:
+                raise ReferenceError("Reference images of the set are not loaded")
+            if undistort:
+                image_set.undistort(None)  # calibration file by serial number
+            image_set.stitching()
+
+        if not hasattr(image_set, "stitched_image") or not image_set.stitched_image:
+            raise ValueError("No stitched image, the set has no corrected images")
+
+        image_set.save_as_h5(folder=str(folder))
+    finally:
+        image_set.close()
+
+    outputs = sorted(str(fp) for fp in Path(folder).rglob("*.h5"))
+    if not outputs:
+        raise ValueError("No output written, see the log")
+
+    return {"outputs": outputs, "images": len(ids)}
+
+
+def _is_current(record, inputs) -> bool:
+    return (
+        record is not None
+        and record.get("status") in ("done", "skipped")
+        and record.get("inputs") == inputs
+        and bool(record.get("outputs"))
+        and all(Path(fp).exists() for fp in record["outputs"])
+    )
+
+
+def _write_summary(path, summary):
+    # replace the file, a killed run leaves the last complete summary
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(summary, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def run(
+    db_path,
+    data_dir,
+    out_dir,
+    workers=None,
+    undistort=True,
+    streaming=False,
+    force=False,
+    sets=None,
+    summary_path=None,
+) -> dict:
+    """Process all sets of the database `db_path`.
+
+    Args:
+        db_path (str | Path): The image database (.csv or .sqlite).
+        data_dir (str | Path): Folder of the image files.
+        out_dir (str | Path): Output folder, one subfolder per set.
+        workers (int, optional): Worker processes, all cores by default.
+        undistort (bool): Remove the lens distortion.
+        streaming (bool): Use `ImageSet.process_streaming`.
+        force (bool): Process the sets that are current as well.
+        sets (list, optional): Only process these (date, location, meas_group).
+        summary_path (str | Path, optional): The run summary, by default
+            `SUMMARY_NAME` in `out_dir`.
+
+    Returns:
+        dict: The run summary.
+    """
+
+    out_dir = Path(out_dir).resolve()  # the summary is read from anywhere
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = Path(summary_path) if summary_path else out_dir / SUMMARY_NAME
+
+    previous = {}
+    if summary_path.exists():
+        try:
+            with open(summary_path) as f:
+                previous = {
+                    record["set"]: record for record in json.load(f).get("sets", [])
+                }
+        except (OSError, ValueError) as e:
+            logging.getLogger(logger).warning(f"Cannot read {summary_path}: {e}")
+
+    # load once here: edits in the journal are written into the db before the
+    # workers read it
+    image_set = ImageSet()
+    image_set.load_db(db_path, data_dir=data_dir)
+    options = {"undistort": undistort, "streaming": streaming}
+
+    all_keys = enumerate_sets(image_set._image_db)
+    keys = all_keys
+    if sets is not None:
+        wanted = {tuple(str(v) for v in key) for key in sets}
+        keys = [key for key in all_keys if key in wanted]
+
+    inputs = {key: set_inputs(image_set, key, options) for key in keys}
+    image_set.close()
+
+    summary = {
+        "db": str(db_path),
+        "data_dir": str(data_dir),
+        "out_dir": str(out_dir),
+        "version": __VERSION__,
+        "options": options,
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "finished": None,
+        "counts": {},
+        "sets": [],
+    }
+    records = {}
+
+    for key in keys:
+        name = set_name(key)
+        record = {
+            "set": name,
+            **dict(zip(SET_FIELDS, key)),
+            "inputs": inputs[key],
+            "status": "pending",
+            "outputs": [],
+            "images": None,
+            "seconds": None,
+            "error": None,
+        }
+
+        old = previous.get(name)
+        if not force and _is_current(old, inputs[key]):
+            record.update(
+                status="skipped", outputs=old["outputs"], images=old.get("images")
+            )
+        records[key] = record
+
+    # the other sets of the db stay in the summary as they were
+    for key in all_keys:
+        if key not in records and set_name(key) in previous:
+            records[key] = previous[set_name(key)]
+
+    def _update():
+        summary["sets"] = [records[key] for key in all_keys if key in records]
+        statuses = [record["status"] for record in summary["sets"]]
+        summary["counts"] = {s: statuses.count(s) for s in sorted(set(statuses))}
+        _write_summary(summary_path, summary)
+
+    todo = [key for key in keys if records[key]["status"] == "pending"]
+    logging.getLogger(logger).info(
+        f"{len(keys)} sets in {db_path}, {len(todo)} to process"
+    )
+    _update()
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {}
+        for key in todo:
+            folder = out_dir / set_name(key)
+
+            # outputs of an earlier (or interrupted) run are replaced
+            for fp in folder.rglob("*.h5"):
+                fp.unlink(missing_ok=True)
+
+            records[key]["status"] = "running"
+            future = executor.submit(
+                process_set, str(db_path), str(data_dir), key, folder, undistort, streaming
+            )
+            futures[future] = (key, time.perf_counter())
+        _update()
+
+        for future in concurrent.futures.as_completed(futures):
+            key, start = futures[future]
+            record = records[key]
+            record["seconds"] = round(time.perf_counter() - start, 1)
+
+            try:
+                record.update(future.result(), status="done")
+                logging.getLogger(logger).info(f"Set {record['set']} done")
+            except Exception as e:
+                record.update(status="failed", error=f"{type(e).__name__}: {e}")
+                logging.getLogger(logger).error(f"Set {record['set']} failed: {e}")
+
+            _update()
+
+    summary["finished"] = datetime.now().isoformat(timespec="seconds")
+    _update()
+
+    return summary
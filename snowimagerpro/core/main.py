@@ -16,18 +16,110 @@
 # this program. If not, see <https://www.gnu.org/licenses/>.
 #
 
-from snowimagerpro.core.processing import ImageSet
+"""Headless version of SnowImagerPro.
 
+Usage:
+    python -m snowimagerpro.core process DB DATA_DIR [-o OUT_DIR] [-j WORKERS]
+"""
 
-def main():
-    print("Hello, world!")
+import argparse
+import logging
+import sys
 
-    image_set = ImageSet()
-    print(image_set)
+
+def _set(value):
+    key = tuple(value.split(","))
+    if len(key) != 3:
+        raise argparse.ArgumentTypeError("use date,location,meas_group")
+    return key
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m snowimagerpro.core",
+        description="This is the Snow Imager headless version.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    process = commands.add_parser(
+        "process",
+        help="stitch all measurement sets of an image database",
+        description=(
+            "Process every (date, location, meas_group) set of the database "
+            "(flat-field correction, reflectance calibration, undistortion, "
+            "stitching) and save the stitched images as .h5 files. Sets "
+            "processed before from the same inputs are skipped."
+        ),
+    )
+    process.add_argument("db", help="image database (.csv or .sqlite)")
+    process.add_argument("data_dir", help="folder of the image files")
+    process.add_argument(
+        "-o", "--out-dir", default="processed", help="output folder (default: processed)"
+    )
+    process.add_argument(
+        "-j", "--workers", type=int, default=None, help="worker processes (default: all cores)"
+    )
+    process.add_argument(
+        "--set",
+        dest="sets",
+        type=_set,
+        action="append",
+        metavar="DATE,LOCATION,MEAS_GROUP",
+        help="only process this set (repeatable)",
+    )
+    process.add_argument(
+        "--force", action="store_true", help="process the current sets as well"
+    )
+    process.add_argument(
+        "--no-undistort", action="store_true", help="skip the undistortion"
+    )
+    process.add_argument(
+        "--streaming",
+        action="store_true",
+        help="process image by image (ImageSet.process_streaming)",
+    )
+    process.add_argument(
+        "--summary", default=None, help="run summary (default: OUT_DIR/summary.json)"
+    )
+    process.add_argument(
+        "--log-level", default="INFO", help="DEBUG, INFO, WARNING or ERROR"
+    )
+
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="[%(asctime)s] %(levelname)s [%(name)s] %(message)s",
+        datefmt="%Y-%m-%dT%H:%M:%S",
+    )
+
+    if args.command == "process":
+        from snowimagerpro.core.batch import run
+
+        summary = run(
+            args.db,
+            args.data_dir,
+            args.out_dir,
+            workers=args.workers,
+            undistort=not args.no_undistort,
+            streaming=args.streaming,
+            force=args.force,
+            sets=args.sets,
+            summary_path=args.summary,
+        )
+
+        print(
+            ", ".join(f"{n} {status}" for status, n in summary["counts"].items())
+            or "No sets"
+        )
+        return 1 if summary["counts"].get("failed") else 0
 
     return 0
 
 
 if __name__ == "__main__":
-    print("This is the Snow Imager headless version.")
-    main()
+    sys.exit(main())
@@ -0,0 +1,358 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Catalog of the entries of several image databases.
+
+The catalog keeps a small SQLite index of all registered databases (ID, date,
+location, measurement group, image type, wavelength and file path of every
+entry), so frames can be found across seasons and sites without loading the
+databases. An entry of several measurement groups (e.g. ``"[1, 2]"``, see
+`helper.expand_db_by_meas_group`) is indexed once per group, with its stored
+ID. A database is indexed again when its file or its edit journal changed.
+Queries return the matching IDs per database; the full metadata is only
+loaded for the databases a query touched.
+"""
+
+import logging
+import sqlite3
+import threading
+from ast import literal_eval
+from collections import OrderedDict
+from pathlib import Path
+
+from snowimagerpro.core.methods.image_db import read_db
+from snowimagerpro.core.methods.journal import EditJournal, journal_path
+from snowimagerpro.core.methods.query import column
+
+logger = "core.catalog"
+
+# fields in the index, besides the ID
+CATALOG_FIELDS = ("date", "location", "meas_group", "img_type", "wavelength", "filepath")
+
+
+def db_stamp(db_path) -> str:
+    """Size and modification time of an image database and its journal."""
+
+    stamp = []
+    for fp in [Path(db_path), journal_path(db_path)]:
+        try:
+            stat = fp.stat()
+            stamp.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            stamp.append("-")
+
+    return "|".join(stamp)
+
+
+def meas_groups(value) -> list:
+    """The measurement groups of a `meas_group` value, as `ImageSet.load_db`
+    expands them."""
+
+    try:
+        groups = literal_eval(str(value))
+    except (ValueError, SyntaxError):
+        return [str(value)]
+
+    return [str(g) for g in groups] if isinstance(groups, list) else [str(value)]
+
+
+def _in(name, values, where, params):
+    if isinstance(values, (list, tuple, set)):
+        values = [str(v) for v in values]
+        where.append(f"{name} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    else:
+        where.append(f"{name} = ?")
+        params.append(str(values))
+
+
+def _between(name, limits, where, params):
+    low, high = limits
+    if low is not None:
+        where.append(f"{name} >= ?")
+        params.append(low)
+    if high is not None:
+        where.append(f"{name} <= ?")
+        params.append(high)
+
+
+class Catalog:
+    """Index of the entries of the registered image databases.
+
+    Args:
+        path (str | Path): The SQLite file of the index.
+        max_loaded (int): Loaded databases kept in memory.
+    """
+
+    def __init__(self, path, max_loaded=4):
+        self.path = Path(path)
+        self.max_loaded = max_loaded
+
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(self.path), check_same_thread=False)
+
+        # path -> (stamp, ImageDB), least recently used first; `_loading`
+        # holds the databases being read (e.g. warmed in the background)
+        self._loaded = OrderedDict()
+        self._loading = set()
+        self._cond = threading.Condition()
+
+        with self._lock, self._con:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            # a cache, it is rebuilt from the databases if lost
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS dbs (path TEXT PRIMARY KEY, stamp TEXT)"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS entries (db TEXT, ID INTEGER, "
+                "date TEXT, location TEXT, meas_group TEXT, img_type TEXT, "
+                "wavelength REAL, filepath TEXT)"
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS idx_db ON entries (db)")
+            self._con.execute(
+                "CREATE INDEX IF NOT EXISTS idx_date ON entries (date, location)"
+            )
+            self._con.execute(
+                "CREATE INDEX IF NOT EXISTS idx_location ON entries (location)"
+            )
+
+    @staticmethod
+    def _key(db_path) -> str:
+        return str(Path(db_path).resolve())
+
+    @property
+    def dbs(self) -> list:
+        """Paths of the registered databases."""
+
+        with self._lock:
+            return [row[0] for row in self._con.execute("SELECT path FROM dbs")]
+
+    def register(self, db_paths):
+        """Add databases to the catalog, they are indexed on the next query."""
+
+        with self._lock, self._con:
+            self._con.executemany(
+                "INSERT OR IGNORE INTO dbs VALUES (?, NULL)",
+                [(self._key(fp),) for fp in db_paths],
+            )
+
+    def unregister(self, db_paths):
+        keys = [(self._key(fp),) for fp in db_paths]
+
+        with self._lock, self._con:
+            self._con.executemany("DELETE FROM entries WHERE db = ?", keys)
+            self._con.executemany("DELETE FROM dbs WHERE path = ?", keys)
+
+        with self._cond:
+            for (key,) in keys:
+                self._loaded.pop(key, None)
+
+    def sync(self) -> list:
+        """Index the registered databases that changed since they were indexed.
+
+        Returns:
+            list: Paths of the databases indexed.
+        """
+
+        with self._lock:
+            stored = dict(self._con.execute("SELECT path, stamp FROM dbs"))
+
+        indexed = []
+        for key, stamp in stored.items():
+            current = db_stamp(key)
+            if current == stamp:
+                continue
+
+            if not Path(key).exists():
+                logging.getLogger(logger).warning(f"Database {key} not found")
+                rows = []
+            else:
+                try:
+                    rows = self._index_rows(key, self._load(key, current))
+                except Exception as e:
+                    logging.getLogger(logger).warning(f"Cannot index {key}: {e}")
+                    continue
+
+            with self._lock, self._con:
+                self._con.execute("DELETE FROM entries WHERE db = ?", (key,))
+                self._con.executemany(
+                    f"INSERT INTO entries VALUES ({', '.join('?' * 8)})", rows
+                )
+                self._con.execute(
+                    "UPDATE dbs SET stamp = ? WHERE path = ?", (current, key)
+                )
+            indexed.append(key)
+
+        if indexed:
+            logging.getLogger(logger).info(f"{len(indexed)} databases indexed")
+
+        return indexed
+
+    @staticmethod
+    def _index_rows(key, image_db):
+        columns = [column(image_db, name).tolist() for name in CATALOG_FIELDS]
+        ids = list(image_db.keys())
+        group = CATALOG_FIELDS.index("meas_group")
+
+        rows = []
+        for ID, *values in zip(ids, *columns):
+            values = [str(v) if not isinstance(v, float) else v for v in values]
+            for meas_group in meas_groups(values[group]):  # a row per group
+                values[group] = meas_group
+                rows.append((key, int(ID), *values))
+
+        return rows
+
+    def query(
+        self,
+        date=None,
+        date_range=None,
+        location=None,
+        meas_group=None,
+        img_type=None,
+        wavelength=None,
+        dbs=None,
+    ) -> dict:
+        """IDs of the entries matching all given filters, per database.
+
+        Args:
+            date, location, meas_group, img_type (optional): A value, or a
+                list of accepted values.
+            date_range (tuple, optional): (first, last) date, ISO formatted,
+                including the limits; either limit may be None.
+            wavelength (optional): A value, or a (min, max) range.
+            dbs (list, optional): Only search these databases.
+
+        Returns:
+            dict: Lists of IDs by database path, in the order of the database.
+        """
+
+        self.sync()
+
+        where, params = [], []
+        for name, wanted in [
+            ("date", date),
+            ("location", location),
+            ("meas_group", meas_group),
+            ("img_type", img_type),
+        ]:
+            if wanted is not None:
+                _in(name, wanted, where, params)
+
+        if date_range is not None:
+            _between("date", date_range, where, params)
+
+        if isinstance(wavelength, (list, tuple)):
+            _between("wavelength", wavelength, where, params)
+        elif wavelength is not None:
+            where.append("wavelength = ?")
+            params.append(float(wavelength))
+
+        if dbs is not None:
+            _in("db", [self._key(fp) for fp in dbs], where, params)
+
+        sql = "SELECT db, ID FROM entries"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY rowid"
+
+        with self._lock:
+            rows = self._con.execute(sql, params).fetchall()
+
+        found = {}
+        for db, ID in rows:
+            found.setdefault(db, {})[ID] = None  # once, entries of several groups
+
+        return {db: list(ids) for db, ids in found.items()}
+
+    def _load(self, key, stamp):
+        with self._cond:
+            while key in self._loading:
+                self._cond.wait()  # read by another thread
+
+            cached = self._loaded.get(key)
+            if cached is not None and cached[0] == stamp:
+                self._loaded.move_to_end(key)
+                return cached[1]
+
+            self._loading.add(key)
+
+        try:
+            image_db = read_db(key)
+            EditJournal.for_db(key).replay(image_db)  # edits not in the file yet
+        finally:
+            with self._cond:
+                self._loading.discard(key)
+                self._cond.notify_all()
+
+        with self._cond:
+            self._loaded[key] = (stamp, image_db)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+        return image_db
+
+    def load(self, db_path):
+        """The entries of a database, loaded once while it is unchanged.
+
+        The database is shared by all callers, use `take` for a copy to edit.
+        Loading a database in the background (e.g. the one the user is likely
+        to open next) makes the next `take` of it instant.
+        """
+
+        key = self._key(db_path)
+        return self._load(key, db_stamp(key))
+
+    def take(self, db_path):
+        """The loaded entries of a database if they are up to date, else None.
+
+        The database is removed from the catalog's memory, so the caller may
+        edit it.
+        """
+
+        key = self._key(db_path)
+        with self._cond:
+            while key in self._loading:
+                self._cond.wait()  # being warmed, wait instead of reading again
+            cached = self._loaded.pop(key, None)
+
+        if cached is not None and cached[0] == db_stamp(key):
+            return cached[1]
+        return None
+
+    def entries(self, **filters):
+        """The entries matching `filters` (see `query`).
+
+        Only the databases with matching entries are loaded.
+
+        Yields:
+            tuple: (database path, entry)
+        """
+
+        for db, ids in self.query(**filters).items():
+            image_db = self.load(db)
+            for ID in ids:
+                if ID in image_db:
+                    yield db, image_db[ID]
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+        with self._cond:
+            self._loaded.clear()
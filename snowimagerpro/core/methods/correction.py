@@ -0,0 +1,200 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Flat-field correction and reflectance calibration of image stacks.
+
+`ffc_refl_cal` runs both steps (see `Image.do_ffc` and `Image.do_refl_cal`)
+on a stack of frames sharing dark and reference in one pass, in place. The
+calibration coefficients only depend on the ROIs, they are computed from the
+corrected ROI pixels before the pass. The pass works on blocks of rows small
+enough to stay in cache, all frames of a block in turn, so the dark and
+correction frame are read from memory once and every frame is read and
+written once.
+"""
+
+import concurrent.futures
+
+import numpy as np
+
+from .processing import rel2pix
+
+# ffc: clip((img - dark) / (ref - ref_dark) * FFC_SCALE, *FFC_CLIP)
+FFC_SCALE = 0.5
+FFC_CLIP = (-0.25, 1.25)
+
+# reflectance of the gray and white targets
+GRAY = 0.498
+WHITE = 0.94
+
+# bytes of a block of rows of one frame
+BLOCK_BYTES = 256 * 2**10
+
+
+def correction_frame(ref, ref_dark, dtype=np.float32) -> np.ndarray:
+    """`FFC_SCALE / (ref - ref_dark)`, zeros of the difference replaced by
+    1e-10 as in `Image.do_ffc`."""
+
+    corr = np.subtract(ref, ref_dark, dtype=dtype)
+    corr[corr == 0] = 1e-10
+    np.divide(FFC_SCALE, corr, out=corr, dtype=dtype)
+
+    return corr
+
+
+def refl_cal_coefficients(avs_gray, avs_white, dtype=np.float32):
+    """Slope and offset of the reflectance calibration, per channel.
+
+    Args:
+        avs_gray, avs_white (list): Per target and channel averages of the
+            corrected image in the gray and white ROIs.
+
+    Returns:
+        tuple: (m, b) arrays, the calibrated image is ``m * img + b``.
+    """
+
+    # per channel mean of averages (i.e. averaging targets)
+    mean_gray = np.nanmean(avs_gray, axis=0)
+    mean_white = np.nanmean(avs_white, axis=0)
+
+    m1 = (WHITE - GRAY) / (mean_white - mean_gray)
+    m2 = (WHITE - 0.000) / (mean_white - 0)
+    m3 = (GRAY - 0.00) / (mean_gray - 0)
+
+    m = (3 * m1 + m2 + m3) / 5  # bias towards m1
+
+    b1 = WHITE - (m * mean_white)
+    b2 = GRAY - (m * mean_gray)
+
+    b = (b1 + b2) / 2
+
+    # float64 coefficients would promote the image
+    return m.astype(dtype), b.astype(dtype)
+
+
+def ffc_roi_averages(frame, dark, corr, ROI):
+    """Per ROI and channel averages of the flat-field corrected `frame`,
+    computed from the ROI pixels only (see `average_in_ROI`)."""
+
+    frame = np.atleast_3d(frame)
+    size = [frame.shape[1], frame.shape[0]]
+
+    avs = []
+    for roi in ROI:
+        (x0, y0), (x1, y1) = rel2pix(roi, size)
+        window = np.s_[y0:y1, x0:x1]
+
+        patch = np.subtract(frame[window], np.atleast_3d(dark)[window], dtype=corr.dtype)
+        patch *= np.atleast_3d(corr)[window]
+        np.clip(patch, *FFC_CLIP, out=patch)
+
+        avs.append(list(np.nanmean(np.nanmean(patch, axis=0), axis=0)))
+
+    return avs
+
+
+def _blocks(shape, itemsize, n_bands):
+    rows = shape[1]
+    row_bytes = max(int(np.prod(shape[2:])) * itemsize, 1)
+    block = max(BLOCK_BYTES // row_bytes, 1)
+
+    band = -(-rows // n_bands)
+    for start in range(0, rows, band):
+        yield [
+            slice(r, min(r + block, start + band, rows))
+            for r in range(start, min(start + band, rows), block)
+        ]
+
+
+def _rows(frame, shape):
+    # (H, W[, C]) frame broadcast to `shape` as (H, W * C)
+    frame = np.asarray(frame)
+    if frame.ndim < len(shape):
+        frame = frame[..., np.newaxis]
+    return np.ascontiguousarray(np.broadcast_to(frame, shape)).reshape(shape[0], -1)
+
+
+def ffc_refl_cal(stack, dark, corr, ROIs=None, workers=4):
+    """Flat-field correct and calibrate the frames of `stack` in place.
+
+    Args:
+        stack (np.ndarray): (N, H, W, C) or (N, H, W) frames sharing dark and
+            reference, of a float dtype (float32 by default in `ImageSet`).
+        dark (np.ndarray): (H, W[, C]) dark frame of the measurements.
+        corr (np.ndarray): Correction frame of the reference, see
+            `correction_frame`.
+        ROIs (list, optional): Gray and white ROIs (`ImageMetadata.ROI`) of
+            each frame. Without ROIs the frames are flat-field corrected only.
+        workers (int): Bands of rows processed in parallel.
+
+    Returns:
+        tuple: (m, b) calibration coefficients, (N, C) arrays (None without
+            ROIs).
+    """
+
+    if not np.issubdtype(stack.dtype, np.floating):
+        raise TypeError(f"stack must be of a float dtype, not {stack.dtype}")
+    if not stack.flags.c_contiguous:
+        raise ValueError("stack must be C-contiguous to be corrected in place")
+
+    n = len(stack)
+    dtype = stack.dtype
+
+    m = b = None
+    if ROIs is not None:
+        coefficients = [
+            refl_cal_coefficients(
+                ffc_roi_averages(stack[i], dark, corr, ROIs[i][0]),
+                ffc_roi_averages(stack[i], dark, corr, ROIs[i][1]),
+                dtype,
+            )
+            for i in range(n)
+        ]
+        m = np.array([c[0] for c in coefficients], dtype=dtype)
+        b = np.array([c[1] for c in coefficients], dtype=dtype)
+
+    # rows of a frame as flat (H, W * C) arrays, so the (C,) coefficients
+    # become a row of W * C values and numpy loops over whole rows
+    frames = stack.reshape(n, stack.shape[1], -1)
+    dark = _rows(dark, stack.shape[1:])
+    corr = _rows(corr, stack.shape[1:])
+    if m is not None:
+        m_rows = np.tile(m, (1, frames.shape[2] // m.shape[1]))
+        b_rows = np.tile(b, (1, frames.shape[2] // b.shape[1]))
+
+    def _band(blocks):
+        for rows in blocks:
+            d = dark[rows]
+            c = corr[rows]
+            for i in range(n):
+                block = frames[i, rows]
+                np.subtract(block, d, out=block)
+                np.multiply(block, c, out=block)
+                np.clip(block, *FFC_CLIP, out=block)
+                if m is not None:
+                    np.multiply(block, m_rows[i], out=block)
+                    np.add(block, b_rows[i], out=block)
+
+    bands = list(_blocks(stack.shape, stack.itemsize, workers))
+    if workers > 1 and len(bands) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_band, bands))
+    else:
+        for blocks in bands:
+            _band(blocks)
+
+    return m, b
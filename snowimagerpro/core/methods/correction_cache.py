@@ -0,0 +1,252 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Cache of the correction frames and master darks of the flat-field correction.
+
+All measurement images linked to the same reference and dark share the
+correction frame ``0.5 / (ref - ref_dark)`` (see `correction.correction_frame`),
+and a master dark averaged from several dark frames is the same for all
+images of a dark group. Both are computed once and kept in memory, and in
+.npy files when the cache has a folder, so later runs reuse them.
+
+Frames are keyed by the path, size and modification time of their source
+files, their dtype and shape and the version of SnowImagerPro (the decoders
+change between versions): modified files miss the cache. Images without a
+file are keyed by a digest of their data. Hashing the loaded data of every
+image would cost as much as computing the frames.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from snowimagerpro import __VERSION__
+from snowimagerpro.core.methods.correction import correction_frame
+
+logger = "core.correction_cache"
+
+
+def data_key(data) -> str:
+    """Digest of the values of an array."""
+
+    digest = hashlib.blake2b(f"{data.dtype.str}{data.shape}".encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(data).data)
+
+    return digest.hexdigest()
+
+
+class CorrectionCache:
+    def __init__(self, root=None, max_frames=8, budget=512 * 2**20):
+        """
+        Args:
+            root (str | Path, optional): Folder of the cache files, in memory
+                only if None.
+            max_frames (int): Frames kept in memory.
+            budget (int): Maximum size of the cache folder in bytes.
+        """
+
+        self.root = Path(root) if root is not None else None
+        self.max_frames = max_frames
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._frames = OrderedDict()  # key -> frame, least recently used first
+
+        # key -> bytes of the file, least recently used first; read from the
+        # folder on first use and kept up to date by `_write` and `evict`
+        self._files = None
+        self._total = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def source_key(self, img, data_dir=None) -> str:
+        """Path, size and modification time of the file of `img`, or a digest
+        of its data without a file."""
+
+        meta = getattr(img, "_meta", None)
+        fp = getattr(meta, "filepath", None)
+        if fp is not None:
+            fp = Path(data_dir) / fp if data_dir else Path(fp)
+            try:
+                stat = os.stat(fp)
+                return f"{fp.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+            except OSError:
+                pass  # synthetic or moved image
+
+        return data_key(img._data)
+
+    def correction_frame(self, ref, ref_darks, dtype, data_dir=None):
+        """`correction.correction_frame` of the image `ref`.
+
+        Args:
+            ref (Image): The reference image.
+            ref_darks (list): Dark images of the reference, averaged (see
+                `master_dark`) if there are several.
+        """
+
+        sources = [self.source_key(ref, data_dir)]
+        sources += sorted(self.source_key(img, data_dir) for img in ref_darks)
+
+        return self._get(
+            "corr",
+            sources,
+            dtype,
+            ref._data.shape,
+            lambda: correction_frame(
+                ref._data, self.master_dark(ref_darks, dtype, data_dir), dtype
+            ),
+        )
+
+    def master_dark(self, darks, dtype, data_dir=None):
+        """Mean of the dark images `darks` in `dtype`, the data of a single
+        dark as is."""
+
+        if len(darks) == 1:
+            return darks[0]._data
+
+        def _mean():
+            total = np.zeros(darks[0]._data.shape, dtype=dtype)
+            for img in darks:
+                np.add(total, img._data, out=total, dtype=dtype)
+            total /= len(darks)
+            return total
+
+        sources = sorted(self.source_key(img, data_dir) for img in darks)
+
+        return self._get("dark", sources, dtype, darks[0]._data.shape, _mean)
+
+    def _file(self, key):
+        return self.root / key[:2] / f"{key}.npy"
+
+    def _get(self, kind, sources, dtype, shape, compute):
+        dtype = np.dtype(dtype)
+        fields = [__VERSION__, kind, *sources, dtype.str, str(tuple(shape))]
+        key = hashlib.blake2b("|".join(fields).encode(), digest_size=16).hexdigest()
+
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                self.hits += 1
+                return frame
+
+        frame = self._read(key)
+        if frame is None:
+            logging.getLogger(logger).info(f"Computing {kind} frame {key}")
+            frame = compute()
+            self._write(key, frame)
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        # shared by all images of the group
+        frame.flags.writeable = False
+
+        with self._lock:
+            self._frames[key] = frame
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+
+        return frame
+
+    def _read(self, key):
+        if self.root is None:
+            return None
+
+        path = self._file(key)
+        try:
+            frame = np.load(path)
+        except (OSError, ValueError):
+            return None
+
+        os.utime(path)  # mark as recently used
+        with self._lock:
+            if self._files is not None and key in self._files:
+                self._files.move_to_end(key)
+
+        return frame
+
+    def _write(self, key, frame):
+        if self.root is None:
+            return
+
+        path = self._file(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            # write to a temporary file first, readers never see partial files
+            tmp = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, frame)
+            os.replace(tmp, path)
+            size = path.stat().st_size
+        except OSError as e:
+            logging.getLogger(logger).warning(f"Cannot store frame {key}: {e}")
+            return
+
+        with self._lock:
+            if self._files is not None:
+                self._total += size - self._files.pop(key, 0)
+                self._files[key] = size
+
+        self.evict()
+
+    def _scan(self):
+        # lock held
+        files = []
+        for path in self.root.glob("*/*.npy"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+
+        self._files = OrderedDict((key, size) for _, key, size in sorted(files))
+        self._total = sum(self._files.values())
+
+    def evict(self):
+        """Remove the least recently used files until the budget is met.
+
+        The folder is scanned once, later calls only remove files from the
+        index kept in memory.
+        """
+
+        if self.root is None:
+            return
+
+        with self._lock:
+            if self._files is None:
+                self._scan()
+
+            while self._total > self.budget and self._files:
+                key, size = self._files.popitem(last=False)
+                self._file(key).unlink(missing_ok=True)
+                self._total -= size
+
+    def clear(self):
+        """Forget the frames in memory (the files are kept)."""
+
+        with self._lock:
+            self._frames.clear()
+
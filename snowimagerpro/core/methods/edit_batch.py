@@ -0,0 +1,88 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Edits of an image database grouped into one step (see `ImageSet.batch`).
+
+A batch remembers the state of every entry before its first edit, which is
+all that is needed to relink, save and undo the edits at once.
+"""
+
+import logging
+
+from snowimagerpro.core.metadata import ImageMetadata
+from snowimagerpro.core.methods.image_db import to_row
+
+logger = "core.edit_batch"
+
+
+class EditBatch:
+    """The entries of `image_db` edited, added or removed in one step.
+
+    Args:
+        image_db (dict): Mapping of IDs to ImageMetadata.
+        label (str): Description of the step, e.g. for an undo menu.
+    """
+
+    def __init__(self, image_db, label=""):
+        self.image_db = image_db
+        self.label = label
+
+        # `to_row` of the entries before their first edit, None if added
+        self.before = {}
+
+    def __len__(self):
+        return len(self.before)
+
+    @property
+    def keys(self) -> list:
+        return list(self.before)
+
+    def record(self, keys):
+        """Remember the entries `keys` before they are edited or removed.
+
+        Keys of entries that do not exist yet are recorded as added.
+        """
+
+        for key in keys:
+            key = int(key)
+            if key not in self.before:
+                entry = self.image_db.get(key)
+                self.before[key] = None if entry is None else to_row(entry)
+
+    def split_keys(self):
+        """Returns (keys of the entries in the db, keys of removed entries)."""
+
+        present, removed = [], []
+        for key in self.before:
+            (present if key in self.image_db else removed).append(key)
+        return present, removed
+
+    def undo(self):
+        """Restore the recorded entries, remove the added ones."""
+
+        fields = list(ImageMetadata.model_fields)
+
+        for key, row in self.before.items():
+            if row is None:
+                self.image_db.pop(key, None)
+            else:
+                self.image_db[key] = ImageMetadata(**dict(zip(fields, row)))
+
+        logging.getLogger(logger).info(
+            f"Undone '{self.label}' ({len(self.before)} entries)"
+        )
@@ -48,6 +48,9 @@ def error_msg(msg):
 
 
 def expand_db_by_meas_group(db):
+    if hasattr(db, "expand_by_meas_group"):
+        return db.expand_by_meas_group()  # ImageDB, without building all entries
+
     db_out = {}
     for key, entry in db.items():
         meas_grps = literal_eval(entry.meas_group)
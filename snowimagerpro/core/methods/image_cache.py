@@ -0,0 +1,88 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""In-memory cache of decoded images with a memory budget."""
+
+import threading
+from collections import OrderedDict
+
+
+def image_nbytes(img) -> int:
+    data = getattr(img, "_data", None)
+    return 0 if data is None else data.nbytes
+
+
+class ImageLRU:
+    """Least recently used cache of decoded `Image` objects.
+
+    The size of an entry is the size of its image data. Entries are dropped,
+    least recently used first, when the total exceeds `budget` bytes. An
+    image larger than the budget is not cached. Thread safe.
+    """
+
+    def __init__(self, budget=1024 * 2**20):
+        self.budget = budget
+        self.nbytes = 0
+
+        self._lock = threading.Lock()
+        self._images = OrderedDict()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._images
+
+    def __len__(self):
+        with self._lock:
+            return len(self._images)
+
+    def get(self, key):
+        """Return the image stored under `key` (and mark it used), or None."""
+
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+
+        return img
+
+    def put(self, key, img):
+        size = image_nbytes(img)
+
+        with self._lock:
+            if key in self._images:
+                self.nbytes -= image_nbytes(self._images.pop(key))
+
+            if size > self.budget:
+                return
+
+            self._images[key] = img
+            self.nbytes += size
+
+            while self.nbytes > self.budget:
+                _, dropped = self._images.popitem(last=False)
+                self.nbytes -= image_nbytes(dropped)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._images:
+                self.nbytes -= image_nbytes(self._images.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.nbytes = 0
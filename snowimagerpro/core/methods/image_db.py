@@ -0,0 +1,940 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Loading and saving of image databases (CSV or SQLite files).
+
+The CSV is parsed column by column: numeric columns are converted in bulk,
+nested list columns (ROI, coordinates, ...) are parsed once per distinct
+value with a JSON parser. Rows that fail the fast path are validated by
+`ImageMetadata` itself, so the accepted values are the same as before; rows
+that fail there are reported and skipped.
+
+The entries stay in the columns (see `ImageDB`), no `ImageMetadata` object is
+built per entry. Values are validated by pydantic when they are assigned.
+
+Databases stored in SQLite are saved incrementally, only the entries that
+changed since loading are written.
+"""
+
+import csv
+import json
+import logging
+import sqlite3
+import sys
+from ast import literal_eval
+from collections.abc import MutableMapping
+from pathlib import Path
+
+import numpy as np
+from pydantic import ValidationError
+
+from snowimagerpro.core.metadata import ImageMetadata, stringCleaner
+from snowimagerpro.core.methods.helper import create_uuid
+
+logger = "core.image_db"
+
+# numeric columns, stored as arrays
+NUMERIC_FIELDS = {
+    "ID": np.int64,
+    "wavelength": np.float64,
+    "drk_group": np.int64,
+    "ref_group": np.int64,
+    "px_2_mm": np.float64,
+}
+
+# nesting depth of the list columns, the innermost lists hold floats
+LIST_FIELDS = {
+    "ROI": 4,
+    "coords_pix": 1,
+    "coords_mm": 1,
+    "stitch_at_mm": 1,
+    "affine_points": 2,
+    "trafo_points": 2,
+}
+
+
+def as_nested_floats(value, depth):
+    """Check that `value` is a list nested `depth` times, with float leaves."""
+
+    if not isinstance(value, list):
+        raise ValueError(f"expected a list, got {value!r}")
+
+    if depth == 1:
+        out = []
+        for v in value:
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                raise ValueError(f"expected a number, got {v!r}")
+            out.append(float(v))
+        return out
+
+    return [as_nested_floats(v, depth - 1) for v in value]
+
+
+def parse_list(s, depth):
+    """Parse a nested list of floats as written by `ImageSet.save_db`."""
+
+    s = stringCleaner(s)
+    try:
+        value = json.loads(s)
+    except ValueError:
+        value = literal_eval(s)  # e.g. trailing commas
+
+    return as_nested_floats(value, depth)
+
+
+def parse_list_column(values, depth):
+    """Parse a column of nested lists, each distinct string only once.
+
+    The values are kept as normalised JSON, decoding it is the fastest way
+    to give every entry its own copy of the lists.
+
+    Returns:
+        tuple: (list of JSON strings, rows that could not be parsed)
+    """
+
+    parsed = {}
+    out = []
+    bad = []
+
+    for row, s in enumerate(values):
+        if s not in parsed:
+            try:
+                parsed[s] = json.dumps(parse_list(s, depth))
+            except Exception:
+                parsed[s] = None
+        if parsed[s] is None:
+            bad.append(row)
+        out.append(parsed[s])
+
+    return out, bad
+
+
+def parse_numeric_column(values, dtype):
+    """Returns (array, rows that could not be converted)."""
+
+    convert = int if np.dtype(dtype).kind == "i" else float
+
+    try:
+        return np.array([convert(s) for s in values], dtype=dtype), []
+    except (TypeError, ValueError, OverflowError):
+        pass
+
+    out = np.zeros(len(values), dtype=dtype)
+    bad = []
+    for row, s in enumerate(values):
+        try:
+            out[row] = convert(s)
+        except (TypeError, ValueError, OverflowError):
+            bad.append(row)
+
+    return out, bad
+
+
+def to_points(values) -> np.ndarray:
+    """(n, 2) array of the first two values of the lists (or JSON lists)
+    `values`, NaN where a list has fewer values."""
+
+    points = np.full((len(values), 2), np.nan)
+    for i, value in enumerate(values):
+        point = (json.loads(value) if isinstance(value, str) else value)[:2]
+        points[i, : len(point)] = point
+
+    return points
+
+
+def validate_field(name, value):
+    """Validate `value` for field `name` as `ImageMetadata` does on assignment."""
+
+    model = ImageMetadata.model_construct()
+    ImageMetadata.__pydantic_validator__.validate_assignment(model, name, value)
+    return getattr(model, name)
+
+
+class MetadataRow:
+    """View of one entry of an `ImageDB`, with the attributes and methods of
+    `ImageMetadata`.
+
+    Reading an attribute reads the columns of the db, assigning validates the
+    value like `ImageMetadata` and writes it to the columns. List fields are
+    parsed on first access and kept as lists, so they can be edited in place
+    (e.g. ``row.ROI[0].append(roi)``). Copies are `ImageMetadata` objects.
+    """
+
+    __slots__ = ("_db", "_row")
+
+    model_fields = ImageMetadata.model_fields
+
+    def __init__(self, db, row):
+        object.__setattr__(self, "_db", db)
+        object.__setattr__(self, "_row", row)
+
+    def __getattr__(self, name):
+        if name in ImageMetadata.model_fields:
+            return self._db._get(self._row, name)
+        raise AttributeError(f"'MetadataRow' object has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+        if name not in ImageMetadata.model_fields:
+            raise AttributeError(f"'MetadataRow' object has no field '{name}'")
+        self._db._set(self._row, name, value)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __copy__(self):
+        return self.to_model()
+
+    def __deepcopy__(self, memo):
+        return self.to_model()
+
+    def __repr__(self):
+        return f"MetadataRow({self.to_model()!r})"
+
+    def to_model(self) -> ImageMetadata:
+        """The entry as an independent `ImageMetadata`."""
+        return self._db._to_model(self._row)
+
+    def model_copy(self, update=None, deep=False):
+        return self.to_model().model_copy(update=update)
+
+    def by_date(self):
+        return self.date
+
+    def by_location(self):
+        return self.location
+
+    def by_meas_group(self):
+        return self.meas_group
+
+    def by_img_type(self):
+        return self.img_type
+
+    def by_wavelength(self):
+        return self.wavelength
+
+    def by_ID(self):
+        return self.ID
+
+    def to_list(self):
+        return [getattr(self, key) for key in ImageMetadata.model_fields]
+
+    @classmethod
+    def to_key_list(cls) -> list:
+        return ImageMetadata.to_key_list()
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in ImageMetadata.model_fields}
+
+    def model_dump(self):
+        return self.to_model().model_dump()
+
+    def to_string(self):
+        return self.to_model().to_string()
+
+    def update(self, new_data):
+        for key, value in new_data.items():
+            setattr(self, key, str(value))
+
+
+class ImageDB(MutableMapping):
+    """Image database, mapping IDs to entries with the attributes of
+    `ImageMetadata` (`MetadataRow` views).
+
+    The entries are stored as one column per field: numeric fields in NumPy
+    arrays, text fields as interned strings, list fields as JSON until they
+    are first accessed. Values are validated by `ImageMetadata` when they are
+    assigned, not when they are read. `assign` edits many entries at once.
+    Iteration follows the order of the file.
+    """
+
+    def __init__(self, columns=None, bad_rows=None):
+        self._columns = {}
+        self._size = 0  # rows in use, the columns may be longer
+        self._rows = {}  # ID -> row in _columns
+
+        if columns:
+            self._size = len(columns["ID"])
+            for key in ImageMetadata.model_fields:
+                self._columns[key] = _as_column(key, columns[key])
+
+        # (line number, error message) of the rows that were skipped
+        self.bad_rows = bad_rows or []
+
+        # SQLite file the entries were loaded from or last saved to, and the
+        # stored state of each entry (row in _columns or `to_row` tuple)
+        self.source = None
+        self._baseline = {}
+
+        # stored values of the fields edited (or lists handed out, which may
+        # be edited in place) since the last save, by row and field
+        self._touched = {}
+
+        # rows of the entries in order (see `column`)
+        self._layout = None
+
+    @classmethod
+    def from_columns(cls, columns, bad_rows=None):
+        db = cls(columns, bad_rows)
+        for row, ID in enumerate(db._columns["ID"][: db._size].tolist()):
+            db._rows[ID] = row
+        db._baseline = dict(db._rows)
+        db._layout = None
+        return db
+
+    def _append(self, values):
+        """Add a row with the stored `values` (see `_stored_values`)."""
+
+        row = self._size
+        if not self._columns or row == len(self._columns["ID"]):
+            capacity = max(2 * row, 16)
+            for key in ImageMetadata.model_fields:
+                column = np.empty(capacity, dtype=NUMERIC_FIELDS.get(key, object))
+                if key in self._columns:
+                    column[:row] = self._columns[key][:row]
+                self._columns[key] = column
+
+        for key, value in values.items():
+            self._columns[key][row] = value
+        self._size += 1
+
+        return row
+
+    def _stored_values(self, entry):
+        """Values of `entry` (`ImageMetadata` or `MetadataRow`) for a new row."""
+
+        values = {}
+        for key in ImageMetadata.model_fields:
+            value = getattr(entry, key)
+            values[key] = json.dumps(value) if key in LIST_FIELDS else _cell(key, value)
+
+        return values
+
+    def _touch(self, row, names):
+        touched = self._touched.setdefault(row, {})
+        for name in names:
+            if name not in touched:
+                touched[name] = _stored_cell(name, self._columns[name][row])
+
+    def _touch_rows(self, rows, name):
+        """`_touch` of field `name` for an array of rows."""
+
+        column = self._columns[name]
+        for row, value in zip(rows.tolist(), column[rows].tolist()):
+            touched = self._touched.setdefault(row, {})
+            if name not in touched:
+                touched[name] = _stored_cell(name, value)
+
+    def _get(self, row, name):
+        value = self._columns[name][row]
+
+        if name in NUMERIC_FIELDS:
+            return value.item()
+
+        if name in LIST_FIELDS:
+            # the caller may edit the list in place
+            self._touch(row, [name])
+            if isinstance(value, str):
+                value = json.loads(value)
+                self._columns[name][row] = value
+
+        return value
+
+    def _set(self, row, name, value):
+        value = validate_field(name, value)
+        if name not in LIST_FIELDS:
+            value = _cell(name, value)
+
+        self._touch(row, [name])
+        self._columns[name][row] = value
+
+    def _to_model(self, row):
+        values = {}
+        for key, column in self._columns.items():
+            value = column[row]
+            if key in LIST_FIELDS:
+                value = json.loads(value if isinstance(value, str) else json.dumps(value))
+            elif key in NUMERIC_FIELDS:
+                value = value.item()
+            values[key] = value
+
+        return ImageMetadata.model_construct(**values)
+
+    def _stored_row(self, row):
+        """`to_row` of the entry in row `row` of the columns."""
+
+        return tuple(
+            _stored_cell(key, column[row]) for key, column in self._columns.items()
+        )
+
+    def _saved_row(self, row):
+        """`to_row` of the entry in row `row` before the unsaved edits."""
+
+        touched = self._touched.get(row, {})
+        return tuple(
+            touched[key] if key in touched else _stored_cell(key, column[row])
+            for key, column in self._columns.items()
+        )
+
+    def to_rows(self):
+        """`to_row` tuples of all entries, in order."""
+
+        for row in self._rows.values():
+            yield self._stored_row(row)
+
+    def __getitem__(self, key):
+        return MetadataRow(self, self._rows[key])
+
+    def __setitem__(self, key, value):
+        values = self._stored_values(value)
+
+        if key in self._rows:
+            row = self._rows[key]
+            self._touch(row, values)
+            for name, v in values.items():
+                self._columns[name][row] = v
+        else:
+            self._rows[key] = self._append(values)
+            self._layout = None
+
+    def __delitem__(self, key):
+        del self._rows[key]
+        self._layout = None
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return f"ImageDB({len(self)} entries, {len(self.bad_rows)} bad rows)"
+
+    def field(self, key, name):
+        """Value of field `name` of entry `key`, for reading only."""
+
+        value = self._columns[name][self._rows[key]]
+        if name in LIST_FIELDS:
+            return json.loads(value) if isinstance(value, str) else value
+        return value.item() if name in NUMERIC_FIELDS else value
+
+    def assign(self, keys, **values):
+        """Set fields of the entries `keys` to the same values.
+
+        Each value is validated once, then written to all rows at once.
+
+        Example: ``image_db.assign(keys, wavelength=940, img_type="ref")``.
+        """
+
+        rows = np.fromiter(
+            (self._rows[key] for key in keys), dtype=np.int64, count=len(keys)
+        )
+
+        for name, value in values.items():
+            if name not in ImageMetadata.model_fields:
+                raise AttributeError(f"ImageMetadata has no field '{name}'")
+
+            value = validate_field(name, value)
+            if name in LIST_FIELDS:
+                value = json.dumps(value)  # every row parses its own copy
+            else:
+                value = _cell(name, value)
+
+            self._touch_rows(rows, name)
+            self._columns[name][rows] = value
+
+    def _row_layout(self):
+        """Keys of the entries and their rows in the columns, in order."""
+
+        if self._layout is None:
+            keys = np.fromiter(self._rows.keys(), dtype=np.int64, count=len(self))
+            rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self))
+            self._layout = (keys, rows)
+
+        return self._layout
+
+    def keys_array(self) -> np.ndarray:
+        """Keys of all entries as an array, in order."""
+        return self._row_layout()[0].copy()
+
+    def column(self, name) -> np.ndarray:
+        """Values of field `name` of all entries, in order.
+
+        Numeric fields are returned as arrays of their dtype, the other fields
+        as object arrays (list fields as JSON strings).
+        """
+
+        _, rows = self._row_layout()
+        out = self._columns[name][rows] if self._columns else np.empty(0)
+
+        if name in LIST_FIELDS:
+            for pos, value in enumerate(out.tolist()):
+                if not isinstance(value, str):
+                    out[pos] = json.dumps(value)
+
+        return out
+
+    def points(self, name) -> np.ndarray:
+        """First two values of the list field `name` of all entries, as an
+        (n, 2) array (NaN where a list is shorter), see `column`."""
+
+        _, rows = self._row_layout()
+        if not self._columns:
+            return np.empty((0, 2))
+
+        # each distinct JSON value is parsed once
+        values = self._columns[name][rows].tolist()
+        distinct = {}
+        index = np.empty(len(values), dtype=np.int64)
+        parsed = []
+        for pos, value in enumerate(values):
+            if isinstance(value, str):
+                i = distinct.get(value)
+                if i is None:
+                    i = distinct[value] = len(parsed)
+                    parsed.append(value)
+            else:
+                i = len(parsed)
+                parsed.append(value)
+            index[pos] = i
+
+        return to_points(parsed)[index]
+
+    def _stored_state(self, key):
+        """`to_row` of entry `key` as last loaded or saved, None if new."""
+
+        stored = self._baseline.get(key)
+        if isinstance(stored, int):
+            stored = self._saved_row(stored)
+        return stored
+
+    def changes(self):
+        """Entries changed, added and removed since loading or `mark_saved`.
+
+        Entries that were not edited (or whose lists were not handed out)
+        cannot have changed and are not compared.
+
+        Returns:
+            tuple: (list of (ID, `to_row` tuple) to write, list of removed IDs)
+        """
+
+        upserts = []
+        for key, row in self._rows.items():
+            if row not in self._touched and self._baseline.get(key) == row:
+                continue
+
+            current = self._stored_row(row)
+            if current != self._stored_state(key):
+                upserts.append((key, current))
+
+        deletes = [key for key in self._baseline if key not in self._rows]
+
+        return upserts, deletes
+
+    def mark_saved(self, source, upserts=None):
+        """Take the current entries as the stored state of `source`.
+
+        Args:
+            source (str): The SQLite file written.
+            upserts (list): Rows written by an incremental save (see
+                `changes`), None after writing all entries.
+        """
+
+        if upserts is None:
+            self._baseline = dict(self._rows)
+            self._touched = {}
+        else:
+            written = dict(upserts)
+            baseline = {}
+            for key, row in self._rows.items():
+                if row not in self._touched and self._baseline.get(key) == row:
+                    baseline[key] = row  # not edited
+                    continue
+
+                stored = written[key] if key in written else self._stored_state(key)
+                if stored is None:
+                    continue
+
+                # rows unchanged since the write need no saved values any more
+                if self._stored_row(row) == stored:
+                    self._touched.pop(row, None)
+                    baseline[key] = row
+                else:
+                    baseline[key] = stored
+
+            self._baseline = baseline
+
+        self.source = source
+
+    def expand_by_meas_group(self):
+        """Split entries with a list of measurement groups into one entry per
+        group (with new IDs), see `helper.expand_db_by_meas_group`."""
+
+        rows = {}
+        for key, row in self._rows.items():
+            meas_group = str(self._columns["meas_group"][row])
+
+            groups = None
+            if meas_group.lstrip().startswith("["):
+                try:
+                    groups = literal_eval(meas_group)
+                except (ValueError, SyntaxError):
+                    pass
+
+            if not isinstance(groups, list):
+                rows[key] = row
+                continue
+
+            values = {}
+            for name, column in self._columns.items():
+                value = column[row]
+                if name in LIST_FIELDS and not isinstance(value, str):
+                    value = json.dumps(value)  # the copies get their own lists
+                values[name] = value
+
+            for group in groups:
+                new_key = create_uuid()
+                values.update(meas_group=sys.intern(str(group)), ID=new_key)
+                rows[new_key] = self._append(values)
+
+        self._rows = rows
+        self._layout = None
+
+        return self
+
+
+def _stored_cell(key, value):
+    """Value of a cell of field `key` as in `to_row`."""
+
+    if key in NUMERIC_FIELDS:
+        return value.item() if isinstance(value, np.generic) else value
+    if key in LIST_FIELDS:
+        return value if isinstance(value, str) else json.dumps(value)
+    return str(value)
+
+
+def _cell(key, value):
+    """Stored value of the (validated) non-list field `key`."""
+
+    if key == "filepath":
+        return Path(value)
+    if key in NUMERIC_FIELDS:
+        return value
+    return sys.intern(str(value))
+
+
+def _as_column(key, values):
+    """Column array of field `key` from a list or array of loaded values."""
+
+    if key in NUMERIC_FIELDS:
+        return np.asarray(values, dtype=NUMERIC_FIELDS[key])
+
+    column = np.empty(len(values), dtype=object)
+    if key in LIST_FIELDS or key == "filepath":
+        column[:] = list(values)
+    else:
+        column[:] = [sys.intern(str(v)) for v in values]
+
+    return column
+
+
+def read_csv(path) -> ImageDB:
+    """Load an image database CSV file into an `ImageDB`.
+
+    Args:
+        path (str | Path): The CSV file, as written by `ImageSet.save_db`.
+
+    Returns:
+        ImageDB: The entries of all valid rows; the skipped rows and their
+            errors are listed in `bad_rows`.
+    """
+
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+
+        lines = []
+        rows = []
+        bad_rows = []
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(header):
+                bad_rows.append(
+                    (reader.line_num, f"{len(row)} values for {len(header)} columns")
+                )
+                continue
+            lines.append(reader.line_num)
+            rows.append(row)
+
+    return from_rows(header, rows, lines, bad_rows, source=path)
+
+
+def from_rows(header, rows, lines, bad_rows, source=""):
+    """Build an `ImageDB` from the rows of a table with columns `header`.
+
+    Args:
+        header (list): Field names of the columns.
+        rows (list): Rows of values (strings or numbers).
+        lines (list): Line (or row) number of each row, for error messages.
+        bad_rows (list): (line, message) of rows already rejected.
+        source (str | Path): Name of the table, for error messages.
+    """
+
+    fields = ImageMetadata.model_fields
+
+    keys = [key for key in header if key in fields]
+    raw = {key: [] for key in keys}
+    positions = [header.index(key) for key in keys]
+    for row in rows:
+        for key, pos in zip(keys, positions):
+            raw[key].append(row[pos])
+
+    # bulk conversion, a row failing any column is validated by pydantic
+    columns = {}
+    failed = set()
+    for key in keys:
+        if key in NUMERIC_FIELDS:
+            columns[key], bad = parse_numeric_column(raw[key], NUMERIC_FIELDS[key])
+        elif key in LIST_FIELDS:
+            columns[key], bad = parse_list_column(raw[key], LIST_FIELDS[key])
+        elif key == "filepath":
+            columns[key], bad = [Path(str(s)) for s in raw[key]], []
+        else:
+            columns[key], bad = raw[key], []
+        failed.update(bad)
+
+    # fields missing in the file get their defaults
+    n = len(rows)
+    for key, field in fields.items():
+        if key in columns:
+            continue
+        default = field.get_default(call_default_factory=True)
+        if key in NUMERIC_FIELDS:
+            columns[key] = np.full(n, default, dtype=NUMERIC_FIELDS[key])
+        elif key in LIST_FIELDS:
+            columns[key] = [json.dumps(default)] * n
+        else:
+            columns[key] = [default] * n
+
+    skipped = set()
+    for row in sorted(failed):
+        try:
+            meta = ImageMetadata(**{key: raw[key][row] for key in keys})
+        except (ValidationError, ValueError, SyntaxError) as e:
+            bad_rows.append((lines[row], str(e)))
+            skipped.add(row)
+            continue
+
+        for key in keys:
+            value = getattr(meta, key)
+            columns[key][row] = json.dumps(value) if key in LIST_FIELDS else value
+
+    if skipped:
+        keep = [row for row in range(n) if row not in skipped]
+        for key, column in columns.items():
+            if isinstance(column, np.ndarray):
+                columns[key] = column[keep]
+            else:
+                columns[key] = [column[row] for row in keep]
+
+    bad_rows.sort()
+    for line, msg in bad_rows:
+        logging.getLogger(logger).warning(f"{source}, line {line} skipped: {msg}")
+
+    # keep the column order of ImageMetadata, as objects built by pydantic do
+    columns = {key: columns[key] for key in fields}
+
+    return ImageDB.from_columns(columns, bad_rows)
+
+
+def write_csv(image_db, path):
+    """Write all entries of `image_db` to a CSV file."""
+
+    with open(str(path), "w") as f:
+        f.write(",".join(ImageMetadata.to_key_list()) + "\n")
+
+        for entry in image_db.values():
+            _tmp = []
+            for _key, item in zip(entry.to_key_list(), entry.to_list()):
+                if isinstance(item, list):
+                    _tmp.append('"' + str(item) + '"')
+                else:
+                    if _key in [
+                        "meas_group",
+                        "aux_data",
+                    ]:  # FIX because of commas in csv
+                        _tmp.append('"' + str(item) + '"')
+                    else:
+                        _tmp.append(str(item))
+
+            f.write(",".join(_tmp) + "\n")
+
+
+# file extensions of image databases stored in SQLite
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+# indexed columns of the SQLite table, as used by the explorer tree and queries
+INDEXED_FIELDS = (
+    "date",
+    "location",
+    "meas_group",
+    "img_type",
+    "wavelength",
+    "drk_group",
+    "ref_group",
+)
+
+
+def is_sqlite(path) -> bool:
+    return Path(path).suffix.lower() in SQLITE_SUFFIXES
+
+
+def to_row(meta) -> tuple:
+    """Values of an `ImageMetadata` as stored in the SQLite table."""
+
+    row = []
+    for key in ImageMetadata.model_fields:
+        value = getattr(meta, key)
+        if key in LIST_FIELDS:
+            value = json.dumps(value)
+        elif key not in NUMERIC_FIELDS:
+            value = str(value)
+        row.append(value)
+
+    return tuple(row)
+
+
+def _connect(path):
+    fields = ImageMetadata.model_fields
+
+    columns = []
+    for key in fields:
+        if key == "ID":
+            columns.append("ID INTEGER NOT NULL UNIQUE")
+        elif key in NUMERIC_FIELDS:
+            kind = "INTEGER" if np.dtype(NUMERIC_FIELDS[key]).kind == "i" else "REAL"
+            columns.append(f"{key} {kind}")
+        else:
+            columns.append(f"{key} TEXT")
+
+    con = sqlite3.connect(str(path))
+    with con:
+        # the implicit rowid keeps the order of the entries
+        con.execute(f"CREATE TABLE IF NOT EXISTS images ({', '.join(columns)})")
+        for key in INDEXED_FIELDS:
+            con.execute(f"CREATE INDEX IF NOT EXISTS idx_{key} ON images ({key})")
+
+    return con
+
+
+def read_sqlite(path) -> ImageDB:
+    """Load an image database stored in SQLite into an `ImageDB`."""
+
+    if not Path(path).exists():
+        raise FileNotFoundError(path)
+
+    con = _connect(path)
+    try:
+        header = [row[1] for row in con.execute("PRAGMA table_info(images)")]
+        rows = con.execute(
+            f"SELECT rowid, {', '.join(header)} FROM images ORDER BY rowid"
+        ).fetchall()
+    finally:
+        con.close()
+
+    lines = [row[0] for row in rows]
+    rows = [row[1:] for row in rows]
+
+    image_db = from_rows(header, rows, lines, [], source=path)
+    image_db.source = str(Path(path).resolve())
+
+    return image_db
+
+
+def write_sqlite(image_db, path) -> int:
+    """Store `image_db` in a SQLite file.
+
+    If `image_db` was loaded from (or last saved to) `path`, only changed,
+    added and removed entries are written, otherwise all entries replace the
+    content of the file. All writes of a call are one transaction.
+
+    Returns:
+        int: Number of entries written or removed.
+    """
+
+    source = str(Path(path).resolve())
+    fields = list(ImageMetadata.model_fields)
+
+    insert = (
+        f"INSERT INTO images ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))}) "
+        f"ON CONFLICT(ID) DO UPDATE SET "
+        + ", ".join(f"{key} = excluded.{key}" for key in fields if key != "ID")
+    )
+
+    incremental = isinstance(image_db, ImageDB) and image_db.source == source
+
+    con = _connect(path)
+    try:
+        with con:
+            if incremental:
+                upserts, deletes = image_db.changes()
+                con.executemany(
+                    "DELETE FROM images WHERE ID = ?", [(key,) for key in deletes]
+                )
+                con.executemany(insert, [row for _, row in upserts])
+            else:
+                upserts = None
+                deletes = []
+                con.execute("DELETE FROM images")
+                if isinstance(image_db, ImageDB):
+                    rows = image_db.to_rows()
+                else:
+                    rows = (to_row(meta) for meta in image_db.values())
+                con.executemany(insert, rows)
+    finally:
+        con.close()
+
+    n = len(upserts) + len(deletes) if incremental else len(image_db)
+
+    if isinstance(image_db, ImageDB):
+        image_db.mark_saved(source, upserts)
+
+    logging.getLogger(logger).info(f"{n} entries written to {path}")
+
+    return n
+
+
+def read_db(path):
+    """Load an image database from a CSV or SQLite file."""
+
+    if is_sqlite(path):
+        return read_sqlite(path)
+
+    return read_csv(path)
+
+
+def write_db(image_db, path):
+    """Save an image database to a CSV or SQLite file, by file extension."""
+
+    if is_sqlite(path):
+        write_sqlite(image_db, path)
+    else:
+        write_csv(image_db, path)
@@ -19,56 +19,135 @@
 import logging
 import numpy as np
 import h5py
-import copy
 import rawpy
 import exifread
 import yaml
 
 from pathlib import Path
 import snowimagerpro.core.methods.helper as helper
+from snowimagerpro.core.methods.metadata_index import (
+    get_aux_data,
+    get_sn,
+    sidecar_path,
+    to_plain,
+)
 
 
-def load_dng(path, shrink=2):
-    """Load a DNG file containing the raw image data."""
+def demosaic_and_bin(raw_image, shrink=1, white_level=1):
+    """Demosaic a Bayer mosaic into binned, normalised float32 RGB planes.
 
-    with rawpy.imread(str(path)) as raw:
-        raw_image = raw.raw_image.copy()
+    Each output pixel is the mean of a (2 * shrink) x (2 * shrink) block of
+    the mosaic, split by Bayer site. The block sums are done in a single
+    float32 reduction over a reshaped view of `raw_image`, the two green
+    sites are averaged without rounding. Rows and columns that do not fill
+    a whole block are cropped.
 
-        black_level = raw.black_level_per_channel[0]
-        white_level = raw.white_level
+    Args:
+        raw_image (np.ndarray): 2D mosaic, starting with a green site.
+        shrink (int): Binning factor of the colour planes.
+        white_level (float): Value mapped to 1.
 
-    with open(path, "rb") as f:
-        exif = exifread.process_file(f)
+    Returns:
+        np.ndarray: float32 array of shape (rows / 2 / shrink, columns / 2 / shrink, 3).
+    """
 
-    image = np.zeros(
-        (raw_image.shape[0] // 2, raw_image.shape[1] // 2) + (3,), dtype=np.uint16
-    )
+    h = raw_image.shape[0] // (2 * shrink)
+    w = raw_image.shape[1] // (2 * shrink)
+
+    # rows of each block: (h, shrink, 2 * w * 2 * shrink)
+    rows = raw_image[: h * 2 * shrink, : w * 2 * shrink].reshape(h, shrink, -1)
+
+    if shrink > 1:
+        # accumulate slices instead of ndarray.sum(axis=...), which is much
+        # slower on strided axes
+        acc = rows[:, 0].astype(np.float32)
+        for a in range(1, shrink):
+            acc += rows[:, a]
+
+        cols = acc.reshape(h, 2, w, shrink, 2)
+        sites = cols[:, :, :, 0].copy()
+        for b in range(1, shrink):
+            sites += cols[:, :, :, b]
+    else:
+        sites = rows.reshape(h, 2, w, 2)
+
+    scale = np.float32(1 / (shrink**2 * white_level))
 
     # TODO double check demosaicing pattern with correct camera ... should be alright, starts from bottom left corner!
-    image[:, :, 0] = raw_image[1::2, 0::2]  # red channel
-    image[:, :, 1] = (
-        raw_image[0::2, 0::2] // 2 + raw_image[1::2, 1::2] // 2
-    )  # green channel
-    image[:, :, 2] = raw_image[0::2, 1::2]  # blue channel
-
-    image = helper.bin_ndarray(
-        image, (image.shape[0] // shrink, image.shape[1] // shrink, 3), operation="mean"
+    image = np.empty((h, w, 3), dtype=np.float32)
+    np.multiply(sites[:, 1, :, 0], scale, out=image[:, :, 0])  # red channel
+    np.add(  # green channel, summed in float32, integer sites would wrap around
+        sites[:, 0, :, 0], sites[:, 1, :, 1], out=image[:, :, 1], dtype=np.float32
     )
+    image[:, :, 1] *= scale / 2
+    np.multiply(sites[:, 0, :, 1], scale, out=image[:, :, 2])  # blue channel
 
-    #image = (image - black_level) / (white_level - black_level - 1)
-    image = image / white_level
+    return image
 
-    try:
-        metafile = str(path).split("-")[:-1]
-        metafile = "-".join(metafile) + "_metadata.yaml"
-        with open(metafile, "r") as f:
-            metadata = yaml.safe_load(f)
 
+# libyaml parser if available, the sidecars of a field day are parsed at once
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def read_sidecar(path):
+    """Read the *_metadata.yaml sidecar of a raw image file."""
+
+    with open(sidecar_path(path), "r") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def read_dng_metadata(path):
+    """Parse the EXIF tags of a DNG file, merged with its sidecar."""
+
+    with open(path, "rb") as f:
+        exif = exifread.process_file(f)
+
+    try:
+        metadata = read_sidecar(path)
     except Exception as e:
         print(e)
         metadata = {}
 
-    exif = {**exif, **metadata}
+    return to_plain({**exif, **metadata})
+
+
+def read_bayer_metadata(path):
+    """Parse the sidecar of a .bay file."""
+
+    try:
+        metadata = read_sidecar(path)
+    except Exception as e:
+        print(e)
+        metadata = None
+
+    return to_plain(metadata)
+
+
+def read_metadata(path, index=None):
+    """Parsed EXIF/sidecar metadata of a raw image, from `index` if possible."""
+
+    if Path(path).suffix.lower() == ".dng":
+        parse = read_dng_metadata
+    else:
+        parse = read_bayer_metadata
+
+    if index is None:
+        return parse(path)
+
+    return index.lookup(path, parse)
+
+
+def load_dng(path, shrink=2, index=None):
+    """Load a DNG file containing the raw image data."""
+
+    with rawpy.imread(str(path)) as raw:
+        black_level = raw.black_level_per_channel[0]
+        white_level = raw.white_level
+
+        #image = (image - black_level) / (white_level - black_level - 1)
+        image = demosaic_and_bin(raw.raw_image, shrink, white_level)
+
+    exif = read_metadata(path, index)
 
     return image, exif
 
@@ -273,109 +352,214 @@ def load_hdf5_legacy(path, ext):
     return image
 
 
-def load_bayer(path, version=None, shrink=1):
-    """Loads bayer data."""
+# Raw Bayer layouts of the .bay files, keyed by the historic `version` index:
+# (rows, row stride in bytes), (rows, bytes with pixel data), bits per pixel
+BAYER_MODES = {
+    1: ((1952, 3264), (1944, 3240), 10),  # Cam: v1
+    2: ((2480, 4128), (2464, 4100), 10),  # 2464, 3280 Cam: v2, Lib: picamera 1
+    3: ((2464, 4128), (2464, 4100), 10),  # 2464, 3280 Cam: v2, Lib: Picamera 2
+    4: ((864, 1536), (864, 1536), 10),  # 864, 1536 Cam: v3, Lib: Picamera 2
+    5: ((1296, 2880), (1296, 2880), 10),  # 1296, 2304 Cam: v3, Lib: Picamera 2
+    6: ((2592, 5760), (2592, 5760), 10),  # 2592, 4608 Cam: v3, Lib: Picamera 2
+    7: ((3040, 6112), (3040, 6084), 12),  # 3040, 4056 Cam: hq, Lib: Picamera 2
+}
 
-    print("Loading Bayer data ", end=" ... ")
+# picamera 1 prepends a 32 kB "BRCM" header to the raw data
+BRCM_HEADER_SIZE = 32768
 
 
-    with open(path, "rb") as file:
-        data = file.read()
-
-    data = np.fromstring(data, dtype=np.uint8)
-
-    parameters = {
-        1: ((1952, 3264), (1944, 3240)),
-        2: (
-            (2480, 4128),
-            (2464, 4100),
-        ),  #                  2464, 3280 Cam: v2, Lib: picamera 1, highest resolution
-        3: (
-            (2464, 4128),
-            (2464, 4100),
-        ),  # sensor mode 3    2464, 3280 Cam: v2, Lib: Picamera 2, highest resolution
-        4: (
-            (864, 1536),
-            (864, 1536),
-        ),  # sensor mode 0     864, 1536 Cam: v3, Lib: Picamera 2
-        5: (
-            (1296, 2880),
-            (1296, 2880),
-        ),  # sensor mode 1    1296, 2304 Cam: v3, Lib: Picamera 2
-        6: (
-            (2592, 5760),
-            (2592, 5760),
-        ),  # sensor mode 2    2592, 4608 Cam: v3, Lib: Picamera 2, highest resolution
-        7: (
-            (3040, 6112),
-            (3040, 6084),
-        ),  #                  3040, 4056 Cam: hq, Lib: Picamera 2, highest resolution
-    }
+def bayer_mode(file_size, head=None):
+    """Find the sensor mode and data offset of a .bay file from its size.
 
-    x_sizes = {
-        1: 0,
-        2: 3280,
-        3: 3280,
-        4: 2304,
-        5: 2304,
-        6: 4608,
-        7: 4056,
-    }
+    Args:
+        file_size (int): Size of the file in bytes.
+        head (callable, optional): ``head(offset)`` returns the four bytes at
+            ``offset``, used to look for a "BRCM" header in front of the data.
+
+    Returns:
+        tuple: (version, offset) or (None, None) if no mode matches.
+    """
+
+    for version, ((rows, stride), _, _) in BAYER_MODES.items():
+        if file_size == rows * stride:
+            return version, 0
+
+    if head is not None:
+        for version, ((rows, stride), _, _) in BAYER_MODES.items():
+            offset = file_size - rows * stride
+            if offset >= BRCM_HEADER_SIZE and (
+                head(offset - BRCM_HEADER_SIZE) == b"BRCM"
+            ):
+                return version, offset
+
+    return None, None
+
+
+def _add_bayer_sites(groups, parity, bits, out, scale):
+    """Decode the pixels of one column parity from packed groups into `out`.
+
+    `groups` is a (rows, n_groups, bytes_per_group) uint8 view. Each group
+    holds the high bytes of 4 (10-bit) or 2 (12-bit) pixels followed by one
+    byte with their low bits. Only the 10 most significant bits are kept, as
+    in the original decoder. Values are multiplied by `scale` and added to
+    `out` (rows, n_groups * pixels / 2), so two green sites can share it.
+    """
+
+    n_px = 4 if bits == 10 else 2
+    _out = out.reshape((out.shape[0], groups.shape[1], n_px // 2), copy=False)
+    low = groups[:, :, n_px]
+
+    for i in range(n_px // 2):
+        k = 2 * i + parity
+        _low = (low >> (2 * (n_px - 1 - k))) & 0b11
+        _out[:, :, i] += groups[:, :, k] * np.float32(4 * scale)
+        _out[:, :, i] += _low * np.float32(scale)
+
+
+def unpack_bayer(data, version, shrink=1):
+    """Unpack MIPI packed Bayer data into normalised float32 R, G, B planes.
+
+    Args:
+        data (np.ndarray): uint8 buffer (no copy needed) of the raw data.
+        version (int): Sensor mode, see `BAYER_MODES`.
+        shrink (int): Keep only every `shrink`-th pixel of each colour plane.
+
+    Returns:
+        np.ndarray: float32 array of shape (rows / 2, columns / 2, 3).
+    """
+
+    (rows, stride), (crop_rows, crop_bytes), bits = BAYER_MODES[version]
+    n_px = 4 if bits == 10 else 2
+    n_groups = crop_bytes // (n_px + 1)
+
+    data = data.reshape(rows, stride)[:crop_rows, : n_groups * (n_px + 1)]
+    groups = data.reshape(crop_rows, n_groups, n_px + 1)
+
+    even = groups[0::2]
+    odd = groups[1::2]
+
+    image = np.zeros((crop_rows // 2, n_groups * n_px // 2, 3), dtype=np.float32)
+
+    _add_bayer_sites(odd, 0, bits, image[:, :, 0], 1 / 1023)  # red channel
+    _add_bayer_sites(even, 0, bits, image[:, :, 1], 0.5 / 1023)  # green channel
+    _add_bayer_sites(odd, 1, bits, image[:, :, 1], 0.5 / 1023)
+    _add_bayer_sites(even, 1, bits, image[:, :, 2], 1 / 1023)  # blue channel
+
+    return image[::shrink, ::shrink]
+
+
+def unpack_bayer_channel(data, version, channel=0, shrink=1):
+    """Decode a single colour plane, reading only the rows and groups needed.
+
+    Unlike `unpack_bayer`, the subsampling by `shrink` is applied to the
+    packed data, so the cost scales with the size of the output. Works on
+    any uint8 buffer, in particular on a `np.memmap` of the file.
+
+    Args:
+        data (np.ndarray): uint8 buffer of the raw data.
+        version (int): Sensor mode, see `BAYER_MODES`.
+        channel (int): 0 (red), 1 (green) or 2 (blue).
+        shrink (int): Keep only every `shrink`-th pixel of the plane.
+
+    Returns:
+        np.ndarray: float32 array of shape (rows / 2 / shrink, columns / 2 / shrink).
+    """
+
+    (rows, stride), (crop_rows, crop_bytes), bits = BAYER_MODES[version]
+    n_px = 4 if bits == 10 else 2
+    n_groups = crop_bytes // (n_px + 1)
+
+    data = data.reshape(rows, stride)[:crop_rows, : n_groups * (n_px + 1)]
+    groups = data.reshape(crop_rows, n_groups, n_px + 1)
+
+    # (row parity, column parity) of the Bayer sites of each channel
+    sites = {0: [(1, 0)], 1: [(0, 0), (1, 1)], 2: [(0, 1)]}[channel]
+    scale = np.float32(1 / 1023 / len(sites))
+
+    cols = np.arange(0, n_groups * n_px // 2, shrink)
+    group_idx = cols // (n_px // 2)
+
+    image = np.zeros((len(range(0, crop_rows // 2, shrink)), len(cols)), np.float32)
+
+    for row_parity, parity in sites:
+        sub = groups[row_parity : 2 * (crop_rows // 2) : 2 * shrink]
+        k = 2 * (cols % (n_px // 2)) + parity
+        shift = (2 * (n_px - 1 - k)).astype(np.uint8)
+
+        image += sub[:, group_idx, k] * (4 * scale)
+        image += ((sub[:, group_idx, n_px] >> shift) & 0b11) * scale
+
+    return image
+
+
+def open_bayer(path, version=None):
+    """Memory-map the raw data of a .bay file.
+
+    Returns:
+        tuple: (np.memmap of the raw data, version)
+    """
+
+    size = Path(path).stat().st_size
 
     if version is None:
-        versions = np.arange(1, 8)
-    else:
-        versions = [version]
+        with open(path, "rb") as file:
 
-    for i, ver in enumerate(versions):
-        reshape, crop = parameters[ver]
+            def head(pos):
+                file.seek(pos)
+                return file.read(4)
 
-        try:
-            data = data.reshape(reshape)[: crop[0], : crop[1]]
-            data = data.astype(np.uint16) << 2
+            version, _ = bayer_mode(size, head=head)
 
-            if ver < 7:
-                # five bytes into 4 10-bit values (4 pixels)
-                for byte in range(4):
-                    data[:, byte::5] |= (data[:, 4::5] >> ((4 - byte) * 2)) & 0b11
-                data = np.delete(data, np.s_[4::5], 1)
+        if version is None:
+            raise ValueError(f"Unknown Bayer layout of {size} bytes: {path}")
 
-            elif ver == 7:
-                # three bytes into 2 12-bit values (2 pixels)
-                for byte in range(2):
-                    data[:, byte::3] |= (data[:, 2::3] >> ((2 - byte) * 2)) & 0b11
-                data = np.delete(data, np.s_[2::3], 1)
+    if version not in BAYER_MODES:
+        raise ValueError(f"Unknown Bayer mode {version}: {path}")
 
-            y_size = parameters[ver][1][0]
-            x_size = x_sizes[ver]
+    (rows, stride), _, _ = BAYER_MODES[version]
+    if size < rows * stride:
+        raise ValueError(
+            f"{path} has {size} bytes, Bayer mode {version} needs {rows * stride}"
+        )
 
-            image = np.zeros((y_size // 2, x_size // 2) + (3,), dtype=data.dtype)
+    data = np.memmap(
+        path, dtype=np.uint8, mode="r", offset=size - rows * stride, shape=rows * stride
+    )
 
-        except Exception:
-            continue
+    return data, version
 
-    image[:, :, 0] = data[1::2, 0::2]  # red channel
-    image[:, :, 1] = (data[0::2, 0::2] + data[1::2, 1::2]) // 2  # green channel
-    image[:, :, 2] = data[0::2, 1::2]  # blue channel
 
-    # reduce data size for visualization efficiency
-    image = image[::shrink, ::shrink]
+def load_bayer_preview(path, shrink=4):
+    """Load the red channel of a .bay file, decoding only every `shrink`-th pixel."""
 
-    print(path)
+    data, version = open_bayer(path)
+    image = unpack_bayer_channel(data, version, channel=0, shrink=shrink)
+    del data
 
-    try:
-        metafile = str(path).split("-")[:-1]
-        metafile = "-".join(metafile) + "_metadata.yaml"
-        with open(metafile, "r") as f:
-            metadata = yaml.safe_load(f)
+    return image, None
 
-    except Exception as e:
-        print(e)
-        metadata = None
+
+def load_bayer(path, version=None, shrink=1, index=None):
+    """Loads bayer data.
+
+    The sensor mode is taken from the file size (or the position of the
+    picamera "BRCM" header) unless `version` is given.
+    """
+
+    print("Loading Bayer data ", end=" ... ")
+
+    data, version = open_bayer(path, version)
+
+    image = unpack_bayer(data, version, shrink=shrink)
+    del data
+
+    print(path)
+
+    metadata = read_metadata(path, index)
 
     print("Done!")
 
-    return image / 1023, metadata
+    return image, metadata
 
 
 def load_npy(path, ext):
@@ -441,184 +625,259 @@ def load_rgb(path, ext):
     return image[:, :, :3]
 
 
-def load_raw(path, ext="RAW"):
-    """Load data from .raw file.
+# MOSAiC .RAW frame geometries (rows, columns), keyed by file size in bytes
+RAW_GEOMETRIES = {
+    18000000: (3000, 4000),
+}
+
+
+def unpack_raw12(rows):
+    """Unpack rows of little-endian packed 12-bit pixels (2 px in 3 bytes).
+
+    Args:
+        rows (np.ndarray): uint8 array of shape (n_rows, n_groups, 3).
+
+    Returns:
+        tuple: uint16 arrays of the even and odd columns, (n_rows, n_groups) each.
+    """
+
+    b0 = rows[:, :, 0].astype(np.uint16)
+    b1 = rows[:, :, 1].astype(np.uint16)
+    b2 = rows[:, :, 2].astype(np.uint16)
+
+    even = b0 | ((b1 & 0x0F) << 8)
+    odd = (b1 >> 4) | (b2 << 4)
+
+    return even, odd
+
+
+def load_raw(path, ext="RAW", shape=None, shrink=2, chunk_rows=256):
+    """Load data from .raw file (MOSAiC).
+
+    The packed 12-bit data is decoded in blocks of rows straight into the
+    output colour planes, only the rows and columns kept by `shrink` are
+    read from the memory-mapped file.
 
     Arguments:
     ----------
-    path (string): _description_
-    ext (string): _description_
+    path (string): Path of the .RAW file.
+    ext (string): File extension (unused, kept for compatibility).
+    shape (tuple): (rows, columns) of the sensor, looked up in
+        `RAW_GEOMETRIES` by file size if None.
+    shrink (int): Keep only every `shrink`-th pixel of each colour plane.
+    chunk_rows (int): Number of output rows decoded at once.
 
     Returns:
     --------
-    _type_: _description_
+    tuple: float32 array (rows / 2 / shrink, columns / 2 / shrink, 3) and None
+        (no metadata)
     """
 
     print("Loading RAW data (MoSAIC) ...", end=" ")
-    with open(path, "rb") as f:
-        data = f.read()
-
-    data = np.fromstring(data, dtype=np.uint8)
-    test = 0
-
-    if test == 0:
-        data = np.unpackbits(data)
-        # data = unpack(data)
-        # print(data[:10])
-        print(np.shape(data))
-
-        datsize = data.shape[0]
-        data = data.reshape((int(datsize / 4), 4))
-        # print(data[:10, :10])
-        # print(np.shape(data))
-
-        # Switch even rows and odd rows
-        temp = copy.deepcopy(data[0::2])
-        temp2 = copy.deepcopy(data[1::2])
-        data[0::2] = temp2
-        data[1::2] = temp
-
-        # print(data[:10, :10])
-        # print(np.shape(data))
-
-        temp = np.concatenate(
-            [
-                data[0::3],
-                np.array([0, 0, 0, 0] * 12000000, dtype=np.uint8).reshape(12000000, 4),
-                data[2::3],
-                data[1::3],
-            ],
-            axis=1,
-        )
 
-        # print(temp[:10, :20])
-        # print(np.shape(temp))
-
-        # Repack into image file
-        udata = np.packbits(
-            # udata = pack(
-            # np.concatenate(
-            #    [
-            #        data[0::3],
-            #        np.array([0, 0, 0, 0] * 12000000, dtype=np.uint8).reshape(12000000, 4),
-            #        data[2::3],
-            #        data[1::3],
-            #    ],
-            #    axis=1,
-            temp
-            # )
-            .reshape(192000000, 1)
-        ).tobytes()
-        # print(udata[:10])
-        # print(len(udata))
-
-        img = np.fromstring(udata, np.dtype("u2"), (4000 * 3000)).reshape((3000, 4000))
-        # print(img[:10, :10])
-        # print(img.shape)
-        y_size = 3000
-        x_size = 4000
-        image = np.zeros((y_size // 2, x_size // 2) + (3,), dtype=np.dtype("u2"))
-
-        print(image.shape)
-        image[:, :, 0] = img[1::2, 0::2]  # red channel
-        image[:, :, 1] = (img[0::2, 0::2] + img[1::2, 1::2]) // 2  # green channel
-        image[:, :, 2] = img[0::2, 1::2]  # blue channel
-
-        print(image.shape)
-
-    elif test == 1:
-        data = np.unpackbits(data)
-        datsize = data.shape[0]
-        data = data.reshape((int(datsize / 4), 4))
-
-        temp = []
-        for i in range(16000000):
-            temp.extend(
-                [
-                    data[i * 12 + 1],
-                    [0, 0, 0, 0],
-                    data[i * 12 + 3],
-                    data[i * 12 + 0],
-                    data[i * 12 + 2],
-                    [0, 0, 0, 0],
-                    data[i * 12 + 4],
-                    data[i * 12 + 5],
-                    data[i * 12 + 7],
-                    [0, 0, 0, 0],
-                    data[i * 12 + 9],
-                    data[i * 12 + 6],
-                    data[i * 12 + 8],
-                    [0, 0, 0, 0],
-                    data[i * 12 + 10],
-                    data[i * 12 + 11],
-                ]
+    size = Path(path).stat().st_size
+
+    if shape is None:
+        if size not in RAW_GEOMETRIES:
+            raise ValueError(
+                f"Unknown RAW geometry of {size} bytes, pass shape=(rows, columns): {path}"
             )
+        shape = RAW_GEOMETRIES[size]
+
+    y_size, x_size = shape
+    if size < y_size * x_size * 3 // 2 or x_size % 4:
+        raise ValueError(f"RAW file {path} does not match shape {shape}")
+
+    data = np.memmap(path, dtype=np.uint8, mode="r", shape=(y_size, x_size // 2, 3))
 
-        udata = np.packbits(temp.reshape(192000000, 1)).tobytes()
+    # colour planes are (y_size // 2, x_size // 2), keep every shrink-th pixel
+    row_idx = np.arange(0, y_size // 2, shrink)
+    image = np.empty((len(row_idx), len(range(0, x_size // 2, shrink)), 3), np.float32)
+    scale = np.float32(16 / 65536)
 
-        img = np.fromstring(udata, np.dtype("u2"), (4000 * 3000)).reshape((3000, 4000))
+    for start in range(0, len(row_idx), chunk_rows):
+        rows = row_idx[start : start + chunk_rows]
+        out = image[start : start + len(rows)]
 
-        y_size = 3000
-        x_size = 4000
-        image = np.zeros((y_size // 2, x_size // 2) + (3,), dtype=np.dtype("u2"))
+        even_row = unpack_raw12(data[2 * rows, ::shrink])
+        odd_row = unpack_raw12(data[2 * rows + 1, ::shrink])
 
-        print(image.shape)
-        image[:, :, 0] = img[1::2, 0::2]  # red channel
-        image[:, :, 1] = (img[0::2, 0::2] + img[1::2, 1::2]) // 2  # green channel
-        image[:, :, 2] = img[0::2, 1::2]  # blue channel
+        np.multiply(odd_row[0], scale, out=out[:, :, 0])  # red channel
+        np.add(even_row[0], odd_row[1], out=out[:, :, 1], dtype=np.float32)
+        out[:, :, 1] *= scale / 2  # green channel
+        np.multiply(even_row[1], scale, out=out[:, :, 2])  # blue channel
 
-    elif test == 2:
-        data = data.reshape(3000, 6000)[:, :]
-        data = data.astype(np.uint16) << 2
+    del data
 
-        for byte in range(2):
-            data[:, byte::3] |= (data[:, 2::3] >> ((2 - byte) * 2)) & 0b11
-        data = np.delete(data, np.s_[2::3], 1)
+    print("Done!")
+    return image, None
 
-        y_size = 3000
-        x_size = 4000
 
-        print(data.dtype)
+# image types of a database entry: without grid, with grid, reference
+IMG_TYPES = ["ngr", "gri", "ref"]
 
-        image = np.zeros((y_size // 2, x_size // 2) + (3,), dtype=data.dtype)
 
-        image[:, :, 0] = data[1::2, 0::2]  # red channel
-        # image[:, :, 1] = (data[0::2, 0::2] + data[1::2, 1::2]) // 2  # green channel
-        # image[:, :, 2] = data[0::2, 1::2]  # blue channel
-        image[:, :, 1] = data[1::2, 0::2]  # red channel
-        image[:, :, 2] = data[1::2, 0::2]  # red channel
+def _dng_raw_shape(exif):
+    """(rows, columns) of the largest image described by the EXIF tags of a DNG.
 
-        print(image.shape)
+    DNG files store the thumbnail in the first IFD and the raw data in a
+    sub-IFD, the raw data is the largest of them.
+    """
 
-    elif test == 3:
-        y_size = 3000
-        x_size = 4000
+    def _max(name):
+        values = []
+        for tag, value in exif.items():
+            value = str(value).strip()
+            if tag.endswith(name) and value.isdigit():
+                values.append(int(value))
+        return max(values, default=None)
 
-        image = np.zeros((y_size // 2, x_size // 2) + (3,), dtype=data.dtype)
+    rows, cols = _max("ImageLength"), _max("ImageWidth")
+    if rows is None or cols is None:
+        return None
 
-        data = read_uint12(data).reshape(3000, 4000)
-        # print(data.shape)
-        image[:, :, 0] = data[1::2, 0::2]  # red channel
-        image[:, :, 1] = (data[0::2, 0::2] + data[1::2, 1::2]) // 2  # green channel
-        image[:, :, 2] = data[0::2, 1::2]  # blue channel
+    return rows, cols
 
-        # print(image.shape)
 
-    print("Done!")
-    return image[::2, ::2] / 65536
+def probe(path, index=None):
+    """Describe a raw image file without decoding its pixel data.
 
+    Only the EXIF header (.dng), the sidecar (.dng, .bay) and the file size
+    (.bay, .RAW) are read, so thousands of files are probed in seconds.
 
-def read_uint12(data):
-    # data = np.frombuffer(data_chunk, dtype=np.uint8)
-    fst_uint8, mid_uint8, lst_uint8 = (
-        np.reshape(data, (data.shape[0] // 3, 3)).astype(np.uint16).T
-    )
-    # fst_uint12 = (fst_uint8 << 4) + (mid_uint8 >> 4)
-    # snd_uint12 = ((mid_uint8 % 16) << 8) + lst_uint8
-    fst_uint12 = (fst_uint8 << 4) + (lst_uint8 >> 4)
-    # print(fst_uint8)
-    snd_uint12 = (mid_uint8 << 4) + (lst_uint8 << 4)
-    return np.reshape(
-        np.concatenate((fst_uint12[:, None], snd_uint12[:, None]), axis=1),
-        2 * fst_uint12.shape[0],
-    )
+    Args:
+        path (str | Path): Image file.
+        index (MetadataIndex, optional): Cache of the parsed EXIF metadata.
+
+    Returns:
+        dict: With the keys
+            "path", "format" ("dng", "bay" or "RAW"),
+            "valid" (bool) and "error" (str or None),
+            "sensor_shape" (rows, columns of the mosaic) and "mode" (Bayer
+                sensor mode of .bay files, see `BAYER_MODES`),
+            "shape" (shape of the image returned by `load_image`),
+            "serial_number", "wavelength", "timestamp", "location" and
+                "img_type" (from the metadata, None if unknown),
+            "exif" (parsed metadata or None).
+    """
+
+    path = Path(path)
+    info = {
+        "path": path,
+        "format": None,
+        "valid": False,
+        "error": None,
+        "sensor_shape": None,
+        "mode": None,
+        "shape": None,
+        "serial_number": None,
+        "wavelength": None,
+        "timestamp": None,
+        "location": None,
+        "img_type": None,
+        "exif": None,
+    }
+
+    ext = path.suffix[1:].lower()
+
+    try:
+        size = path.stat().st_size
+
+        if ext == "bay":
+            info["format"] = "bay"
+
+            with open(path, "rb") as file:
+
+                def head(pos):
+                    file.seek(pos)
+                    return file.read(4)
+
+                version, _ = bayer_mode(size, head=head)
+
+            if version is None:
+                raise ValueError(f"Unknown Bayer layout of {size} bytes")
+
+            (rows, _), (crop_rows, crop_bytes), bits = BAYER_MODES[version]
+            n_px = 4 if bits == 10 else 2
+            cols = crop_bytes // (n_px + 1) * n_px
+
+            info["mode"] = version
+            info["sensor_shape"] = (crop_rows, cols)
+            info["shape"] = (crop_rows // 2, cols // 2, 3)  # load_bayer, shrink=1
+            info["exif"] = read_metadata(path, index)
+
+        elif ext == "dng":
+            info["format"] = "dng"
+            info["exif"] = read_metadata(path, index)
+
+            shape = _dng_raw_shape(info["exif"])
+            if shape is None:
+                raise ValueError("No image size in the EXIF header")
+
+            rows, cols = shape
+            info["sensor_shape"] = shape
+            info["shape"] = (rows // 4, cols // 4, 3)  # load_dng, shrink=2
+
+        elif ext == "raw":
+            info["format"] = "RAW"
+
+            if size not in RAW_GEOMETRIES:
+                raise ValueError(f"Unknown RAW geometry of {size} bytes")
+
+            rows, cols = RAW_GEOMETRIES[size]
+            info["sensor_shape"] = (rows, cols)
+            info["shape"] = (  # load_raw, shrink=2
+                len(range(0, rows // 2, 2)),
+                len(range(0, cols // 2, 2)),
+                3,
+            )
+
+        else:
+            raise ValueError(f"Not a raw image file: .{ext}")
+
+    except Exception as e:
+        info["error"] = f"{type(e).__name__}: {e}"
+        return info
+
+    info["valid"] = True
+
+    exif = info["exif"]
+    if exif:
+        aux_data = get_aux_data(exif)
+        sidecar = exif.get("metadata") if isinstance(exif.get("metadata"), dict) else {}
+
+        info["serial_number"] = get_sn(exif)
+        info["wavelength"] = aux_data.get("wavelength", sidecar.get("wavelength"))
+        info["timestamp"] = aux_data.get(
+            "timestamp", sidecar.get("timestamp", exif.get("Image DateTimeOriginal"))
+        )
+        info["location"] = sidecar.get("location")
+        info["img_type"] = sidecar.get("img_type")
+
+    return info
+
+
+def probe_fields(info) -> dict:
+    """`ImageMetadata` fields that can be filled in from a `probe` result."""
+
+    fields = {}
+
+    try:
+        if info["wavelength"] not in (None, ""):
+            fields["wavelength"] = float(info["wavelength"])
+    except (TypeError, ValueError):
+        pass
+
+    # EXIF "2024:01:31 12:00:00" or ISO "2024-01-31T12:00:00"
+    timestamp = str(info["timestamp"] or "")
+    date = timestamp[:10].replace(":", "-")
+    if len(date) == 10 and date[4] == "-" and date[7] == "-":
+        fields["date"] = date
+
+    if info.get("location") not in (None, ""):
+        fields["location"] = str(info["location"])
+
+    if info.get("img_type") in IMG_TYPES:
+        fields["img_type"] = info["img_type"]
+
+    return fields
@@ -0,0 +1,195 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Adding folders of raw images to an image database.
+
+The folder tree is scanned with one thread per directory, then every file is
+probed (header and sidecar only, see `probe`) and its content digested in a
+thread pool. Files whose content is already in the database or earlier in
+the batch are skipped: the sampled digest (see `preview_cache.content_key`)
+selects the candidates, a byte comparison confirms them. The digests of the
+files in the database are cached in the `MetadataIndex`, so only new files
+are read on the next ingest.
+"""
+
+import concurrent.futures
+import filecmp
+import logging
+import os
+from pathlib import Path
+
+from snowimagerpro.core.metadata import ImageMetadata
+from snowimagerpro.core.methods.helper import create_uuid
+from snowimagerpro.core.methods.image_loading import probe, probe_fields
+from snowimagerpro.core.methods.preview_cache import content_key
+
+logger = "core.ingest"
+
+RAW_EXTENSIONS = (".bay", ".dng", ".raw")
+
+
+def scan(folder, exts=RAW_EXTENSIONS, workers=8) -> list:
+    """Raw image files below `folder`, sorted.
+
+    Args:
+        folder (str | Path): Top directory.
+        exts (tuple): File extensions, matched case-insensitively.
+        workers (int): Directories listed in parallel.
+
+    Returns:
+        list: Paths of the files.
+    """
+
+    exts = tuple(ext.lower() for ext in exts)
+
+    def _list(directory):
+        files, dirs = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.name.lower().endswith(exts):
+                        files.append(Path(entry.path))
+        except OSError as e:
+            logging.getLogger(logger).warning(f"Cannot list {directory}: {e}")
+        return files, dirs
+
+    files = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_list, folder)}
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                _files, _dirs = future.result()
+                files += _files
+                pending |= {executor.submit(_list, d) for d in _dirs}
+
+    return sorted(files)
+
+
+def _content_key(path, index=None):
+    if index is None:
+        return content_key(path)
+    return index.lookup_content_key(path, content_key)
+
+
+def _same_content(fp, other) -> bool:
+    try:
+        return os.path.samefile(fp, other) or filecmp.cmp(fp, other, shallow=False)
+    except OSError:
+        return False
+
+
+def ingest(files, image_db=None, data_dir="", index=None, workers=8) -> dict:
+    """Create database entries for the raw image files `files`.
+
+    Date, location, wavelength and image type are taken from the EXIF tags
+    and sidecar files, where available. `image_db` is not modified.
+
+    Args:
+        files (list): Image files, e.g. from `scan`.
+        image_db (dict, optional): The database the entries are meant for,
+            its files are not added again.
+        data_dir (str | Path): Directory the file paths in `image_db` are
+            relative to.
+        index (MetadataIndex, optional): Cache of metadata and digests.
+        workers (int): Files probed in parallel.
+
+    Returns:
+        dict: "entries" (new `ImageMetadata`, in the order of `files`),
+            "invalid" (`probe` results of files that cannot be read) and
+            "duplicates" (list of (file, file with the same content)).
+    """
+
+    files = [Path(fp) for fp in files]
+    image_db = image_db or {}
+
+    def _probe(fp):
+        info = probe(fp, index=index)
+        if info["valid"]:
+            try:
+                info["content_key"] = _content_key(fp, index)
+            except OSError as e:
+                info["valid"] = False
+                info["error"] = f"{type(e).__name__}: {e}"
+        return info
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        infos = list(executor.map(_probe, files))
+
+        # digest only the files of the db that could be equal to a new one
+        sizes = {info["path"].stat().st_size for info in infos if info["valid"]}
+        if hasattr(image_db, "field"):  # ImageDB, without building the entries
+            filepaths = [image_db.field(key, "filepath") for key in image_db.keys()]
+        else:
+            filepaths = [meta.filepath for meta in image_db.values()]
+        known_paths = [Path(data_dir) / fp for fp in filepaths]
+
+        def _known_key(fp):
+            try:
+                if fp.stat().st_size in sizes:
+                    return _content_key(fp, index)
+            except OSError:
+                pass  # file moved or deleted, nothing to compare with
+            return None
+
+        known = {}  # content key -> files with that key
+        for fp, key in zip(known_paths, executor.map(_known_key, known_paths)):
+            if key is not None:
+                known.setdefault(key, []).append(fp)
+
+        # the key samples the content, files with equal keys are compared
+        # byte by byte (with the db files and the earlier files of the batch)
+        pairs = {}
+        batch = {}  # content key -> files of the batch
+        for info in infos:
+            if info["valid"]:
+                key = info["content_key"]
+                for other in known.get(key, []) + batch.get(key, []):
+                    pairs[(info["path"], other)] = None
+                batch.setdefault(key, []).append(info["path"])
+
+        same = dict(zip(pairs, executor.map(lambda pair: _same_content(*pair), pairs)))
+
+    entries, invalid, duplicates = [], [], []
+    used = set(image_db.keys())
+    for info in infos:
+        if not info["valid"]:
+            invalid.append(info)
+            continue
+
+        candidates = known.setdefault(info["content_key"], [])
+        other = next((fp for fp in candidates if same[(info["path"], fp)]), None)
+        if other is not None:
+            duplicates.append((info["path"], other))
+            continue
+        candidates.append(info["path"])
+
+        uuid = create_uuid()
+        while uuid in used:
+            uuid = create_uuid()
+        used.add(uuid)
+
+        entries.append(
+            ImageMetadata(ID=uuid, filepath=info["path"], **probe_fields(info))
+        )
+
+    return {"entries": entries, "invalid": invalid, "duplicates": duplicates}
@@ -0,0 +1,142 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Append-only journal of the edits of an image database.
+
+Autosave appends one JSON line per edited entry to ``<db>.journal`` instead
+of rewriting the database. The journal is compacted into the database file
+now and then, and replayed when the database is loaded after a crash.
+
+Compaction first renames the journal to ``<db>.journal.compacting``, so
+edits made while the database is written go to a new journal. Both files are
+replayed at load, the records hold complete entries and can be applied more
+than once.
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from pydantic import ValidationError
+
+from snowimagerpro.core.metadata import ImageMetadata
+from snowimagerpro.core.methods.image_db import to_row
+
+logger = "core.journal"
+
+
+def journal_path(db_path) -> Path:
+    db_path = Path(db_path)
+    return db_path.with_suffix(db_path.suffix + ".journal")
+
+
+class EditJournal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.compacting = self.path.with_suffix(self.path.suffix + ".compacting")
+
+        self._lock = threading.Lock()
+        self.n_records = 0
+
+    @classmethod
+    def for_db(cls, db_path):
+        return cls(journal_path(db_path))
+
+    def _append(self, records):
+        lines = "".join(json.dumps(record) + "\n" for record in records)
+
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.n_records += len(records)
+
+    def put(self, entries):
+        """Record the current state of the `ImageMetadata` entries."""
+
+        fields = list(ImageMetadata.model_fields)
+        self._append(
+            [{"op": "put", "entry": dict(zip(fields, to_row(e)))} for e in entries]
+        )
+
+    def delete(self, keys):
+        self._append([{"op": "del", "id": key} for key in keys])
+
+    def replay(self, image_db) -> int:
+        """Apply the recorded edits to `image_db`.
+
+        Returns:
+            int: Number of records applied.
+        """
+
+        n = 0
+        for path in [self.compacting, self.path]:
+            if not path.exists():
+                continue
+
+            with open(path) as f:
+                for i, line in enumerate(f):
+                    try:
+                        record = json.loads(line)
+                        if record["op"] == "put":
+                            meta = ImageMetadata(**record["entry"])
+                            image_db[meta.ID] = meta
+                        elif record["op"] == "del":
+                            image_db.pop(record["id"], None)
+                    except (ValueError, KeyError, ValidationError) as e:
+                        # e.g. the last line of a crashed write
+                        logging.getLogger(logger).warning(
+                            f"{path}, record {i + 1} skipped: {e}"
+                        )
+                        continue
+                    n += 1
+
+        return n
+
+    def begin_compaction(self) -> bool:
+        """Move the journal aside before the database is written.
+
+        Returns:
+            bool: False if there is nothing to compact.
+        """
+
+        with self._lock:
+            if self.path.exists():
+                if self.compacting.exists():
+                    # left over from a failed compaction, keep both
+                    with open(self.compacting, "a") as f, open(self.path) as g:
+                        f.write(g.read())
+                    self.path.unlink()
+                else:
+                    os.replace(self.path, self.compacting)
+            self.n_records = 0
+
+            return self.compacting.exists()
+
+    def end_compaction(self):
+        """Remove the journaled edits, once the database has been written."""
+        self.compacting.unlink(missing_ok=True)
+
+    def clear(self):
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+            self.compacting.unlink(missing_ok=True)
+            self.n_records = 0
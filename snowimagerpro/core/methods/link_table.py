@@ -0,0 +1,258 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Links of images to their dark and reference images.
+
+Every image with a wavelength is linked to the dark image (wavelength 0)
+with the same drk_group and meas_group, every image that is not a reference
+image to the reference image with the same ref_group and meas_group. Darks
+and references are found in hash indexes on these groups, so the table is
+built in O(n) and updated in O(1) per edited entry.
+"""
+
+from collections import defaultdict, namedtuple
+
+Signature = namedtuple(
+    "Signature", ["ID", "is_dark", "is_ref", "needs_ref", "dark_group", "ref_group"]
+)
+
+
+def signature(image_db, key) -> Signature:
+    """The fields of entry `key` that its links depend on."""
+
+    if hasattr(image_db, "field"):  # ImageDB, without building the entry
+
+        def get(name):
+            return image_db.field(key, name)
+
+    else:
+        entry = image_db[key]
+
+        def get(name):
+            return getattr(entry, name)
+
+    wavelength = get("wavelength")
+    img_type = get("img_type")
+    meas_group = get("meas_group")
+
+    return Signature(
+        ID=get("ID"),
+        is_dark=wavelength == 0,
+        is_ref=img_type == "ref" and wavelength != 0,
+        needs_ref=img_type not in ["ref"],
+        dark_group=(get("drk_group"), meas_group),
+        ref_group=(get("ref_group"), meas_group),
+    )
+
+
+class LinkTable(dict):
+    """Mapping of entry keys to ``{"dark_id": ..., "ref_id": ...}``.
+
+    If several darks (references) match, the last one in the order of the
+    database is used, as before. Such entries are listed in `ambiguous`,
+    entries without a match in `unmatched`. Without any reference image in
+    the database the table is empty.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self._sigs = {}
+        self._pos = {}  # order of the entries in the database
+        self._next_pos = 0
+
+        self._darks = defaultdict(set)  # (drk_group, meas_group) -> keys
+        self._refs = defaultdict(set)  # (ref_group, meas_group) -> keys
+        self._dark_users = defaultdict(set)
+        self._ref_users = defaultdict(set)
+        self._n_refs = 0
+
+        self.unmatched = {}  # key -> ["dark_id", "ref_id"]
+        self.ambiguous = {}  # key -> {"dark_id": [IDs], "ref_id": [IDs]}
+
+    @classmethod
+    def build(cls, image_db):
+        table = cls()
+        table.update_entries(image_db, list(image_db.keys()))
+        return table
+
+    def _index(self, key, sig, add):
+        def _set(index, group):
+            if add:
+                index[group].add(key)
+            else:
+                index[group].discard(key)
+                if not index[group]:
+                    del index[group]
+
+        if sig.is_dark:
+            _set(self._darks, sig.dark_group)
+        else:
+            _set(self._dark_users, sig.dark_group)
+
+        if sig.is_ref:
+            _set(self._refs, sig.ref_group)
+            self._n_refs += 1 if add else -1
+
+        if sig.needs_ref:
+            _set(self._ref_users, sig.ref_group)
+
+    def _affected(self, sig):
+        """Entries whose links depend on the entry with signature `sig`."""
+
+        keys = set()
+        if sig.is_dark:
+            keys |= self._dark_users.get(sig.dark_group, set())
+        if sig.is_ref:
+            keys |= self._ref_users.get(sig.ref_group, set())
+        return keys
+
+    def _pick(self, key, name, candidates):
+        candidates = [k for k in candidates if k != key]
+        if not candidates:
+            return None
+
+        if len(candidates) > 1:
+            candidates.sort(key=self._pos.__getitem__)
+            self.ambiguous.setdefault(key, {})[name] = [
+                self._sigs[k].ID for k in candidates
+            ]
+
+        # the last one in the database, as the old dict comprehensions did
+        return self._sigs[max(candidates, key=self._pos.__getitem__)].ID
+
+    def _link(self, key):
+        sig = self._sigs[key]
+        link = {}
+
+        self.unmatched.pop(key, None)
+        self.ambiguous.pop(key, None)
+
+        if not sig.is_dark:
+            dark_id = self._pick(key, "dark_id", self._darks.get(sig.dark_group, ()))
+            if dark_id is None:
+                self.unmatched.setdefault(key, []).append("dark_id")
+            else:
+                link["dark_id"] = dark_id
+
+        if sig.needs_ref:
+            ref_id = self._pick(key, "ref_id", self._refs.get(sig.ref_group, ()))
+            if ref_id is not None:
+                link["ref_id"] = ref_id
+            elif not sig.is_dark:  # darks are not corrected
+                self.unmatched.setdefault(key, []).append("ref_id")
+
+        self[key] = link
+
+    def update_entries(self, image_db, keys):
+        """Update the links after the entries `keys` were edited, added to or
+        removed from `image_db`."""
+
+        had_refs = self._n_refs > 0
+        affected = set()
+
+        for key in keys:
+            old = self._sigs.pop(key, None)
+            if old is not None:
+                self._index(key, old, add=False)
+                affected |= self._affected(old)
+
+            if key not in image_db:
+                self._pos.pop(key, None)
+                self.pop(key, None)
+                self.unmatched.pop(key, None)
+                self.ambiguous.pop(key, None)
+                continue
+
+            sig = signature(image_db, key)
+            self._sigs[key] = sig
+            if key not in self._pos:
+                self._pos[key] = self._next_pos
+                self._next_pos += 1
+            self._index(key, sig, add=True)
+
+            affected |= self._affected(sig)
+            affected.add(key)
+
+        if self._n_refs == 0:
+            # without reference images nothing can be corrected
+            self.clear()
+            self.unmatched.clear()
+            self.ambiguous.clear()
+            return
+
+        if not had_refs:
+            affected = set(self._sigs)
+
+        for key in affected:
+            if key in self._sigs:
+                self._link(key)
+
+    def sync(self, image_db, keys=None):
+        """Update the links of all entries that changed since the last update.
+
+        Args:
+            image_db (dict): The database.
+            keys (list, optional): Only check these entries.
+
+        Returns:
+            list: Keys of the changed, added and removed entries.
+        """
+
+        if keys is None:
+            keys = list(image_db.keys())
+            removed = [key for key in self._sigs if key not in image_db]
+        else:
+            removed = [key for key in keys if key not in image_db]
+            keys = [key for key in keys if key in image_db]
+
+        changed = [
+            key
+            for key in keys
+            if key not in self._sigs or signature(image_db, key) != self._sigs[key]
+        ]
+        changed += [key for key in removed if key in self._sigs]
+
+        if changed:
+            self.update_entries(image_db, changed)
+
+        return changed
+
+    def report(self, limit=10) -> list:
+        """Messages about unmatched and ambiguous links."""
+
+        def _ids(keys):
+            ids = [str(self._sigs[key].ID) for key in list(keys)[:limit]]
+            return ", ".join(ids) + (", ..." if len(keys) > limit else "")
+
+        messages = []
+        for name, what in [("dark_id", "dark"), ("ref_id", "reference")]:
+            unmatched = [k for k, names in self.unmatched.items() if name in names]
+            if unmatched:
+                messages.append(
+                    f"{len(unmatched)} images without {what} image: {_ids(unmatched)}"
+                )
+
+            ambiguous = [k for k, names in self.ambiguous.items() if name in names]
+            if ambiguous:
+                messages.append(
+                    f"{len(ambiguous)} images with several {what} images "
+                    f"(the last one is used): {_ids(ambiguous)}"
+                )
+
+        return messages
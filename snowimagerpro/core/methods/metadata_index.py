@@ -0,0 +1,265 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Persistent index of the EXIF tags and sidecar metadata of raw image files.
+
+Parsing the EXIF block of a DNG and the ``*_metadata.yaml`` sidecar is done
+once per file and stored in a SQLite file next to the image database. An
+entry is valid as long as size and modification time of the image and of its
+sidecar are unchanged. The content digests used to find duplicate files are
+stored the same way.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+logger = "core.metadata_index"
+
+# key of the values derived from the EXIF/sidecar data when it is parsed
+DERIVED_KEY = "_derived"
+
+
+def index_path(db_path) -> Path:
+    """Path of the metadata index belonging to an image database."""
+    db_path = Path(db_path)
+    return db_path.with_suffix(db_path.suffix + ".meta.sqlite")
+
+
+def sidecar_path(path) -> Path:
+    """Path of the ``*_metadata.yaml`` sidecar of a raw image file."""
+    metafile = str(path).split("-")[:-1]
+    return Path("-".join(metafile) + "_metadata.yaml")
+
+
+def file_stamp(path) -> str:
+    """Size and modification time of a raw image and its sidecar."""
+    stamp = []
+    for fp in [Path(path), sidecar_path(path)]:
+        try:
+            stat = fp.stat()
+            stamp.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            stamp.append("-")
+
+    return "|".join(stamp)
+
+
+def get_sn(exif) -> str:
+    if exif is not None:
+        if DERIVED_KEY in exif:
+            return exif[DERIVED_KEY]["serial_number"]
+
+        try:
+            sn = str(exif["Image BodySerialNumber"])
+        except Exception as e:
+            print(e)
+            try:
+                sn = exif["metadata"]["device"]
+            except Exception as e:
+                print(e)
+                sn = "unknown"
+
+    else:
+        sn = "unknown"
+
+    return sn
+
+
+def get_aux_data(exif) -> dict:
+    """Auxiliary data written to the attributes of processed h5 files."""
+
+    if exif is None:
+        return {}
+
+    if DERIVED_KEY in exif:
+        return exif[DERIVED_KEY]["aux_data"]
+
+    sn = get_sn(exif)
+
+    try:
+        if sn in ["snowimager-01"]:
+            aux_data = {
+                "timestamp": exif["metadata"]["timestamp"],
+                "timezone": exif["metadata"]["timezone"],
+                "longitude": "",
+                "latitude": "",
+                "software_version": exif["metadata"]["software_version"],
+                "wavelength": exif["metadata"]["wavelength"],
+                "board_temperature_electronics_side": "",
+                "board_temperature_led_side": "",
+            }
+        elif sn in ["snowimager-06", "snowimager-07"]:
+            aux_data = {
+                "timestamp": str(exif["Image DateTimeOriginal"]),
+                "timezone": "UTC",
+                "longitude": exif["metadata"]["longitude"],
+                "latitude": exif["metadata"]["latitude"],
+                "software_version": exif["metadata"]["software_version"],
+                "wavelength": exif["metadata"]["wavelength"],
+                "board_temperature_electronics_side": exif["metadata"][
+                    "temperatures"
+                ]["board_temperature_electronics_side"],
+                "board_temperature_led_side": exif["metadata"]["temperatures"][
+                    "board_temperature_led_side"
+                ],
+            }
+        else:
+            aux_data = {}
+    except (KeyError, TypeError) as e:
+        logging.getLogger(logger).warning(f"Incomplete metadata for {sn}: {e}")
+        aux_data = {}
+
+    return aux_data
+
+
+def to_plain(exif):
+    """Turn parsed EXIF tags and sidecar data into JSON compatible values.
+
+    EXIF tags are replaced by their printable string, binary values (e.g.
+    the embedded JPEG thumbnail) are dropped. The serial number and the
+    auxiliary data are derived once and stored under `DERIVED_KEY`.
+    """
+
+    if exif is None:
+        return None
+
+    def _plain(value):
+        if isinstance(value, dict):
+            return {str(k): _plain(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [_plain(v) for v in value]
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return str(value)
+
+    plain = {
+        key: _plain(value)
+        for key, value in exif.items()
+        if not isinstance(value, (bytes, bytearray))
+    }
+    plain.pop(DERIVED_KEY, None)
+    plain[DERIVED_KEY] = {
+        "serial_number": get_sn(plain),
+        "aux_data": get_aux_data(plain),
+    }
+
+    return plain
+
+
+class MetadataIndex:
+    """SQLite backed cache of parsed image metadata, keyed by file path.
+
+    Can be shared by the loader threads of an `ImageSet`.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(self.path), check_same_thread=False)
+
+        with self._lock, self._con:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            # a cache, losing the last entries on power loss is fine
+            self._con.execute("PRAGMA synchronous=NORMAL")
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "path TEXT PRIMARY KEY, stamp TEXT, serial_number TEXT, exif TEXT)"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS content_keys ("
+                "path TEXT PRIMARY KEY, stamp TEXT, key TEXT)"
+            )
+
+    @classmethod
+    def for_db(cls, db_path):
+        """Open (or create) the index next to the image database `db_path`."""
+        try:
+            return cls(index_path(db_path))
+        except sqlite3.Error as e:
+            logging.getLogger(logger).warning(
+                f"Metadata index for {db_path} not available: {e}"
+            )
+            return None
+
+    def get(self, path):
+        """Return the cached metadata of `path`, or None if missing or stale."""
+
+        key = str(Path(path).resolve())
+
+        with self._lock:
+            row = self._con.execute(
+                "SELECT stamp, exif FROM metadata WHERE path = ?", (key,)
+            ).fetchone()
+
+        if row is None or row[0] != file_stamp(path):
+            return None
+
+        return json.loads(row[1])
+
+    def put(self, path, exif):
+        key = str(Path(path).resolve())
+        sn = exif[DERIVED_KEY]["serial_number"] if exif else None
+
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)",
+                (key, file_stamp(path), sn, json.dumps(exif, default=str)),
+            )
+
+    def lookup(self, path, parse):
+        """Return the metadata of `path`, parsing and storing it on a miss."""
+
+        exif = self.get(path)
+        if exif is None:
+            logging.getLogger(logger).debug(f"Metadata index miss: {path}")
+            exif = parse(path)
+            self.put(path, exif)
+
+        return exif
+
+    def lookup_content_key(self, path, compute):
+        """Return the content digest of `path`, computing and storing it on a
+        miss (see `preview_cache.content_key`)."""
+
+        key = str(Path(path).resolve())
+        stamp = file_stamp(path)
+
+        with self._lock:
+            row = self._con.execute(
+                "SELECT stamp, key FROM content_keys WHERE path = ?", (key,)
+            ).fetchone()
+
+        if row is not None and row[0] == stamp:
+            return row[1]
+
+        digest = compute(path)
+
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO content_keys VALUES (?, ?, ?)",
+                (key, stamp, digest),
+            )
+
+        return digest
+
+    def close(self):
+        with self._lock:
+            self._con.close()
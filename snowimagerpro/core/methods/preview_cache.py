@@ -0,0 +1,234 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""On-disk cache of downsampled previews of raw image files.
+
+For every raw file float16 previews of the decoded image, binned by the
+factors in `LEVELS`, are stored as .npy files. The viewers show the 1/4
+pixel level only; coarser levels cost disk budget and write time and are
+only worth adding to `LEVELS` once a view reads them. Entries are keyed
+by a digest of the file content, so moved or copied files hit the cache and
+modified files miss it. The least recently used entries are removed when the
+cache grows beyond its disk budget.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+logger = "core.preview_cache"
+
+# linear binning factors of the stored levels (1/4 of the pixels)
+LEVELS = (2,)
+
+# bytes read from the start, middle and end of a file for its digest
+SAMPLE_SIZE = 2**18
+
+
+def content_key(fp) -> str:
+    """Digest of the size and of three samples of the content of a file.
+
+    Raw frames differ throughout the file, so sampling is sufficient to tell
+    them apart, without reading hundreds of MB per folder.
+    """
+
+    size = os.path.getsize(fp)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+
+    with open(fp, "rb") as f:
+        for pos in [0, max(size // 2 - SAMPLE_SIZE // 2, 0), max(size - SAMPLE_SIZE, 0)]:
+            f.seek(pos)
+            digest.update(f.read(SAMPLE_SIZE))
+
+    return digest.hexdigest()
+
+
+def bin2(image):
+    """Mean of 2 x 2 pixel blocks (odd rows and columns are cropped)."""
+
+    h, w = image.shape[0] // 2, image.shape[1] // 2
+    image = image[: 2 * h, : 2 * w]
+    out = image[0::2, 0::2].astype(np.float32)
+    out += image[1::2, 0::2]
+    out += image[0::2, 1::2]
+    out += image[1::2, 1::2]
+    out *= 0.25
+
+    return out
+
+
+def build_pyramid(image) -> dict:
+    """Downsampled float16 copies of `image`, keyed by binning factor."""
+
+    pyramid = {}
+    level = image
+    factor = 1
+    while factor < LEVELS[-1]:
+        level = bin2(level)
+        factor *= 2
+        if factor in LEVELS:
+            pyramid[factor] = level.astype(np.float16)
+
+    return pyramid
+
+
+class PreviewCache:
+    def __init__(self, root, budget=1024 * 2**20):
+        """
+        Args:
+            root (str | Path): Folder of the cache files.
+            budget (int): Maximum size of the cache on disk in bytes.
+        """
+
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._keys = {}  # (path, size, mtime) -> content key
+
+        # key -> bytes on disk, least recently used first; read from the
+        # folder on first use and kept up to date by `put` and `evict`
+        self._index = None
+        self._total = 0
+
+    def _key(self, fp):
+        stat = os.stat(fp)
+        stamp = (str(fp), stat.st_size, stat.st_mtime_ns)
+
+        if stamp not in self._keys:
+            self._keys[stamp] = content_key(fp)
+
+        return self._keys[stamp]
+
+    def _file(self, key, level):
+        return self.root / key[:2] / f"{key}_{level}.npy"
+
+    def get(self, fp, level=LEVELS[0]):
+        """Return the cached preview of `fp` at `level`, or None."""
+
+        try:
+            key = self._key(fp)
+        except OSError:
+            return None
+
+        path = self._file(key, level)
+
+        try:
+            preview = np.load(path)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            return None  # not cached, or evicted meanwhile
+
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index.move_to_end(key)
+
+        return preview.astype(np.float32)
+
+    def has(self, fp):
+        try:
+            return self._file(self._key(fp), LEVELS[-1]).exists()
+        except OSError:
+            return False
+
+    def put(self, fp, image, evict=True):
+        """Store the previews (`LEVELS`) of the decoded `image` of file `fp`.
+
+        Args:
+            evict (bool): Meet the budget afterwards (see `evict`).
+        """
+
+        key = self._key(fp)
+
+        size = 0
+        for level, preview in build_pyramid(np.asarray(image)).items():
+            path = self._file(key, level)
+            path.parent.mkdir(exist_ok=True)
+
+            # write to a temporary file first, readers never see partial files
+            tmp = path.with_name(f"{path.stem}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, preview)
+            os.replace(tmp, path)
+            size += path.stat().st_size
+
+        with self._lock:
+            if self._index is not None:
+                self._total += size - self._index.pop(key, 0)
+                self._index[key] = size
+
+        if evict:
+            self.evict()
+
+    def fill(self, fps, load):
+        """Add the previews of all files in `fps` that are not cached yet.
+
+        Args:
+            fps (list): File paths.
+            load (callable): ``load(fp)`` returns the decoded image.
+        """
+
+        for fp in fps:
+            if self.has(fp):
+                continue
+            try:
+                self.put(fp, load(fp), evict=False)
+            except Exception as e:
+                logging.getLogger(logger).warning(f"No preview for {fp}: {e}")
+
+        self.evict()
+
+    def _scan(self):
+        # lock held; the last use of an entry is the newest mtime of its files
+        entries = {}  # key -> [last use, size]
+        for path in self.root.glob("*/*.npy"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entry = entries.setdefault(path.stem.split("_")[0], [0, 0])
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+
+        by_use = sorted(entries.items(), key=lambda item: item[1][0])
+        self._index = OrderedDict((key, size) for key, (_, size) in by_use)
+        self._total = sum(self._index.values())
+
+    def evict(self):
+        """Remove the least recently used entries until the budget is met.
+
+        The folder is scanned once, later calls only remove entries from the
+        index kept in memory.
+        """
+
+        with self._lock:
+            if self._index is None:
+                self._scan()
+
+            while self._total > self.budget and self._index:
+                key, size = self._index.popitem(last=False)
+                # all levels, also those of earlier versions of `LEVELS`
+                for path in (self.root / key[:2]).glob(f"{key}_*.npy"):
+                    path.unlink(missing_ok=True)
+                self._total -= size
@@ -16,7 +16,6 @@
 # this program. If not, see <https://www.gnu.org/licenses/>.
 #
 
-import csv
 import json
 import logging
 import time
@@ -26,13 +25,23 @@ from typing import Union
 
 import cv2 as cv
 import numpy as np
-from pydantic import ValidationError
 
 from snowimagerpro.core._GLOBALS import ROOT
 
 from ..metadata import ImageMetadata
 from .helper import error_msg
-from .image_loading import load_bayer, load_dng, load_dng_preview
+from .image_db import read_db, write_db
+from .image_loading import (
+    load_bayer,
+    load_bayer_preview,
+    load_dng,
+    load_dng_preview,
+    load_raw,
+    probe,
+    probe_fields,
+)
+from .ingest import ingest, scan
+from .metadata_index import get_aux_data, get_sn
 
 DEBUG = False
 
@@ -41,67 +50,70 @@ def load_db(_db_path):
     """
     Load a database from the given file path.
     Args:
-        _db_path (str): The path to the database file.
+        _db_path (str): The path to the database file (.csv or .sqlite).
     Returns:
-        dict: A dictionary containing the loaded image database.
-    Raises:
-        SyntaxError: If there is a syntax error while loading the database.
+        ImageDB: The loaded image database (a mapping of IDs to ImageMetadata),
+            rows that could not be read are listed in its `bad_rows`.
     """
 
     logging.info(f"loading db from {_db_path}")
 
-    try:
-        with open(_db_path) as data_file:
-            reader = csv.DictReader(data_file)
+    return read_db(_db_path)
+
 
-            image_db = {}
-            for row in reader:
-                try:
-                    meta = ImageMetadata(**row)
-                except ValidationError as e:
-                    print(json.dumps(e.errors(), indent=4))
-                image_db[meta.ID] = meta
+def save_db(image_db, _db_path):
+    """
+    Save a database to the given file path.
+    Args:
+        image_db (dict): Mapping of IDs to ImageMetadata.
+        _db_path (str): The path to the database file. CSV files are
+            rewritten, SQLite files (.sqlite, .sqlite3, .db) only get the
+            entries changed since the database was loaded from them.
+    """
 
-    except SyntaxError as error:
-        logging.info("failed to load database (init_tree).")
-        logging.info(error)
+    logging.info(f"saving db to {_db_path}")
 
-    return image_db
+    write_db(image_db, _db_path)
 
 
-def load_image(fp):
+def load_image(fp, index=None):
     """
     Load an image file and return the data and EXIF metadata.
     Args:
         fp (str): The file path of the image file.
+        index (MetadataIndex, optional): Cache of the parsed EXIF metadata.
     Returns:
         tuple: A tuple containing the image data and EXIF metadata.
     Raises:
         None
     """
 
-    ext = fp.suffix[1:]
+    ext = fp.suffix[1:].lower()
     if ext == "bay":
         logging.info("load single .bay image")
-        _data, _exif = load_bayer(fp)
+        _data, _exif = load_bayer(fp, index=index)
     elif ext == "dng":
         logging.info("load single .dng image")
-        _data, _exif = load_dng(fp)
-    elif ext == "RAW":
+        _data, _exif = load_dng(fp, index=index)
+    elif ext == "raw":
         logging.info("load single .raw image")
-        # TODO: load RAW from MOSAiC
-        pass
+        _data, _exif = load_raw(fp)
     else:
         logging.info(f"File with extension {ext} is not a valid image file.")
 
     return _data, _exif
 
 
-def load_preview(fp):
+# subsampling of the previews decoded by `load_preview`
+PREVIEW_SHRINK = 4
+
+
+def load_preview(fp, shrink=PREVIEW_SHRINK):
     """
     Load a preview image from the given file path.
     Parameters:
     - fp (str): The file path of the image file.
+    - shrink (int): Subsampling of .bay previews, only the needed pixels are decoded.
     Returns:
     - _out (ndarray or None): The loaded image as a NumPy array, or None if the file is not a valid image file.
     - None: This function always returns None as the second value.
@@ -110,8 +122,7 @@ def load_preview(fp):
     ext = fp.suffix[1:]
 
     if ext == "bay":
-        _out, _ = load_bayer(fp, shrink=1)
-        _out = _out[:, :, 0]
+        _out, _ = load_bayer_preview(fp, shrink=shrink)
     elif ext == "dng":
         _out, _ = load_dng_preview(fp)
     else:
@@ -266,17 +277,36 @@ def coords_mm_to_pix(images):
 
     """
 
-    y_max = 0
-    x_min = 0
+    positions = image_positions(
+        {key: (img._meta, get_img_size(img)) for key, img in images.items()}
+    )
 
     for key, img in images.items():
-        img_size = get_img_size(img)
+        img._pos = positions[key]
+
+    return images
 
-        coords_pix = [int(a * b) for a, b in zip(img._meta.coords_pix, img_size)]
 
-        coords_mm = img._meta.coords_mm
+def image_positions(entries) -> dict:
+    """Positions of images on the super-image, from their metadata and size.
 
-        px_2_mm = img._meta.px_2_mm
+    Args:
+        entries (dict): (metadata, [width, height]) by key.
+
+    Returns:
+        dict: (x, y) position in pixels by key.
+    """
+
+    y_max = 0
+    x_min = 0
+
+    positions = {}
+    for key, (meta, img_size) in entries.items():
+        coords_pix = [int(a * b) for a, b in zip(meta.coords_pix, img_size)]
+
+        coords_mm = meta.coords_mm
+
+        px_2_mm = meta.px_2_mm
 
         coords_mm_in_pix = [int(a / px_2_mm) for a in coords_mm]
 
@@ -287,15 +317,9 @@ def coords_mm_to_pix(images):
             else x_min
         )
 
-        coords_mm_in_pix = (coords_mm_in_pix[0] - coords_pix[0], coords_mm_in_pix[1])
-        img._pos = coords_mm_in_pix
+        positions[key] = (coords_mm_in_pix[0] - coords_pix[0], coords_mm_in_pix[1])
 
-    for key, img in images.items():
-        coords_mm_in_pix = img._pos
-        coords_mm_in_pix = (coords_mm_in_pix[0] - x_min, y_max - coords_mm_in_pix[1])
-        img._pos = coords_mm_in_pix
-
-    return images
+    return {key: (x - x_min, y_max - y) for key, (x, y) in positions.items()}
 
 
 def image_sorting(images):
@@ -447,10 +471,11 @@ def image_blending(
     images, algo="laplPyr", sigmaX=100, sigmaY=100
 ) -> tuple[np.ndarray, Union[list, None], Union[list, None]]:
     # collect metadata of individual images
-    meta = [(k, v._meta.__dict__) for k, v in images.items()]
+    meta = [(k, v._meta.to_dict()) for k, v in images.items()]
     exif = [(k, v._exif) for k, v in images.items()]
 
-    images = deepcopy(images)  # avoid rotation when processing several times
+    # avoid rotation when processing several times, the data is not copied
+    images = {key: img.stage_copy() for key, img in images.items()}
 
     for _img in images.values():
         t = time.time()
@@ -524,23 +549,40 @@ def image_blending_laplPyr(images, sigmaX=100, sigmaY=100) -> np.ndarray:
     - finding center of mass and shape of mask
 
     """
-    image: np.ndarray = np.zeros((1, 1))
+    blender = LaplPyrBlender(sigmaX, sigmaY)
+
+    for _img in convert_to_grayscale(images).values():
+        blender.add(_img)
+
+    return blender.image
+
 
-    images = convert_to_grayscale(images)
+class LaplPyrBlender:
+    """Blends images into the super-image one at a time, in the order they are
+    added (see `image_blending_laplPyr`), so they can be released after."""
 
-    masks = []
+    def __init__(self, sigmaX=100, sigmaY=100):
+        self.sigmaX = sigmaX
+        self.sigmaY = sigmaY
 
-    for i, _img in enumerate(images.values()):
+        self.image: np.ndarray = np.zeros((1, 1))
+        self.masks = []
+        self.n = 0
+
+    def add(self, _img):
+        """Blend the (grayscale) image `_img`, placed at `_img._pos`."""
+
+        image = self.image
         dx, dy = _img._pos
 
         t = time.time()
         _data, image = image_registration(_img._data, image, dx, dy)
         logging.info(f"Alignment in {time.time() - t} sec")
 
-        if i > 0:
+        if self.n > 0:
             t = time.time()
-            mask, crop = _mask(image, _data, sigmaX, sigmaY)
-            masks.append(mask)  ### TODO: mask parameters for reusability
+            mask, crop = _mask(image, _data, self.sigmaX, self.sigmaY)
+            self.masks.append(mask)  ### TODO: mask parameters for reusability
             logging.info(f"Masking in {time.time() - t} sec")
 
             t = time.time()
@@ -564,7 +606,8 @@ def image_blending_laplPyr(images, sigmaX=100, sigmaY=100) -> np.ndarray:
         if DEBUG:
             image += stitching_line_img
 
-    return image
+        self.image = image
+        self.n += 1
 
 
 def _mask(image_A, image_B, sigmaX, sigmaY):
@@ -624,8 +667,9 @@ def _laplPyr_blend(image_A, image_B, mask, crop):
         G = cv.pyrDown(G)
         gpB.append(G)
 
-    # generate Gaussian pyramid for mask
-    G = mask.copy()
+    # generate Gaussian pyramid for mask (in the precision of the images,
+    # an integer mask would promote the blend to float64)
+    G = mask.astype(image_A.dtype)
     gpM = [G]
     for i in range(pyrLvls):
         G = cv.pyrDown(G)
@@ -683,20 +727,3 @@ def convert_to_grayscale(images) -> dict:
             print("gray image already")
 
     return images
-
-
-def get_sn(exif) -> str:
-    if exif is not None:
-        try:
-            sn = str(exif["Image BodySerialNumber"])
-        except Exception as e:
-            print(e)
-            try:
-                sn = exif["metadata"]["device"]
-            except Exception as e:
-                print(e)
-
-    else:
-        sn = "unknown"
-
-    return sn
@@ -0,0 +1,134 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Selecting entries of an image database by their metadata.
+
+The fields are read as columns (one array per field, see `ImageDB.column`)
+and every filter is evaluated as a boolean mask over all entries.
+"""
+
+import json
+
+import numpy as np
+
+from snowimagerpro.core.methods.image_db import LIST_FIELDS, NUMERIC_FIELDS, to_points
+
+
+def keys_array(image_db) -> np.ndarray:
+    if hasattr(image_db, "keys_array"):
+        return image_db.keys_array()
+    return np.fromiter(image_db.keys(), dtype=np.int64, count=len(image_db))
+
+
+def column(image_db, name) -> np.ndarray:
+    """Values of field `name` of all entries, in order (see `ImageDB.column`)."""
+
+    if hasattr(image_db, "column"):
+        return image_db.column(name)
+
+    out = np.empty(len(image_db), dtype=NUMERIC_FIELDS.get(name, object))
+    for pos, entry in enumerate(image_db.values()):
+        value = getattr(entry, name)
+        out[pos] = json.dumps(value) if name in LIST_FIELDS else value
+
+    return out
+
+
+def point_columns(image_db, name="coords_mm"):
+    """First and second value of the point field `name` of all entries.
+
+    Returns:
+        tuple: (x, z) float arrays, NaN where the point has fewer values.
+    """
+
+    if hasattr(image_db, "points"):
+        points = image_db.points(name)
+    else:
+        points = to_points([getattr(entry, name) for entry in image_db.values()])
+
+    return points[:, 0], points[:, 1]
+
+
+def _isin(values, wanted):
+    # the text fields are str, compared as objects without conversion
+    if isinstance(wanted, (list, tuple, set, np.ndarray)):
+        mask = np.zeros(len(values), dtype=bool)
+        for w in set(str(w) for w in wanted):
+            mask |= values == w
+        return mask
+    return values == str(wanted)
+
+
+def query(
+    image_db,
+    ids=None,
+    date=None,
+    location=None,
+    img_type=None,
+    meas_group=None,
+    wavelength=None,
+    bbox=None,
+) -> np.ndarray:
+    """IDs of the entries matching all given filters.
+
+    Args:
+        image_db (dict): Mapping of IDs to ImageMetadata.
+        ids (list, optional): Only consider these entries.
+        date, location, img_type, meas_group (optional): A value, or a list
+            of accepted values.
+        wavelength (optional): A value, or a (min, max) range including the
+            limits; either limit may be None.
+        bbox (tuple, optional): (x_min, z_min, x_max, z_max), the entries
+            with `coords_mm` inside (limits included).
+
+    Returns:
+        np.ndarray: IDs of the matching entries, in the order of the db.
+    """
+
+    keys = keys_array(image_db)
+    mask = np.ones(len(keys), dtype=bool)
+
+    if ids is not None:
+        mask &= np.isin(keys, np.asarray(list(ids), dtype=np.int64))
+
+    for name, wanted in [
+        ("date", date),
+        ("location", location),
+        ("img_type", img_type),
+        ("meas_group", meas_group),
+    ]:
+        if wanted is not None:
+            mask &= _isin(column(image_db, name), wanted)
+
+    if wavelength is not None:
+        values = column(image_db, "wavelength")
+        if isinstance(wavelength, (list, tuple)):
+            low, high = wavelength
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        else:
+            mask &= values == wavelength
+
+    if bbox is not None:
+        x_min, z_min, x_max, z_max = bbox
+        x, z = point_columns(image_db, "coords_mm")
+        mask &= (x >= x_min) & (x <= x_max) & (z >= z_min) & (z <= z_max)
+
+    return keys[mask]
@@ -0,0 +1,145 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Decoding of raw images in worker processes.
+
+The workers decode an image into a `multiprocessing.shared_memory` block and
+only return the name, shape and dtype of the block together with the (small)
+metadata dict. The parent maps the block and uses it as image data without
+copying or unpickling the pixels.
+"""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = "core.shared_loading"
+
+# metadata indices opened by a worker process, by path
+_indices = {}
+
+
+def _index(index_path):
+    if index_path is None:
+        return None
+
+    if index_path not in _indices:
+        from snowimagerpro.core.methods.metadata_index import MetadataIndex
+
+        _indices[index_path] = MetadataIndex(index_path)
+
+    return _indices[index_path]
+
+
+def load_to_shared(fp, dtype, index_path=None):
+    """Decode `fp` into a new shared memory block (runs in a worker process).
+
+    Args:
+        fp (str | Path): Image file.
+        dtype (str): Data type of the image in the block.
+        index_path (str | Path | None): Metadata index to use.
+
+    Returns:
+        tuple: (block name, shape, dtype string, exif)
+    """
+
+    import snowimagerpro.core.methods.processing as pro
+
+    data, exif = pro.load_image(fp, index=_index(index_path))
+    data = np.asarray(data, dtype=dtype)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    try:
+        view = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+        view[...] = data
+        del view
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+
+    shm.close()  # the block lives on until the parent unlinks it
+
+    return shm.name, data.shape, data.dtype.str, exif
+
+
+def process_pool(workers=None) -> ProcessPoolExecutor:
+    """Pool of decoding worker processes.
+
+    Workers are spawned rather than forked, forking a process that runs Qt
+    threads is not safe.
+    """
+
+    return ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+class SharedFrames:
+    """Shared memory blocks mapped into this process as image data.
+
+    Blocks are unlinked as soon as they are mapped, the memory is returned
+    to the system once the block is closed. A block can only be closed when
+    no array uses it anymore, `release` closes those blocks and keeps the
+    others for a later call.
+    """
+
+    def __init__(self):
+        self._blocks = []
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @property
+    def nbytes(self):
+        return sum(shm.size for shm in self._blocks)
+
+    def attach(self, name, shape, dtype) -> np.ndarray:
+        """Map the block `name` and return it as array (no copy)."""
+
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+        self._blocks.append(shm)
+
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    def release(self):
+        """Close the blocks that are no longer used by any array."""
+
+        in_use = []
+        for shm in self._blocks:
+            try:
+                shm.close()
+            except BufferError:
+                in_use.append(shm)
+
+        if in_use:
+            logging.getLogger(logger).debug(
+                f"{len(in_use)} shared image blocks still in use"
+            )
+
+        self._blocks = in_use
@@ -0,0 +1,202 @@
+#
+# This file is part of SnowImagerPro (https://github.com/lbmnky/SnowImagerPro).
+#
+# Copyright (C) 2025 Lars Mewes
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program. If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Outputs of the processing stages of an `ImageSet`.
+
+Every stage works on copies of the images of the previous stage made by
+`Image.stage_copy`. These copies share metadata and EXIF with the previous
+stage, and their data as a read-only view until the stage assigns its
+result. Only the arrays a stage computes take new memory.
+
+When a stage is done, the outputs it supersedes are handled by the policy:
+
+- "keep": kept in memory, e.g. to show them in the app
+- "release": dropped
+- "spill": written to .npy files and memory-mapped read-only, so they stay
+  available but leave RAM
+
+The resident bytes of all stages are recorded at the end of each stage,
+while its inputs are still held, as the peak of that stage.
+"""
+
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+logger = "core.stage_buffers"
+
+POLICIES = ("keep", "release", "spill")
+
+
+def _base(array):
+    while isinstance(array.base, np.ndarray) and not isinstance(array, np.memmap):
+        array = array.base
+    return array
+
+
+def resident_bytes(*stages) -> int:
+    """Bytes of the image arrays of `stages` (dicts of `Image`) in memory.
+
+    Arrays shared by several images (views) are counted once, memory-mapped
+    arrays are not counted.
+    """
+
+    bases = {}
+    for images in stages:
+        for img in images.values():
+            data = getattr(img, "_data", None)
+            if not isinstance(data, np.ndarray):
+                continue
+            base = _base(data)
+            if not isinstance(base, np.memmap):
+                bases[id(base)] = base.nbytes
+
+    return sum(bases.values())
+
+
+class StageBuffers:
+    """The images of each processing stage, by stage name.
+
+    Args:
+        policy (str): What happens to superseded stages, see `POLICIES`.
+        spill_dir (str | Path, optional): Directory for spilled stages, a
+            temporary directory by default.
+    """
+
+    def __init__(self, policy="keep", spill_dir=None):
+        self.policy = policy
+        self.spill_dir = spill_dir
+
+        self._stages = {}
+        self._spilled = {}  # stage name -> files
+        self._tmp_dir = None
+
+        # resident bytes at the end of each stage
+        self.peak = {}
+
+    def __contains__(self, name):
+        return name in self._stages
+
+    def __getitem__(self, name):
+        return self._stages[name]
+
+    def get(self, name, default=None):
+        return self._stages.get(name, default)
+
+    def put(self, name, images, superseded=()):
+        """Store the output `images` of stage `name`.
+
+        Args:
+            superseded (list): Names of the stages whose images are not needed
+                any more, handled by the policy.
+        """
+
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown stage policy {self.policy}, use one of {POLICIES}")
+
+        self.release(name)
+        self._stages[name] = images
+
+        resident = self.resident_bytes()
+        self.peak[name] = resident
+
+        for old in superseded:
+            if old == name or old not in self._stages:
+                continue
+            if self.policy == "release":
+                self.release(old)
+            elif self.policy == "spill":
+                self.spill(old)
+
+        logging.getLogger(logger).info(
+            f"Stage {name}: {len(images)} images, {resident / 2**20:.0f} MB resident "
+            f"at the end, {self.resident_bytes() / 2**20:.0f} MB kept"
+        )
+
+    def resident_bytes(self) -> int:
+        return resident_bytes(*self._stages.values())
+
+    def release(self, name):
+        """Drop the images of stage `name` (and their spill files)."""
+
+        self._stages.pop(name, None)
+
+        for fp in self._spilled.pop(name, []):
+            try:
+                fp.unlink()
+            except OSError:
+                pass  # still mapped (Windows), removed with the directory
+
+    def spill(self, name):
+        """Move the image data of stage `name` to memory-mapped files."""
+
+        if self._tmp_dir is None:
+            if self.spill_dir is not None:
+                Path(self.spill_dir).mkdir(parents=True, exist_ok=True)
+            self._tmp_dir = Path(tempfile.mkdtemp(prefix="stages-", dir=self.spill_dir))
+
+        files = self._spilled.setdefault(name, [])
+        for key, img in self._stages[name].items():
+            data = getattr(img, "_data", None)
+            if not isinstance(data, np.ndarray) or isinstance(_base(data), np.memmap):
+                continue
+
+            fp = self._tmp_dir / f"{name}-{key}.npy"
+            np.save(fp, data)
+            img._data = np.load(fp, mmap_mode="r")
+            files.append(fp)
+
+    def report(self) -> dict:
+        """Peak resident bytes by stage, in the order the stages were run."""
+        return dict(self.peak)
+
+    def clear(self):
+        for name in list(self._stages):
+            self.release(name)
+        self.peak = {}
+
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+
+def stage_property(name):
+    """`ImageSet` attribute for the images of stage `name` in its `stages`.
+
+    Missing stages raise AttributeError, so ``hasattr`` tells whether the
+    stage was run; ``del`` releases it.
+    """
+
+    def fget(self):
+        try:
+            return self.stages[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def fset(self, images):
+        self.stages.put(name, images)
+
+    def fdel(self):
+        if name not in self.stages:
+            raise AttributeError(name)
+        self.stages.release(name)
+
+    return property(fget, fset, fdel)
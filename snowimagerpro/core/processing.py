@@ -19,7 +19,9 @@
 import concurrent.futures
 import json
 import logging
-from copy import deepcopy
+import threading
+from contextlib import contextmanager
+from copy import copy, deepcopy
 from datetime import datetime
 from pathlib import Path
 from typing import Union
@@ -33,21 +35,87 @@ from scipy import ndimage
 import snowimagerpro.core.methods.processing as pro
 from snowimagerpro.core.metadata import ImageMetadata, StitchedMetadata
 from snowimagerpro.core.methods import helper
+from snowimagerpro.core.methods.correction import (
+    FFC_CLIP,
+    ffc_refl_cal,
+    refl_cal_coefficients,
+)
+from snowimagerpro.core.methods.correction_cache import CorrectionCache
+from snowimagerpro.core.methods.edit_batch import EditBatch
+from snowimagerpro.core.methods.image_db import MetadataRow
+from snowimagerpro.core.methods.journal import EditJournal
+from snowimagerpro.core.methods.link_table import LinkTable
+from snowimagerpro.core.methods.metadata_index import MetadataIndex
+from snowimagerpro.core.methods.query import query
+from snowimagerpro.core.methods.stage_buffers import StageBuffers, stage_property
+from snowimagerpro.core.methods.shared_loading import (
+    SharedFrames,
+    load_to_shared,
+    process_pool,
+)
 from snowimagerpro.core.validators import OutputDataValidator
 
 DEBUG = 0
 
 logger = "core.processing"
 
+# precision of the image data in all processing stages
+DEFAULT_DTYPE = np.float32
+
 
 class ImageSet:
-    def __init__(self):
+    # images after each processing stage, held in `stages`
+    imgs_post_ffc = stage_property("ffc")
+    imgs_post_refl_cal = stage_property("refl_cal")
+    imgs_post_undistort = stage_property("undistort")
+    stitched_image = stage_property("stitched")
+
+    def __init__(self, dtype=DEFAULT_DTYPE, load_backend="thread", load_workers=None):
+        # precision of the loaded images and of every processing stage
+        self.dtype = np.dtype(dtype)
+
+        # stage outputs share metadata and unchanged data with their inputs;
+        # superseded stages are kept, released or spilled to disk (`policy`)
+        self.stages = StageBuffers()
+
+        # correction frames (and master darks) shared by the images of a link
+        # group; `master_dark` averages all darks of a group instead of using
+        # the last one
+        self.correction_cache = CorrectionCache()
+        self.master_dark = False
+
+        # "thread": decode in a thread pool, "process": decode in worker
+        # processes into shared memory (not limited by the GIL)
+        self.load_backend = load_backend
+        self.load_workers = load_workers
+        self._process_pool = None
+        self._shared_frames = SharedFrames()
+
         self.total_progress = 0
         self.status_msg = ""
 
         self.autosave_on = False
 
+        # autosave appends the edits to a journal next to the db, which is
+        # written into the db in the background every `compact_after` records
+        self.journal = None
+        self.compact_after = 1000
+        self._journal_ready = False
+        self._compaction = None
+        self._compaction_lock = threading.Lock()
+
+        # edits grouped by `batch`, the last `max_undo` can be undone;
+        # `edit_listeners` are called with the edited keys of every batch
+        self._batch = None
+        self.undo_stack = []
+        self.max_undo = 50
+        self.edit_listeners = []
+
         self.current_db_path = None
+        self.metadata_index = None
+
+        # Catalog of all databases, databases it has loaded are not read again
+        self.catalog = None
 
         self._db_path = ""
         self._data_dir = ""
@@ -100,110 +168,348 @@ class ImageSet:
         self.load_db("path/to/db")
 
     def load_db(self, db_path: str | Path, data_dir: str | Path | None = None):
+        self.close_journal()  # of the previous db
+
         self.current_db_path = db_path
 
         if data_dir:
             self._data_dir = data_dir
 
-        image_db = pro.load_db(db_path)
+        image_db = None
+        if self.catalog is not None:
+            image_db = self.catalog.take(db_path)
+        if image_db is None:
+            image_db = pro.load_db(db_path)
 
+        keys = list(image_db.keys())
         image_db = helper.expand_db_by_meas_group(image_db)
         self._image_db = image_db
+        self.undo_stack = []
+
+        # expanded entries get new IDs on every load, journal records refer to
+        # them only once the expansion has been saved
+        self._journal_ready = list(image_db.keys()) == keys
+
+        self.journal = EditJournal.for_db(db_path)
+        n = self.journal.replay(self._image_db)
+        if n:
+            logging.getLogger(logger).warning(
+                f"Recovered {n} unsaved edits of {db_path} from {self.journal.path}"
+            )
+            self.compact_journal()
+
+        if self.metadata_index is not None:
+            self.metadata_index.close()
+        self.metadata_index = MetadataIndex.for_db(db_path)
 
         self.generate_link_table()
 
-    def autosave_db(self):
-        if self.autosave_on:
+    def autosave_db(self, keys=None, removed=None):
+        """Save the edits of the current db, if autosave is on.
+
+        Args:
+            keys (list, optional): Keys of the edited or added entries. They
+                are appended to the journal of the db, instead of rewriting
+                the whole db. Without keys the db is saved.
+            removed (list, optional): Keys of the removed entries.
+        """
+
+        if not self.autosave_on:
+            return
+
+        if self.journal is None or (keys is None and removed is None):
+            return self.save_db()
+
+        if not self._journal_ready:
             self.save_db()
+            self._journal_ready = True
+            return
+
+        if keys:
+            self.journal.put(
+                [self._image_db[key] for key in keys if key in self._image_db]
+            )
+        if removed:
+            self.journal.delete(removed)
+
+        if self.journal.n_records >= self.compact_after:
+            self.compact_journal(background=True)
 
     def save_db(self, fp=None):
-        if not fp:
-            fp = self.current_db_path
-
-        with open(str(fp), "w") as f:
-            f.write(",".join(ImageMetadata.to_key_list()) + "\n")
-
-            for entry in self._image_db.values():
-                _tmp = []
-                for _key, item in zip(entry.to_key_list(), entry.to_list()):
-                    if isinstance(item, list):
-                        _tmp.append('"' + str(item) + '"')
-                    else:
-                        if _key in [
-                            "meas_group",
-                            "aux_data",
-                        ]:  # FIX because of commas in csv
-                            _tmp.append('"' + str(item) + '"')
-                        else:
-                            _tmp.append(str(item))
-
-                f.write(",".join(_tmp) + "\n")
-
-    def regenerate_link_table(self):
-        self.generate_link_table()
+        if fp and str(fp) != str(self.current_db_path):
+            return pro.save_db(self._image_db, fp)
+
+        if self.journal is None:
+            return pro.save_db(self._image_db, self.current_db_path)
+
+        # the journaled edits are in the db now
+        with self._compaction_lock:
+            self.journal.begin_compaction()
+            pro.save_db(self._image_db, self.current_db_path)
+            self.journal.end_compaction()
+
+    def compact_journal(self, background=False):
+        """Write the journaled edits into the db file.
+
+        Args:
+            background (bool): Write in a separate thread, edits made in the
+                meantime go to a new journal.
+        """
+
+        if self.journal is None:
+            return
+
+        if background:
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+            self._compaction = threading.Thread(
+                target=self.compact_journal, daemon=True
+            )
+            self._compaction.start()
+            return
+
+        with self._compaction_lock:
+            if not self.journal.begin_compaction():
+                return
+
+            try:
+                pro.save_db(self._image_db, self.current_db_path)
+            except RuntimeError as e:  # db edited while it was written
+                logging.getLogger(logger).warning(
+                    f"Compaction of {self.journal.path} postponed: {e}"
+                )
+                return
+
+            self.journal.end_compaction()
+
+    def close_journal(self):
+        """Compact and close the journal of the current db."""
+
+        if self.journal is None:
+            return
+
+        if self._compaction is not None:
+            self._compaction.join()
+        self.compact_journal()
+        self.journal = None
+
+    def close(self):
+        self.close_journal()
+        self.shutdown_workers()
+        self.stages.clear()
+
+    def query(self, **filters):
+        """IDs of the entries of the db matching the filters.
+
+        Example: ``img_set.query(date="2024-01-31", wavelength=(900, 1000))``.
+        See `core.methods.query.query` for the filters.
+
+        Returns:
+            np.ndarray: The IDs, in the order of the db.
+        """
+
+        return query(self._image_db, **filters)
+
+    @contextmanager
+    def batch(self, label=""):
+        """Group edits of the db into one step.
+
+        The entries edited in the block (by `update_entries`, `add_entries`
+        and `remove_entries`, or in place after `EditBatch.record`) are
+        relinked, passed to the `edit_listeners` and autosaved once, at the
+        end of the outermost block, and undone by one call of `undo`.
+
+        Example::
+
+            with img_set.batch("Add ROI") as batch:
+                batch.record(keys)
+                for key in keys:
+                    img_set._image_db[key].ROI[1].append(roi)
+
+        Yields:
+            EditBatch: The step, nested blocks yield the outer one.
+        """
+
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        self._batch = EditBatch(self._image_db, label)
+        try:
+            yield self._batch
+        finally:
+            batch, self._batch = self._batch, None
+            if batch:
+                self.undo_stack.append(batch)
+                del self.undo_stack[: -self.max_undo]
+                self._commit(batch)
+
+    def _commit(self, batch):
+        keys, removed = batch.split_keys()
+
+        self.regenerate_link_table(batch.keys)
+        for listener in self.edit_listeners:
+            listener(batch.keys)
+        self.autosave_db(keys=keys, removed=removed)
+
+    def undo(self):
+        """Undo the last batch of edits.
+
+        Returns:
+            EditBatch: The undone step, None if there is nothing to undo.
+        """
+
+        if not self.undo_stack:
+            return None
+
+        batch = self.undo_stack.pop()
+        batch.undo()
+        self._commit(batch)
+
+        return batch
+
+    def update_entries(self, keys, **values):
+        """Set fields of the entries `keys` of the db to the same values.
+
+        Example: ``img_set.update_entries(keys, img_type="ref", ref_group=2)``.
+        The values are validated once and written as one edit per field.
+        """
+
+        keys = [int(key) for key in keys]
+
+        with self.batch("Edit " + ", ".join(values)) as batch:
+            batch.record(keys)
+
+            if hasattr(self._image_db, "assign"):
+                self._image_db.assign(keys, **values)
+            else:
+                for key in keys:
+                    for name, value in values.items():
+                        setattr(self._image_db[key], name, value)
+
+    def add_entries(self, entries):
+        """Add the `ImageMetadata` entries to the db, as one step."""
+
+        with self.batch("Add images") as batch:
+            batch.record([meta.ID for meta in entries])
+            for meta in entries:
+                self._image_db[meta.ID] = meta
+
+    def remove_entries(self, keys):
+        """Remove the entries `keys` from the db, as one step."""
+
+        keys = [int(key) for key in keys]
+
+        with self.batch("Remove images") as batch:
+            batch.record(key for key in keys if key in self._image_db)
+            for key in keys:
+                self._image_db.pop(key, None)
+
+    def regenerate_link_table(self, keys=None):
+        """Update the links of the entries edited, added or removed since the
+        link table was generated.
+
+        Args:
+            keys (list, optional): The edited entries, if known. Saves
+                comparing all entries with the table.
+        """
+
+        if not isinstance(getattr(self, "_link_table", None), LinkTable):
+            return self.generate_link_table()
+
+        if self._link_table.sync(self._image_db, keys):
+            self.report_links()
 
     def generate_link_table(self):
-        link_table = {}
         db_path = self.current_db_path
-        image_db = self._image_db
 
         logging.getLogger(logger).info(f"Generating link table for {db_path}")
 
-        has_ref = False
-        for key in image_db.keys():
-            if image_db[key].img_type == "ref":
-                has_ref = True
-                break
-
-        if has_ref:
-            for key, entry in image_db.items():
-                if entry.wavelength != 0:
-                    link_entry = {}
-                    link_entry.update(
-                        {
-                            "dark_id": v.ID
-                            for k, v in image_db.items()
-                            if v.drk_group == entry.drk_group
-                            and v.meas_group == entry.meas_group
-                            and v.wavelength == 0
-                            and k != key
-                        }
-                    )
+        self._link_table = LinkTable.build(self._image_db)
 
-                try:
-                    if entry.img_type not in ["ref"]:
-                        link_entry.update(
-                            {
-                                "ref_id": v.ID
-                                for k, v in image_db.items()
-                                if v.ref_group == entry.ref_group
-                                and v.meas_group == entry.meas_group
-                                and v.wavelength != 0
-                                and v.img_type == "ref"
-                            }
-                        )
-
-                    link_table.update({key: deepcopy(link_entry)})
-                except Exception as e:
-                    print("Error linking images.")
-
-        if not link_table:
+        if not self._link_table:
             print("No reference images found.")
 
-        self._link_table = link_table
+        self.report_links()
+
+    def report_links(self):
+        for msg in self._link_table.report():
+            logging.getLogger(logger).warning(msg)
 
     def load_images(self, list_of_idx):
         self.reset()
 
         self._selected_images = {}
+        self._shared_frames.release()  # blocks of the previous selection
+
+        self.validate_images(list_of_idx)
+
+        if self.load_backend == "process":
+            self._load_images_in_processes(list_of_idx)
+        else:
+            self._load_images_in_threads(list_of_idx)
+
+    def report_stages(self) -> dict:
+        """Peak resident bytes of the image data by processing stage."""
+
+        peak = self.stages.report()
+        for name, nbytes in peak.items():
+            logging.getLogger(logger).info(f"Peak of stage {name}: {nbytes / 2**20:.0f} MB")
+
+        return peak
+
+    def probe_images(self, list_of_idx) -> dict:
+        """Probe the files of the images `list_of_idx` (headers only).
+
+        Returns:
+            dict: `pro.probe` result by image ID.
+        """
+
+        metas = [self._image_db[i] for i in list_of_idx]
+        fps = [Path(self._data_dir) / meta.filepath for meta in metas]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            infos = executor.map(
+                lambda fp: pro.probe(fp, index=self.metadata_index), fps
+            )
+
+            return {meta.ID: info for meta, info in zip(metas, infos)}
+
+    def validate_images(self, list_of_idx) -> dict:
+        """Raise a ValueError naming all images that cannot be loaded.
+
+        Returns:
+            dict: `pro.probe` result by image ID.
+        """
+
+        infos = self.probe_images(list_of_idx)
+        invalid = [
+            f"{info['path']} ({info['error']})"
+            for info in infos.values()
+            if not info["valid"]
+        ]
+
+        if invalid:
+            for msg in invalid:
+                logging.getLogger(logger).error(f"Cannot load {msg}")
+            raise ValueError(
+                f"{len(invalid)} of {len(list_of_idx)} images cannot be loaded: "
+                + ", ".join(invalid)
+            )
+
+        return infos
+
+    def _load_images_in_threads(self, list_of_idx):
         futures = list()
         self.inc_progress_by(1, status_msg="Loading images ...", reset=True)
         N = len(list_of_idx)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.load_workers or 10
+        ) as executor:
             for meta in [self._image_db[i] for i in list_of_idx]:
-                img = Image()
+                img = Image(dtype=self.dtype)
                 future = executor.submit(
-                    img.load_from, meta, self._data_dir
+                    img.load_from, meta, self._data_dir, index=self.metadata_index
                 )  # running in parallel to speed up loading
                 future.add_done_callback(
                     lambda event, progress=(100 / N): self.inc_progress_by(progress)
@@ -215,8 +521,101 @@ class ImageSet:
         for future in futures:
             future.result()  # catch exceptions
 
+    def _load_images_in_processes(self, list_of_idx):
+        if self._process_pool is None:
+            self._process_pool = process_pool(self.load_workers)
+
+        index_path = self.metadata_index.path if self.metadata_index else None
+
+        futures = {}
+        self.inc_progress_by(1, status_msg="Loading images ...", reset=True)
+        N = len(list_of_idx)
+        for meta in [self._image_db[i] for i in list_of_idx]:
+            fp = meta.filepath
+            if self._data_dir:
+                fp = Path(self._data_dir) / fp
+
+            logging.getLogger(logger).info(f"Loading image {fp}")
+
+            future = self._process_pool.submit(
+                load_to_shared, fp, self.dtype.str, index_path
+            )
+            futures[future] = meta
+
+        error = None
+        for future in concurrent.futures.as_completed(futures):
+            meta = futures[future]
+            try:
+                name, shape, dtype, exif = future.result()
+            except Exception as e:
+                # wait for the others, their blocks are unlinked when attached
+                error = error or e
+                continue
+
+            img = Image(dtype=self.dtype)
+            img._meta = meta
+            img._data = self._shared_frames.attach(name, shape, dtype)
+            img._exif = exif
+            self._selected_images[meta.ID] = img
+
+            self.inc_progress_by(100 / N)
+
+        if error is not None:
+            raise error
+
+        # in the order of list_of_idx, as loaded by the thread backend
+        self._selected_images = {
+            meta.ID: self._selected_images[meta.ID]
+            for meta in [self._image_db[i] for i in list_of_idx]
+        }
+
+    def shutdown_workers(self):
+        """Stop the worker processes of the "process" loading backend."""
+        if self._process_pool is not None:
+            self._process_pool.shutdown()
+            self._process_pool = None
+
+    def _dark_ids(self, key, images):
+        """IDs of the dark images of entry `key`: the linked one, or all darks
+        of its group with `master_dark`."""
+
+        ids = [self._link_table[key]["dark_id"]]
+        if self.master_dark:
+            ids = self._link_table.ambiguous.get(key, {}).get("dark_id", ids)
+
+        for _id in ids:
+            if _id not in images:
+                raise ReferenceError(f"Dark image {_id} of image {key} is not loaded")
+
+        return tuple(ids)
+
+    def _ffc_frames(self, key, images, corrs):
+        """Dark and correction frame of the measurement image `key`.
+
+        Args:
+            corrs (dict): Frames of the current run, by linked images.
+        """
+
+        ref_id = self._link_table[key]["ref_id"]
+        if ref_id not in images:
+            raise ReferenceError(f"Reference image {ref_id} of image {key} is not loaded")
+
+        group = (ref_id, self._dark_ids(key, images), self._dark_ids(ref_id, images))
+        if group not in corrs:
+            darks = [images[_id] for _id in group[1]]
+            ref_darks = [images[_id] for _id in group[2]]
+
+            cache = self.correction_cache
+            corrs[group] = (
+                cache.master_dark(darks, self.dtype, self._data_dir),
+                cache.correction_frame(images[ref_id], ref_darks, self.dtype, self._data_dir),
+            )
+
+        return corrs[group]
+
     def ffc(self):
         _images_in = self._selected_images
+        self.stages.put("raw", _images_in)  # kept, the input of every run
         _images_out = {}
         futures = list()
         self.inc_progress_by(1, status_msg="Flat-field correction ...", reset=True)
@@ -227,6 +626,7 @@ class ImageSet:
             if img._meta.img_type not in ["ref"] and img._meta.wavelength != 0
         )
 
+        corrs = {}  # correction frames of this run by reference and darks
         with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
             for key in _images_in.keys():
                 link = self._link_table[key]
@@ -235,27 +635,19 @@ class ImageSet:
                     # skip reference images
                     continue
 
-                img = deepcopy(_images_in[key])
+                img = _images_in[key].stage_copy()
 
                 if img._meta.wavelength == 0:
                     # skip dark images
                     continue
 
-                dark = _images_in[link["dark_id"]]
                 try:
-                    ref = _images_in[link["ref_id"]]
-                except KeyError:
+                    dark, corr = self._ffc_frames(key, _images_in, corrs)
+                except ReferenceError:
                     return ReferenceError
-                # ref._data = ref._data.astype(np.float32) # TODO: Smooth ref and ref_dark
-                # ref._data = cv.bilateralFilter(ref._data, 15, 75, 75)
 
-                ref_dark_id = self._link_table[link["ref_id"]]["dark_id"]
-                ref_dark = _images_in[ref_dark_id]
-                # ref_dark._data = ref_dark._data.astype(np.float32)
-                # ref_dark._data = cv.bilateralFilter(ref_dark._data, 15, 75, 75)
-
-                # ffc: (img - dark) / (ref - ref_dark) * m
-                future = executor.submit(img.do_ffc, dark, ref, ref_dark)
+                # ffc: (img - dark) * corr, corr = 0.5 / (ref - ref_dark)
+                future = executor.submit(img.do_ffc, dark, corr)
                 future.add_done_callback(
                     lambda event, progress=(100 / N): self.inc_progress_by(progress)
                 )
@@ -266,10 +658,67 @@ class ImageSet:
         for future in futures:
             future.result()
 
-        self.imgs_post_ffc = _images_out
+        self.stages.put("ffc", _images_out)
+
+    def ffc_refl_cal(self, workers=4):
+        """Flat-field correction and reflectance calibration in one pass, as
+        `ffc` followed by `refl_cal`.
+
+        The measurement images with the same dark and reference are stacked
+        and corrected in place together (see `correction.ffc_refl_cal`). The
+        flat-field corrected images are not kept.
+
+        Returns:
+            ReferenceError if a dark or reference image is not loaded, as `ffc`.
+        """
+
+        _images_in = self._selected_images
+        self.stages.put("raw", _images_in)
+        self.inc_progress_by(1, status_msg="Flat-field correction ...", reset=True)
+
+        # measurement images by dark and correction frame
+        groups = {}
+        corrs = {}
+        for key, img in _images_in.items():
+            link = self._link_table[key]
+            if "ref_id" not in link or img._meta.wavelength == 0:
+                continue  # reference and dark images
+
+            try:
+                dark, corr = self._ffc_frames(key, _images_in, corrs)
+            except ReferenceError:
+                return ReferenceError
+            groups.setdefault((id(dark), id(corr)), (dark, corr, []))[2].append(key)
+
+        _images_out = {}
+        for dark, corr, keys in groups.values():
+            frames = [_images_in[key]._data for key in keys]
+            stack = np.empty((len(frames),) + frames[0].shape, dtype=self.dtype)
+            for i, frame in enumerate(frames):
+                stack[i] = frame
+
+            ffc_refl_cal(
+                stack,
+                dark,
+                corr,
+                [_images_in[key]._meta.ROI for key in keys],
+                workers=workers,
+            )
+
+            for i, key in enumerate(keys):
+                img = _images_in[key].stage_copy()
+                img._data = stack[i]
+                _images_out[key] = img
+
+            self.inc_progress_by(100 * len(keys) / max(len(_images_in), 1))
+
+        # in the order of the selection, as `ffc` and `refl_cal`
+        _images_out = {key: _images_out[key] for key in _images_in if key in _images_out}
+
+        self.stages.put("refl_cal", _images_out, superseded=["ffc"])
 
     def refl_cal(self):
-        _images_in = deepcopy(self.imgs_post_ffc)
+        _images_in = {key: img.stage_copy() for key, img in self.imgs_post_ffc.items()}
         _images_out = {}
         print("performing reflectance calibration")
         futures = list()
@@ -289,17 +738,19 @@ class ImageSet:
         for future in futures:
             future.result()
 
-        self.imgs_post_refl_cal = _images_out
+        self.stages.put("refl_cal", _images_out, superseded=["ffc"])
 
     def undistort(self, path):
-        if hasattr(self, "imgs_post_refl_cal"):
-            _images_in = deepcopy(self.imgs_post_refl_cal)
-        elif hasattr(self, "imgs_post_ffc"):
-            _images_in = deepcopy(self.imgs_post_ffc)
+        if "refl_cal" in self.stages:
+            source = "refl_cal"
+        elif "ffc" in self.stages:
+            source = "ffc"
         else:
             print("No images to undistort.")
             return
 
+        _images_in = {key: img.stage_copy() for key, img in self.stages[source].items()}
+
         _images_out = {}
         futures = list()
         self.inc_progress_by(1, status_msg="Removing image distortion ...", reset=True)
@@ -308,7 +759,7 @@ class ImageSet:
             for key, img in _images_in.items():
                 # img = deepcopy(self._tmp[key])
 
-                future = executor.submit(lambda path=path: img.do_undistort(path))
+                future = executor.submit(img.do_undistort, path)
                 future.add_done_callback(
                     lambda event, progress=(100 / N): self.inc_progress_by(progress)
                 )
@@ -319,15 +770,13 @@ class ImageSet:
         for future in futures:
             future.result()
 
-        self.imgs_post_undistort = _images_out
+        self.stages.put("undistort", _images_out, superseded=[source])
 
     def stitching(self):
-        if hasattr(self, "imgs_post_undistort"):
-            imgs = self.imgs_post_undistort
-        elif hasattr(self, "imgs_post_refl_cal"):
-            imgs = self.imgs_post_refl_cal
-        elif hasattr(self, "imgs_post_ffc"):
-            imgs = self.imgs_post_ffc
+        for source in ["undistort", "refl_cal", "ffc"]:
+            if source in self.stages:
+                imgs = self.stages[source]
+                break
         else:
             print("No images to stitch.")
             return
@@ -335,7 +784,7 @@ class ImageSet:
         imgs = pro.coords_mm_to_pix(imgs)
         sorted_images = pro.image_sorting(imgs)  #
 
-        self.stitched_image = {}
+        stitched_images = {}
 
         futures = {}
         self.inc_progress_by(1, status_msg="Stitching images ...", reset=True)
@@ -365,39 +814,233 @@ class ImageSet:
             _grp, _img_type = __tmp
             image, meta, exif = future.result()
 
-            wavelengths = set()
-            px2mms = set()
-            for _meta in meta:
-                # key = _meta[0]
-                _meta[1]["filepath"] = str(_meta[1]["filepath"])
-                wavelengths.add(_meta[1]["wavelength"])
-                px2mms.add(_meta[1]["px_2_mm"])
+            stitched_images[_img_type] = self._stitched_image(
+                _img_type, image, meta, exif
+            )
 
-            if len(wavelengths) > 1:
-                print("Error: multiple wavelengths in stitched image.")
-            else:
-                wavelength = next(iter(wavelengths))
-            if len(px2mms) > 1:
-                print("Error: multiple px2mm in stitched image.")
-            else:
-                px2mm = next(iter(px2mms))
+        self.stages.put("stitched", stitched_images, superseded=[source])
 
-            stitched_image = Image()
-            stitched_image._data = image
-            stitched_image._meta = StitchedMetadata
-            stitched_image._meta["img_type"] = _img_type
-            stitched_image._meta["px_2_mm"] = px2mm
-            stitched_image._meta["wavelength"] = wavelength
+        # TODO: add group [_img_type][_grp] for optional col-major or row-major blending
+        # TODO: If col/row-major blending perform here
 
-            stitched_image._meta["orig_meta"] = deepcopy(meta)
+    def _stitched_image(self, _img_type, image, meta, exif):
+        """The stitched image of type `_img_type` blended from the images with
+        metadata `meta` and EXIF `exif` ((key, value) lists)."""
 
-            stitched_image._exif = exif
+        wavelengths = set()
+        px2mms = set()
+        for _meta in meta:
+            # key = _meta[0]
+            _meta[1]["filepath"] = str(_meta[1]["filepath"])
+            wavelengths.add(_meta[1]["wavelength"])
+            px2mms.add(_meta[1]["px_2_mm"])
 
-            self.stitched_image[_img_type] = deepcopy(stitched_image)
-            del stitched_image
+        if len(wavelengths) > 1:
+            print("Error: multiple wavelengths in stitched image.")
+        else:
+            wavelength = next(iter(wavelengths))
+        if len(px2mms) > 1:
+            print("Error: multiple px2mm in stitched image.")
+        else:
+            px2mm = next(iter(px2mms))
+
+        stitched_image = Image(dtype=self.dtype)
+        stitched_image._data = image.astype(self.dtype, copy=False)
+        stitched_image._meta = deepcopy(StitchedMetadata)
+        stitched_image._meta["img_type"] = _img_type
+        stitched_image._meta["px_2_mm"] = px2mm
+        stitched_image._meta["wavelength"] = wavelength
+
+        stitched_image._meta["orig_meta"] = deepcopy(meta)
+
+        stitched_image._exif = exif
+
+        return stitched_image
+
+    def process_streaming(
+        self,
+        list_of_idx,
+        undistort=True,
+        stitch=True,
+        keep=False,
+        max_in_flight=8,
+        workers=None,
+    ):
+        """Load and process the images `list_of_idx` image by image.
+
+        Every measurement image is loaded, flat-field corrected, calibrated
+        and undistorted as soon as its dark and reference images are loaded,
+        without waiting for the other images, and blended into the stitched
+        image of its type when it is done (in the order of `list_of_idx`, as
+        by `stitching`). At most `max_in_flight` images are processed or wait
+        to be blended at a time, which bounds the memory.
+
+        The raw data of a measurement image is corrected in place and released
+        whatever the stage policy. The processed images are kept in the stages
+        only with `keep`, or without `stitch`; otherwise only the dark,
+        reference and stitched images stay in memory.
 
-        # TODO: add group [_img_type][_grp] for optional col-major or row-major blending
-        # TODO: If col/row-major blending perform here
+        Args:
+            undistort (bool): Remove the lens distortion.
+            stitch (bool): Blend the images into stitched images.
+            keep (bool): Keep the processed images.
+            max_in_flight (int): Images in memory besides darks and references.
+            workers (int, optional): Threads, `load_workers` (or 10) by default.
+        """
+
+        self.reset()
+        self._selected_images = {}
+        self._shared_frames.release()  # blocks of the previous selection
+
+        infos = self.validate_images(list_of_idx)
+
+        metas = {i: self._image_db[i] for i in list_of_idx}
+        for i in list_of_idx:
+            img = Image(dtype=self.dtype)
+            img._meta = metas[i]
+            self._selected_images[i] = img
+
+        # measurement images (as corrected by `ffc`), the rest are loaded first
+        frames = [
+            i
+            for i in list_of_idx
+            if "ref_id" in self._link_table.get(i, {}) and metas[i].wavelength != 0
+        ]
+        calibration = [i for i in list_of_idx if i not in frames]
+
+        # images each frame waits for
+        deps = {}
+        for key in frames:
+            ref_id = self._link_table[key]["ref_id"]
+            if ref_id not in self._selected_images:
+                raise ReferenceError(f"Reference image {ref_id} of image {key} is not loaded")
+            deps[key] = {
+                ref_id,
+                *self._dark_ids(key, self._selected_images),
+                *self._dark_ids(ref_id, self._selected_images),
+            }
+
+        if stitch:
+            # positions from the probed sizes, before any image is loaded
+            sizes = {key: infos[key]["shape"][1::-1] for key in frames}
+            positions = pro.image_positions(
+                {key: (metas[key], list(sizes[key])) for key in frames}
+            )
+
+        keep = keep or not stitch
+        corrs = {}
+        corrs_lock = threading.Lock()
+        loads = {}
+
+        def _load(key):
+            img = self._selected_images[key]
+            img.load_from(img._meta, self._data_dir, index=self.metadata_index)
+
+        def _process(key):
+            _load(key)
+            for _id in deps[key]:
+                loads[_id].result()
+
+            with corrs_lock:
+                dark, corr = self._ffc_frames(key, self._selected_images, corrs)
+
+            raw = self._selected_images[key]
+            img = raw.stage_copy()
+            img._data = raw._data  # corrected in place, not needed any more
+            raw._data = None
+            img.do_ffc_refl_cal(dark, corr)
+            if undistort:
+                img.do_undistort(None)  # calibration file by serial number
+
+            return img
+
+        blenders = {}  # img_type -> (LaplPyrBlender, meta, exif)
+        _images_out = {}
+
+        def _blend(key, img):
+            _img_type = img._meta.img_type
+            if _img_type not in blenders:
+                blenders[_img_type] = (
+                    pro.LaplPyrBlender(self.overlap_x, self.overlap_y),
+                    [],
+                    [],
+                )
+            blender, meta, exif = blenders[_img_type]
+
+            if list(pro.get_img_size(img)) != list(sizes[key]):
+                raise ValueError(
+                    f"Image {key} has size {pro.get_img_size(img)}, "
+                    f"not {list(sizes[key])} as probed"
+                )
+
+            meta.append((key, img._meta.to_dict()))
+            exif.append((key, img._exif))
+
+            gray = img.stage_copy()
+            if gray._data.ndim == 3:
+                gray._data = np.mean(gray._data, axis=2)
+            gray._pos = positions[key]
+            blender.add(gray)
+
+        self.inc_progress_by(1, status_msg="Processing images ...", reset=True)
+        N = max(len(frames), 1)
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or self.load_workers or 10
+        ) as executor:
+            for key in calibration:
+                loads[key] = executor.submit(_load, key)
+
+            futures = {}  # submitted frame -> future
+            done = {}  # processed frames waiting for the earlier ones
+            submitted = blended = 0
+
+            while blended < len(frames):
+                while submitted < len(frames) and submitted - blended < max_in_flight:
+                    key = frames[submitted]
+                    futures[key] = executor.submit(_process, key)
+                    submitted += 1
+
+                pending = [f for k, f in futures.items() if k not in done]
+                finished, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for key, future in list(futures.items()):
+                    if future in finished:
+                        done[key] = future.result()
+
+                # in the order of the selection
+                while blended < submitted and frames[blended] in done:
+                    key = frames[blended]
+                    img = done.pop(key)
+                    del futures[key]
+
+                    if stitch:
+                        _blend(key, img)
+                    if keep:
+                        _images_out[key] = img
+                    del self._selected_images[key]  # without raw data
+
+                    blended += 1
+                    self.inc_progress_by(100 / N)
+
+            for future in loads.values():
+                future.result()  # catch exceptions
+
+        self.stages.put("raw", self._selected_images)
+        if keep:
+            self.stages.put("undistort" if undistort else "refl_cal", _images_out)
+
+        if stitch:
+            stitched_images = {}
+            for _img_type in pro.image_sorting({}):  # in the order of `stitching`
+                if _img_type in blenders:
+                    blender, meta, exif = blenders[_img_type]
+                    stitched_images[_img_type] = self._stitched_image(
+                        _img_type, blender.image, meta, exif
+                    )
+
+            self.stages.put("stitched", stitched_images)
 
     def save_as_h5(self, folder=None):
         for key, img in self.stitched_image.items():
@@ -408,18 +1051,36 @@ class ImageSet:
 
 
 class Image:
-    def __init__(self) -> None:
+    def __init__(self, dtype=DEFAULT_DTYPE) -> None:
         self._uid: int
         self._data: Union[np.ndarray, None]
         self._meta: Union[ImageMetadata, dict]
         self._exif = None
 
-    def load_from(self, _from, _dir=None, preview=False):
+        # precision of the image data, kept by all processing steps
+        self.dtype = np.dtype(dtype)
+
+    def stage_copy(self):
+        """Copy for the next processing stage.
+
+        Metadata and EXIF are shared, the data is shared as a read-only view:
+        the processing steps assign new arrays to `_data`, writing into the
+        data of the previous stage raises instead.
+        """
+
+        img = copy(self)
+        if isinstance(self._data, np.ndarray):
+            img._data = self._data.view()
+            img._data.flags.writeable = False
+
+        return img
+
+    def load_from(self, _from, _dir=None, preview=False, index=None):
         if isinstance(_from, Path):
             fp = _from
         elif isinstance(_from, str):
             fp = Path(_from)
-        elif isinstance(_from, ImageMetadata):
+        elif isinstance(_from, (ImageMetadata, MetadataRow)):
             fp = _from.filepath
             self._meta = _from
         else:
@@ -432,27 +1093,42 @@ class Image:
 
         logging.getLogger(logger).info(f"Loading image {fp}")
 
+        data = None
         if preview:
-            self._data, self._exif = pro.load_preview(fp)
-        else:
-            self._data, self._exif = pro.load_image(fp)
+            # strided decode, `preview` is the subsampling unless True
+            shrink = pro.PREVIEW_SHRINK if preview is True else int(preview)
+            data, self._exif = pro.load_preview(fp, shrink=shrink)
+        if data is None:  # full decode, or no preview decoder for the format
+            data, self._exif = pro.load_image(fp, index=index)
 
-    def do_ffc(self, dark, ref, ref_dark):
-        img = self._data
-        dark = dark._data
-        ref = ref._data
-        ref_dark = ref_dark._data
+        self._data = data.astype(self.dtype, copy=False)
 
-        _img = img - dark
-        _ref = ref - ref_dark
-        _ref[_ref == 0] = 1e-10
-        _img = _img / _ref * 0.5
+    def do_ffc(self, dark, corr):
+        """Flat-field correction with the (master) `dark` and the correction
+        frame `corr` of the reference (see `CorrectionCache`)."""
 
-        _img[_img > 1.25] = 1.25
-        _img[_img < -0.25] = -0.25
+        _img = np.subtract(self._data, dark, dtype=self.dtype)
+        np.multiply(_img, corr, out=_img)
+        np.clip(_img, *FFC_CLIP, out=_img)
 
         self._data = _img
 
+    def do_ffc_refl_cal(self, dark, corr):
+        """`do_ffc` and `do_refl_cal` in one pass (see `correction.ffc_refl_cal`),
+        in place unless the data is read-only (shared with another stage)."""
+
+        data = self._data
+        if not (
+            data.dtype == self.dtype
+            and data.flags.writeable
+            and data.flags.c_contiguous
+        ):
+            data = np.array(data, dtype=self.dtype)
+
+        ffc_refl_cal(data[None], dark, corr, [self._meta.ROI], workers=1)
+
+        self._data = data
+
     def do_refl_cal(self):
         img = self._data
         meta = self._meta
@@ -464,24 +1140,13 @@ class Image:
         # TODO: auto-check average values and raise error if the channels are not the same
         # TODO: Average if they are
 
-        # per channel mean of averages (i.e. averaging targets)
-        mean_gray = np.nanmean(avs_gray, axis=0)
-        mean_white = np.nanmean(avs_white, axis=0)
-
         logging.info(
-            f"image {meta.ID} with wavelength {meta.wavelength} has avs_gray: {mean_gray} and avs_white: {mean_white}"
+            f"image {meta.ID} with wavelength {meta.wavelength} has "
+            f"avs_gray: {np.nanmean(avs_gray, axis=0)} and "
+            f"avs_white: {np.nanmean(avs_white, axis=0)}"
         )
 
-        m1 = (0.94 - 0.498) / (mean_white - mean_gray)
-        m2 = (0.94 - 0.000) / (mean_white - 0)
-        m3 = (0.498 - 0.00) / (mean_gray - 0)
-
-        m = (3 * m1 + m2 + m3) / 5  # bias towards m1
-
-        b1 = 0.94 - (m * mean_white)
-        b2 = 0.498 - (m * mean_gray)
-
-        b = (b1 + b2) / 2
+        m, b = refl_cal_coefficients(avs_gray, avs_white, self.dtype)
 
         img = m * img + b
 
@@ -490,7 +1155,7 @@ class Image:
         self._data = img
 
     def do_undistort(self, path):
-        img = self._data
+        img = self._data.astype(self.dtype, copy=False)
         meta = self._meta
 
         sn = pro.get_sn(self._exif)
@@ -545,7 +1210,7 @@ class Image:
                 print("image is 2d")
                 _tmp = post.unwarp_image_backward(
                     img, xcenter, ycenter, np.array(factors)
-                )
+                ).astype(self.dtype, copy=False)
 
             print(f"rotating image by {rot} degrees.")
             _tmp = ndimage.rotate(_tmp, angle=rot, reshape=False, mode="nearest")
@@ -656,32 +1321,7 @@ class Image:
 
             logging.info(f"serial number is {sn}.")
 
-            if sn in ["snowimager-01"]:
-                aux_data = {
-                    "timestamp": exif["metadata"]["timestamp"],
-                    "timezone": exif["metadata"]["timezone"],
-                    "longitude": "",
-                    "latitude": "",
-                    "software_version": exif["metadata"]["software_version"],
-                    "wavelength": exif["metadata"]["wavelength"],
-                    "board_temperature_electronics_side": "",
-                    "board_temperature_led_side": "",
-                }
-            elif sn in ["snowimager-06", "snowimager-07"]:
-                aux_data = {
-                    "timestamp": str(exif["Image DateTimeOriginal"]),
-                    "timezone": "UTC",
-                    "longitude": exif["metadata"]["longitude"],
-                    "latitude": exif["metadata"]["latitude"],
-                    "software_version": exif["metadata"]["software_version"],
-                    "wavelength": exif["metadata"]["wavelength"],
-                    "board_temperature_electronics_side": exif["metadata"][
-                        "temperatures"
-                    ]["board_temperature_electronics_side"],
-                    "board_temperature_led_side": exif["metadata"]["temperatures"][
-                        "board_temperature_led_side"
-                    ],
-                }
+            aux_data = pro.get_aux_data(exif)
 
             with h5py.File(output_file, "a") as f:
                 images_grp = f.require_group("SnowImage(s)")